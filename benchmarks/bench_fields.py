@@ -0,0 +1,51 @@
+from .common import *
+from .common import synthetic_fields, synthetic_state
+
+
+class FieldsSuite(object):
+    params = FIELD_GRID_SIZES
+    param_names = ['n_fields']
+
+    def setup(self, n_fields):
+        self.fields = synthetic_fields(n_fields)
+        self.state = synthetic_state()
+
+    def time_overhead_time(self, n_fields):
+        self.fields.overhead_time(self.state)
+
+    def time_compute_blocks(self, n_fields):
+        # force recomputation
+        self.fields.current_block_night_mjd = None
+        self.fields.compute_blocks(self.state['current_time'])
+
+    def time_select_fields(self, n_fields):
+        self.fields.select_fields(dec_range=[-30, 90], abs_b_range=[20, 90],
+                                  grid_id=0)
+
+    def time_select_fields_by_history(self, n_fields):
+        self.fields.select_fields(program_id=1, filter_id=2,
+                                  n_obs_range=[0, 10],
+                                  last_observed_range=[0., 60000.])
+
+
+class FieldsScalingSuite(object):
+    """Field grid operations on grids much denser than the ZTF grid."""
+
+    params = (FIELD_GRID_SCALING_SIZES, [1, 2])
+    param_names = ['n_fields', 'n_grids']
+    timeout = 600
+
+    def setup(self, n_fields, n_grids):
+        self.fields = synthetic_fields(n_fields, n_grids)
+        self.state = synthetic_state()
+
+    def time_compute_blocks(self, n_fields, n_grids):
+        self.fields.current_block_night_mjd = None
+        self.fields.compute_blocks(self.state['current_time'])
+
+    def peakmem_compute_blocks(self, n_fields, n_grids):
+        self.fields.current_block_night_mjd = None
+        self.fields.compute_blocks(self.state['current_time'])
+
+    def time_overhead_time(self, n_fields, n_grids):
+        self.fields.overhead_time(self.state)
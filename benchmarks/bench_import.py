@@ -0,0 +1,27 @@
+from .common import ZTF_SIM_DIR
+
+
+class ImportSuite(object):
+    """Time to import each module in a fresh interpreter, as paid by every
+    run and every worker process of a sweep."""
+
+    params = ['constants', 'utils', 'magnitudes', 'sky_brightness',
+              'fields', 'QueueManager', 'ZTFStateMachine', 'ObsLogger',
+              'observe']
+    param_names = ['module']
+    timeout = 120
+
+    def timeraw_import(self, module):
+        # numpy, pandas, and astropy are imported by every module, so they
+        # are loaded in the untimed setup
+        setup = """
+import os
+import sys
+sys.path.insert(0, {0!r})
+os.chdir({0!r})
+import numpy
+import pandas
+import astropy.units
+import astropy.coordinates
+""".format(ZTF_SIM_DIR)
+        return 'import {}'.format(module), setup
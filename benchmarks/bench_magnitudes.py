@@ -0,0 +1,26 @@
+from .common import *
+
+
+class LimitingMagSuite(object):
+    params = [1000, 100000]
+    param_names = ['n']
+
+    def setup(self, n):
+        # Series, as in GreedyQueueManager._update_queue
+        rng = np.random.RandomState(0)
+        self.seeing = pd.Series(rng.uniform(1.5, 4., n))
+        self.sky = pd.Series(rng.uniform(17., 21.5, n))
+        self.altitude = pd.Series(rng.uniform(20., 90., n))
+        self.filter_id = pd.Series(rng.choice([1, 2], n))
+
+    def time_limiting_mag(self, n):
+        from magnitudes import limiting_mag
+        limiting_mag(EXPOSURE_TIME, self.seeing, self.sky,
+                     filter_id=self.filter_id, altitude=self.altitude,
+                     SNR=5.)
+
+    def time_limiting_mag_kernel(self, n):
+        from magnitudes import get_limiting_mag_kernel
+        get_limiting_mag_kernel().limiting_mag(
+            EXPOSURE_TIME.value, self.seeing.values, self.sky.values,
+            self.filter_id.values, self.altitude.values, SNR=5.)
@@ -0,0 +1,82 @@
+import glob
+import json
+from .common import *
+from .common import synthetic_fields
+
+RUN_NAME = 'benchmark_one_night'
+
+
+def write_one_night_config():
+    with open('../sims/test_config.json', 'r') as f:
+        config = json.load(f)
+    config['run_name'] = RUN_NAME
+    config['start_time'] = '2018-03-20 02:30:00'
+    config['weather_year'] = None
+    config['survey_duration_days'] = 1.0
+    with open('../sims/{}.json'.format(RUN_NAME), 'w') as f:
+        json.dump(config, f)
+
+
+def one_night_shared_objects(n_fields, n_grids=1):
+    from sky_brightness import FakeSkyBrightness
+    return {'fields': synthetic_fields(n_fields, n_grids),
+            'sky': FakeSkyBrightness(),
+            'observability': None,
+            'ephemeris': None,
+            'calendar': None}
+
+
+def remove_one_night_outputs():
+    for filename in glob.glob('../sims/{}*'.format(RUN_NAME)):
+        os.remove(filename)
+
+
+def observe_one_night(shared):
+    from observe import observe
+    observe('{}.json'.format(RUN_NAME), raise_queue_empty=False,
+            shared=shared)
+
+
+class ObserveSuite(object):
+    """A full one-night simulation on a synthetic field grid, with fake
+    sky brightness and no historical weather."""
+
+    params = FIELD_GRID_SIZES
+    param_names = ['n_fields']
+    timeout = 1800
+    number = 1
+    repeat = 1
+
+    def setup(self, n_fields):
+        write_one_night_config()
+        self.shared = one_night_shared_objects(n_fields)
+
+    def teardown(self, n_fields):
+        remove_one_night_outputs()
+
+    def time_observe_one_night(self, n_fields):
+        observe_one_night(self.shared)
+
+
+class ObserveScalingSuite(object):
+    """Time and peak memory of one simulated night against field grid
+    size."""
+
+    params = (FIELD_GRID_SCALING_SIZES, [1, 2])
+    param_names = ['n_fields', 'n_grids']
+    timeout = 7200
+    number = 1
+    repeat = 1
+
+    def setup(self, n_fields, n_grids):
+        write_one_night_config()
+        self.shared = one_night_shared_objects(n_fields, n_grids)
+
+    def teardown(self, n_fields, n_grids):
+        remove_one_night_outputs()
+
+    def time_observe_one_night(self, n_fields, n_grids):
+        observe_one_night(self.shared)
+
+    def peakmem_observe_one_night(self, n_fields, n_grids):
+        observe_one_night(self.shared)
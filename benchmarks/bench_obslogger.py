@@ -0,0 +1,44 @@
+from .common import *
+from .common import synthetic_fields, synthetic_state, NullWriter
+
+
+class ObsLoggerSuite(object):
+    params = [100, 1000]
+    param_names = ['n_pointings']
+
+    def setup(self, n_pointings):
+        from ObsLogger import ObsLogger
+        self.fields = synthetic_fields(1000)
+        self.log = ObsLogger('benchmark', BENCHMARK_TIME,
+                             flush_every=n_pointings + 1,
+                             writer=NullWriter(), fields=self.fields)
+        rng = np.random.RandomState(0)
+        grid = self.fields.field_grid
+        self.states = []
+        self.requests = []
+        for i in range(n_pointings):
+            self.states.append(synthetic_state(
+                time=BENCHMARK_TIME + i * 40. * u.second))
+            j = rng.randint(len(grid))
+            self.requests.append(
+                {'target_program_id': 1,
+                 'target_field_id': grid.index[j],
+                 'target_ra': grid['ra'].values[j],
+                 'target_dec': grid['dec'].values[j],
+                 'target_filter_id': 2,
+                 'target_exposure_time': EXPOSURE_TIME,
+                 'target_sky_brightness': 20.,
+                 'target_limiting_mag': 20.5,
+                 'target_request_number_tonight': 1,
+                 'target_total_requests_tonight': 2,
+                 'target_metric_value': 1.})
+
+    def time_log_pointing(self, n_pointings):
+        for state, request in zip(self.states, self.requests):
+            self.log.log_pointing(state, request)
+        self.log.records = []
+
+    def time_log_pointing_and_flush(self, n_pointings):
+        for state, request in zip(self.states, self.requests):
+            self.log.log_pointing(state, request)
+        self.log.flush()
@@ -0,0 +1,87 @@
+from .common import *
+from .common import (synthetic_fields, synthetic_state,
+                     synthetic_queue_manager, add_synthetic_requests)
+
+
+class QueueSuite(object):
+    params = [FIELD_GRID_SIZES, POOL_SIZES]
+    param_names = ['n_fields', 'n_requests']
+
+    def setup(self, n_fields, n_requests):
+        self.Q = synthetic_queue_manager(n_fields, n_requests)
+        self.state = synthetic_state()
+        # build the queue once so next_obs only updates overheads
+        self.Q.next_obs(self.state)
+
+    def time_update_queue(self, n_fields, n_requests):
+        self.Q._update_queue(self.state)
+
+    def time_next_obs(self, n_fields, n_requests):
+        self.Q.next_obs(self.state)
+
+    def time_next_obs_and_remove(self, n_fields, n_requests):
+        next_obs = self.Q.next_obs(self.state)
+        self.Q.fields.mark_field_observed(next_obs, self.state)
+        self.Q.remove_requests(next_obs['request_id'])
+
+
+class BlockSkySuite(object):
+    """Queue rebuilds from tonight's precomputed sky brightness and
+    limiting magnitude cubes."""
+
+    params = [FIELD_GRID_SIZES, POOL_SIZES]
+    param_names = ['n_fields', 'n_requests']
+
+    def setup(self, n_fields, n_requests):
+        self.Q = synthetic_queue_manager(n_fields, n_requests)
+        self.Q.precompute_sky = True
+        self.state = synthetic_state()
+        self.Q.fields.compute_blocks(self.state['current_time'])
+        self.Q._compute_block_sky(self.state)
+
+    def time_compute_block_sky(self, n_fields, n_requests):
+        self.Q._compute_block_sky(self.state)
+
+    def time_update_queue(self, n_fields, n_requests):
+        self.Q._update_queue(self.state)
+
+
+class RequestPoolSuite(object):
+    params = [FIELD_GRID_SIZES, POOL_SIZES]
+    param_names = ['n_fields', 'n_requests']
+
+    def setup(self, n_fields, n_requests):
+        from QueueManager import RequestPool
+        self.fields = synthetic_fields(n_fields)
+        self.rp = RequestPool()
+
+    def time_add_requests(self, n_fields, n_requests):
+        self.rp.clear_all_requests()
+        add_synthetic_requests(self.rp, self.fields, n_requests)
+
+
+class ObservingProgramSuite(object):
+    params = FIELD_GRID_SIZES
+    param_names = ['n_fields']
+
+    def setup(self, n_fields):
+        from ObservingProgram import ObservingProgram
+        self.fields = synthetic_fields(n_fields)
+        self.time = synthetic_state()['current_time']
+        field_ids = self.fields.select_field_ids(dec_range=[-30, 90])
+        self.programs = [
+            ObservingProgram(1, 'all_sky', 0.4, field_ids, [1, 2, 2, 1],
+                             1 * u.day, 4, 60 * u.min, 20 * u.min,
+                             nightly_priority='mean_observable_airmass',
+                             filter_choice='sequence'),
+            ObservingProgram(2, 'all_sky', 0.4, field_ids, [1, 2],
+                             3 * u.day, 2, 60 * u.min, 20 * u.min,
+                             nightly_priority='oldest',
+                             filter_choice='rotate')]
+        # compute tonight's blocks outside of the timing
+        self.fields.compute_blocks(self.time)
+
+    def time_assign_nightly_requests(self, n_fields):
+        for program in self.programs:
+            program.assign_nightly_requests(self.time, self.fields,
+                                            block_programs=False)
@@ -0,0 +1,24 @@
+from .common import *
+
+
+class SkyTableSuite(object):
+    """Multilinear interpolation in a sky brightness table with the
+    default grid (filled with random values, so no trained model is
+    needed)."""
+
+    params = [300, 10000]
+    param_names = ['n_rows']
+
+    def setup(self, n_rows):
+        from sky_brightness import SKY_MODEL_FEATURES, SKY_TABLE_GRID
+        rng = np.random.RandomState(0)
+        self.axes = [np.linspace(*SKY_TABLE_GRID[f])
+                     for f in SKY_MODEL_FEATURES]
+        self.table = rng.uniform(17., 21.5, [len(a) for a in self.axes]
+                                 ).astype(np.float32)
+        self.points = np.array([rng.uniform(a[0], a[-1], n_rows)
+                                for a in self.axes]).T
+
+    def time_multilinear_interp(self, n_rows):
+        from sky_brightness import multilinear_interp
+        multilinear_interp(self.axes, self.table, self.points)
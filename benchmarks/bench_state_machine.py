@@ -0,0 +1,35 @@
+import astropy.coordinates as coord
+from .common import *
+
+
+class StateMachineSuite(object):
+    """Telescope state machine transitions, as in one pass of the
+    observe() loop."""
+
+    params = ['transitions', 'native']
+    param_names = ['state_machine']
+
+    def setup(self, state_machine):
+        from ZTFStateMachine import ZTFStateMachine
+        self.tel = ZTFStateMachine(current_time=BENCHMARK_TIME,
+                                   historical_observability_year=None,
+                                   logfile='/dev/null',
+                                   state_machine=state_machine)
+        self.target = coord.SkyCoord(150. * u.deg, 40. * u.deg)
+
+    def time_current_state_dict(self, state_machine):
+        self.tel.current_state_dict()
+
+    def time_wait(self, state_machine):
+        self.tel.wait()
+
+    def time_observe_cycle(self, state_machine):
+        self.tel.current_time = BENCHMARK_TIME
+        self.tel.set_cant_observe()
+        self.tel.check_if_ready()
+        self.tel.start_slew(self.target)
+        self.tel.start_exposing()
+        self.tel.current_state_dict()
+
+    def time_set_cant_observe(self, state_machine):
+        self.tel.set_cant_observe()
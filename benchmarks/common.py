@@ -0,0 +1,100 @@
+"""Synthetic fixtures shared by the benchmarks.
+
+The ztf_sim modules use implicit relative imports and paths relative to
+the ztf_sim directory, so the benchmarks import them from the source
+tree with that directory as the working directory.  Run with, e.g.,
+    asv run --python=same
+    asv dev"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+ZTF_SIM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
+                                           'ztf_sim'))
+if ZTF_SIM_DIR not in sys.path:
+    sys.path.insert(0, ZTF_SIM_DIR)
+os.chdir(ZTF_SIM_DIR)
+
+import astropy.units as u
+from astropy.time import Time
+from constants import *
+
+# a dark time near the spring equinox
+BENCHMARK_TIME = Time('2018-03-20 06:00:00', scale='utc', location=P48_loc)
+
+FIELD_GRID_SIZES = [1000, 4000]
+# the ZTF grid has about 1800 fields north of -30 degrees
+FIELD_GRID_SCALING_SIZES = [1800, 10000, 30000, 100000]
+POOL_SIZES = [1000, 10000]
+
+
+def synthetic_field_grid(n_fields, n_grids=1):
+    """Tessellated field grid of about n_fields fields per grid."""
+    from fields import generate_tessellated_field_grid
+    return generate_tessellated_field_grid(n_fields, n_grids=n_grids)
+
+
+def synthetic_fields(n_fields, n_grids=1):
+    from fields import Fields
+    return Fields(dbname='synthetic_{}_{}'.format(n_fields, n_grids),
+                  field_grid=synthetic_field_grid(n_fields, n_grids))
+
+
+def synthetic_state(time=BENCHMARK_TIME, filter_id=2):
+    """Telescope state dictionary, as from ZTFStateMachine."""
+    return {'current_time': time,
+            'current_ha': 0. * u.deg,
+            'current_dec': 33.36 * u.deg,
+            'current_domeaz': 180. * u.deg,
+            'current_filter_id': filter_id,
+            'current_zenith_seeing': 2.0 * u.arcsec,
+            'filters': FILTER_IDS,
+            'target_skycoord': None}
+
+
+def add_synthetic_requests(rp, fields, n_requests):
+    """Fill a RequestPool with n_requests requests, cycling over fields,
+    programs, and filters.  Half have a time_since_obs cadence."""
+
+    field_ids = fields.field_grid.index.values
+    program_ids = sorted(PROGRAM_IDS)
+    filter_ids = sorted(FILTER_IDS)
+    cadences = [('no_cadence', {}),
+                ('time_since_obs', {'ref_obs': 'last_observed',
+                                    'window_start': 1.,
+                                    'window_stop': 36500.,
+                                    'prev_filter': 'any'})]
+
+    n_sets = len(program_ids) * len(filter_ids) * len(cadences)
+    per_set = int(np.ceil(n_requests / float(n_sets)))
+    i = 0
+    for program_id in program_ids:
+        for filter_id in filter_ids:
+            for cadence_func, cadence_pars in cadences:
+                ids = np.take(field_ids, np.arange(i, i + per_set),
+                              mode='wrap')
+                rp.add_requests(program_id, ids, filter_id, cadence_func,
+                                cadence_pars, 1, 2)
+                i += per_set
+
+
+def synthetic_queue_manager(n_fields, n_requests):
+    from QueueManager import GreedyQueueManager
+    from sky_brightness import FakeSkyBrightness
+    fields = synthetic_fields(n_fields)
+    Q = GreedyQueueManager(observing_programs=[], fields=fields,
+                           block_programs=False, sky=FakeSkyBrightness())
+    add_synthetic_requests(Q.rp, fields, n_requests)
+    return Q
+
+
+class NullWriter(object):
+    """ObsLogger writer that discards the pointings."""
+
+    def write(self, df):
+        pass
+
+    def close(self):
+        pass
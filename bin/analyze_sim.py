@@ -18,7 +18,7 @@ from ztf_sim.utils import *
 
 def calc_stats(sim_name):
 
-    df = df_read_from_sqlite(sim_name, tablename='Summary', directory='sims')
+    df = read_pointings(sim_name, directory='../sims')
 
     stats = OrderedDict()
 
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+"""Run a ztf_sim configuration over a parameter grid and random seeds, or
+over all historical weather years.
+
+Run from the ztf_sim directory, e.g.:
+    ../bin/run_sweep.py test_config.json --grid grid.json --seeds 1 2 3
+    ../bin/run_sweep.py test_config.json --weather-ensemble
+
+grid.json maps dotted configuration keys to lists of values, e.g.
+    {"observing_programs.0.n_visits_per_night": [2, 3]}"""
+
+import sys
+import json
+import argparse
+# hack to get the path right
+sys.path.append('.')
+from sweep import run_sweep, run_weather_ensemble
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('config_file',
+                        help='base configuration file in ../sims')
+    parser.add_argument('--grid', default=None,
+                        help='JSON file (in ../sims) of parameter values')
+    parser.add_argument('--seeds', type=int, nargs='*', default=None,
+                        help='random seeds')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes')
+    parser.add_argument('--name', default=None, help='sweep name')
+    parser.add_argument('--weather-ensemble', action='store_true',
+                        help='run every historical weather year instead')
+    args = parser.parse_args()
+
+    if args.weather_ensemble:
+        summary = run_weather_ensemble(args.config_file,
+                                       n_workers=args.workers,
+                                       ensemble_name=args.name)
+        print(summary)
+        sys.exit()
+
+    grid = None
+    if args.grid is not None:
+        with open('../sims/{}'.format(args.grid), 'r') as f:
+            grid = json.load(f)
+
+    index = run_sweep(args.config_file, grid=grid, seeds=args.seeds,
+                      n_workers=args.workers, sweep_name=args.name)
+    print(index[['run_name', 'status', 'wall_time_s', 'n_exposures']])
@@ -0,0 +1,12 @@
+"""The ztf_sim modules use implicit relative imports and paths relative to
+the ztf_sim directory, so the tests import them from the source tree with
+that directory as the working directory."""
+
+import os
+import sys
+
+ZTF_SIM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
+                                           'ztf_sim'))
+if ZTF_SIM_DIR not in sys.path:
+    sys.path.insert(0, ZTF_SIM_DIR)
+os.chdir(ZTF_SIM_DIR)
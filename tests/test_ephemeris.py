@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('astroplan')
+from astropy.time import Time
+
+from ephemeris import (Ephemeris, EPHEMERIS_KEYS, EPHEMERIS_TOLERANCE_DEG,
+                       EPHEMERIS_TOLERANCE_ILLUMINATION)
+
+
+def test_ephemeris_interpolation_accuracy(tmpdir):
+    ephemeris = Ephemeris(Time('2018-03-18', scale='utc'),
+                          Time('2018-03-21', scale='utc'),
+                          directory=str(tmpdir))
+    max_diff = ephemeris.check_accuracy(n=500)
+
+    for key in EPHEMERIS_KEYS:
+        if key == 'moon_illumination':
+            assert max_diff[key] < EPHEMERIS_TOLERANCE_ILLUMINATION
+        else:
+            assert max_diff[key] < EPHEMERIS_TOLERANCE_DEG, key
+
+
+def test_ephemeris_reloads_saved_grid(tmpdir):
+    start = Time('2018-03-18', scale='utc')
+    stop = Time('2018-03-19', scale='utc')
+    computed = Ephemeris(start, stop, directory=str(tmpdir))
+    loaded = Ephemeris(start, stop, directory=str(tmpdir))
+
+    for key in EPHEMERIS_KEYS:
+        assert np.array_equal(computed.data[key], loaded.data[key])
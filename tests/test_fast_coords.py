@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+coord = pytest.importorskip('astropy.coordinates')
+import astropy.units as u
+from astropy.time import Time
+
+from constants import P48_loc
+from fast_coords import (FAST_ALTAZ_TOLERANCE_ARCMIN, altaz_deg, lst_deg,
+                         precess_from_j2000)
+
+
+@pytest.fixture(scope='module')
+def positions():
+    """Random ICRS positions and times over a three year survey."""
+    rng = np.random.RandomState(0)
+    n = 1000
+    ra = rng.uniform(0., 360., n)
+    dec = np.degrees(np.arcsin(rng.uniform(-1., 1., n)))
+    mjd = Time('2018-01-01', scale='utc').mjd + rng.uniform(0., 3 * 365.25, n)
+    t = Time(mjd, format='mjd', scale='utc', location=P48_loc)
+    # fast_coords takes UT1 = UTC
+    t.delta_ut1_utc = 0.
+    return ra, dec, mjd, t
+
+
+def test_altaz_within_tolerance(positions):
+    ra, dec, mjd, t = positions
+    sc = coord.SkyCoord(ra, dec, frame='icrs', unit='deg')
+    ref = sc.transform_to(coord.AltAz(obstime=t, location=P48_loc))
+
+    alt, az = altaz_deg(ra, dec, mjd)
+    fast = coord.SkyCoord(alt=alt * u.deg, az=az * u.deg, frame='altaz',
+                          obstime=t, location=P48_loc)
+
+    sep = fast.separation(ref).to(u.arcmin).value
+    assert np.max(sep) < FAST_ALTAZ_TOLERANCE_ARCMIN
+
+
+def test_hour_angle_within_tolerance(positions):
+    if not hasattr(coord, 'HADec'):
+        pytest.skip('astropy has no HADec frame')
+    ra, dec, mjd, t = positions
+    sc = coord.SkyCoord(ra, dec, frame='icrs', unit='deg')
+    ref = sc.transform_to(coord.HADec(obstime=t, location=P48_loc))
+
+    ra_date, dec_date = precess_from_j2000(ra, dec, mjd)
+    ha = lst_deg(mjd) - ra_date
+
+    dha = (ha - ref.ha.to(u.deg).value + 180.) % 360. - 180.
+    # compare on the sky, as the hour angle is undefined at the poles
+    dha_arcmin = np.abs(dha) * np.cos(np.radians(dec_date)) * 60.
+    assert np.max(dha_arcmin) < FAST_ALTAZ_TOLERANCE_ARCMIN
+
+
+def test_lst_within_tolerance(positions):
+    ra, dec, mjd, t = positions
+    dlst = (lst_deg(mjd) - t.sidereal_time('apparent').to(u.deg).value +
+            180.) % 360. - 180.
+    assert np.max(np.abs(dlst)) * 60. < FAST_ALTAZ_TOLERANCE_ARCMIN
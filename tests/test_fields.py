@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import pytest
+
+coord = pytest.importorskip('astropy.coordinates')
+import astropy.units as u
+from astropy.time import Time
+
+from constants import FILTER_IDS, P48_loc, PROGRAM_IDS
+from fields import (Fields, LST_TABLE_TOLERANCE_ARCMIN,
+                    generate_tessellated_field_grid)
+from utils import skycoord_to_altaz
+
+SURVEY_START = Time('2018-03-01', scale='utc')
+SURVEY_DAYS = 3 * 365.25
+
+
+@pytest.fixture(scope='module')
+def lst_table_fields():
+    epoch = SURVEY_START + SURVEY_DAYS / 2. * u.day
+    fields = Fields(dbname='test_lst_table',
+                    field_grid=generate_tessellated_field_grid(500),
+                    lst_table=True, lst_epoch=epoch)
+    yield fields
+    os.remove(fields._altaz_table_filename(fields.altaz_table.shape[1],
+                                           epoch=epoch))
+
+
+def test_lst_table_matches_astropy(lst_table_fields):
+    fields = lst_table_fields
+    rng = np.random.RandomState(0)
+    for mjd in SURVEY_START.mjd + rng.uniform(0., SURVEY_DAYS, 10):
+        time = Time(mjd, format='mjd', scale='utc', location=P48_loc)
+        alt, az = fields._lookup_altaz(mjd)
+        table = coord.SkyCoord(alt=alt * u.deg, az=az * u.deg, frame='altaz',
+                               obstime=time, location=P48_loc)
+        ref = skycoord_to_altaz(fields.field_coords, time)
+        sep = table.separation(ref).to(u.arcmin).value
+        assert np.max(sep) < LST_TABLE_TOLERANCE_ARCMIN
+
+
+def test_program_filter_index():
+    fields = Fields(field_grid=generate_tessellated_field_grid(10))
+    rng = np.random.RandomState(0)
+    program_ids = rng.choice(list(PROGRAM_IDS), 50)
+    filter_ids = rng.choice(list(FILTER_IDS), 20)
+    pi, fi = fields.program_filter_index(program_ids, filter_ids)
+    assert list(pi) == [fields._program_index[p] for p in program_ids]
+    assert list(fi) == [fields._filter_index[f] for f in filter_ids]
+
+    pi, fi = fields.program_filter_index(program_ids[0], filter_ids[0])
+    assert (len(pi), len(fi)) == (1, 1)
+
+    with pytest.raises(KeyError):
+        fields.program_filter_index([max(PROGRAM_IDS) + 1], filter_ids)
+    with pytest.raises(KeyError):
+        fields.program_filter_index(program_ids, [max(FILTER_IDS) + 1])
@@ -0,0 +1,25 @@
+import time
+
+from instrumentation import RUN_PROFILE, timed, timer
+
+
+@timed('inner')
+def _inner():
+    time.sleep(0.02)
+
+
+def test_nested_timers_report_self_time():
+    RUN_PROFILE.reset()
+    with timer('outer'):
+        time.sleep(0.02)
+        _inner()
+    timers = RUN_PROFILE.summary()['timers']
+    RUN_PROFILE.reset()
+
+    outer = timers['outer']
+    inner = timers['inner']
+    assert outer['total_s'] >= inner['total_s'] + 0.02
+    assert abs(outer['self_s'] - (outer['total_s'] - inner['total_s'])) \
+        < 1e-9
+    assert inner['self_s'] == inner['total_s']
+    assert sum(t['fraction_of_wall_time'] for t in timers.values()) <= 1.
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# load_sky_model uses the joblib bundled with older versions of sklearn
+joblib = pytest.importorskip('sklearn.externals.joblib')
+pytest.importorskip('sklearn_pandas')
+xgb = pytest.importorskip('xgboost')
+from sklearn import pipeline, preprocessing
+from sklearn_pandas import DataFrameMapper
+
+from sky_brightness import (SKY_MODEL_EXPORT_TOLERANCE, SKY_MODEL_FEATURES,
+                            SKY_TABLE_GRID, check_sky_model_export)
+
+
+def _save_sky_model(model_dir, filter_name='r', n=5000, seed=0):
+    """Train a pipeline of the same form as train_sky_model on synthetic
+    data and save it to model_dir."""
+
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({f: rng.uniform(SKY_TABLE_GRID[f][0],
+                                      SKY_TABLE_GRID[f][1], n)
+                       for f in SKY_MODEL_FEATURES})
+    y = (21. - 2. * df['moonillf'] * (df['moonalt'] > 0) +
+         0.01 * df['altitude'] + 0.02 * (df['sunalt'] + 20.) +
+         rng.normal(0., 0.1, n))
+
+    mapper = DataFrameMapper([([f], preprocessing.StandardScaler())
+                              for f in SKY_MODEL_FEATURES])
+    clf = pipeline.Pipeline([('featurize', mapper),
+                             ('xgb', xgb.XGBRegressor(n_estimators=50))])
+    clf.fit(df, y.values.reshape(-1, 1))
+    joblib.dump(clf, '{}/sky_model_{}.pkl'.format(model_dir, filter_name))
+
+
+def test_sky_model_export_accuracy(tmpdir):
+    model_dir = str(tmpdir)
+    _save_sky_model(model_dir)
+    assert check_sky_model_export(model_dir=model_dir) < \
+        SKY_MODEL_EXPORT_TOLERANCE
@@ -0,0 +1,10 @@
+import pytest
+
+from slew import SLEW_AXES, SLEW_PARAMETERS, SLEW_TABLE_TOLERANCE_S, SlewModel
+
+
+@pytest.mark.parametrize('slew_pars', sorted(SLEW_PARAMETERS.keys()))
+def test_slew_table_accuracy(slew_pars):
+    max_diff = SlewModel(slew_pars).check_accuracy()
+    for axis in SLEW_AXES:
+        assert max_diff[axis] < SLEW_TABLE_TOLERANCE_S
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('transitions')
+import astropy.units as u
+import astropy.coordinates as coord
+from astropy.time import Time
+
+from constants import FILTER_IDS, P48_loc
+from ZTFStateMachine import ZTFStateMachine
+
+TRIGGERS = ['check_if_ready', 'set_cant_observe', 'start_slew',
+            'start_filter_change', 'start_exposing', 'stop_slew', 'wait']
+
+
+def _run_triggers(state_machine, n_events=500, seed=0):
+    """Drive a state machine through a random sequence of triggers,
+    including triggers that are invalid from the current state, and return
+    the return value (or exception name), machine state, and telescope
+    state after each."""
+
+    tel = ZTFStateMachine(current_time=Time('2018-03-20 02:30:00',
+                                            scale='utc', location=P48_loc),
+                          target_skycoord=coord.SkyCoord(150. * u.deg,
+                                                         33.36 * u.deg),
+                          historical_observability_year=None,
+                          logfile=os.devnull, state_machine=state_machine)
+    rng = np.random.RandomState(seed)
+
+    outcomes = []
+    for _ in range(n_events):
+        trigger = TRIGGERS[rng.randint(len(TRIGGERS))]
+        if trigger == 'start_slew':
+            args = (coord.SkyCoord(rng.uniform(0., 360.) * u.deg,
+                                   rng.uniform(-40., 90.) * u.deg),)
+        elif trigger == 'start_filter_change':
+            args = (sorted(FILTER_IDS)[rng.randint(len(FILTER_IDS))],)
+        else:
+            args = ()
+
+        try:
+            result = getattr(tel, trigger)(*args)
+        except Exception as e:
+            result = type(e).__name__
+        t = tel.telescope
+        outcomes.append((trigger, result, tel.state, t.mjd, t.ha, t.dec,
+                         t.domeaz, t.filter_id))
+
+    return outcomes
+
+
+def test_native_state_machine_matches_transitions():
+    expected = _run_triggers('transitions')
+    actual = _run_triggers('native')
+
+    # the sequence must exercise both valid and invalid triggers
+    results = set(outcome[1] for outcome in expected)
+    assert True in results
+    assert 'MachineError' in results
+
+    for i, (e, a) in enumerate(zip(expected, actual)):
+        assert e == a, 'event {}'.format(i)
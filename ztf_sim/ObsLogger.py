@@ -1,25 +1,269 @@
 
+import json
 import numpy as np
-from sqlalchemy import create_engine
+import pandas as pd
+from astropy.time import Time
 import sqlite3
 import astropy.coordinates as coord
 import astropy.units as u
-import astroplan.moon
 from fields import Fields
 from utils import *
 from constants import *
+from instrumentation import timed
+
+# number of buffered pointings written per transaction
+FLUSH_EVERY = 1000
+
+# faster settings for the sqlite pointing history, applied to every new
+# connection if passed as sqlite_pragmas.  With synchronous = NORMAL in WAL
+# mode the last transactions can be lost on a power failure, but the
+# database is not corrupted.
+SQLITE_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}
+
+POINTING_WRITERS = ['sqlite', 'parquet']
+
+# Summary column types in the parquet output: positions and times are kept
+# in double precision, the filter is categorical, and everything else is
+# stored as float32
+PARQUET_INT_COLUMNS = ['sessionID', 'propID', 'fieldID', 'night',
+                       'requestNumberTonight', 'totalRequestsTonight']
+PARQUET_FLOAT64_COLUMNS = ['fieldRA', 'fieldDec', 'expDate', 'expMJD', 'lst']
 
 
 class ObsLogger:
 
-    def __init__(self, run_name, survey_start_time):
+    def __init__(self, run_name, survey_start_time, ephemeris=None,
+                 flush_every=FLUSH_EVERY, writer='sqlite',
+                 sqlite_pragmas=None, metadata=None, fields=None):
         self.run_name = run_name
         self.survey_start_time = survey_start_time
+        # precomputed Sun/Moon ephemeris; if None, use astropy directly
+        self.ephemeris = ephemeris
         self.prev_obs = None
-        self.mjd_tonight = None
-        self.moon_illumination_tonight = None
-        self.engine = create_engine('sqlite:///../sims/{}.db'.format(
-            self.run_name))
+        # pointings are buffered and their derived columns computed and
+        # written in batches by flush()
+        self.flush_every = flush_every
+        self.records = []
+
+        # writer is one of POINTING_WRITERS or an object providing
+        # write(df) and close()
+        if writer == 'sqlite':
+            self.writer = SQLiteSummaryWriter(run_name,
+                                              sqlite_pragmas=sqlite_pragmas,
+                                              fields=fields)
+        elif writer == 'parquet':
+            run_metadata = {'run_name': run_name,
+                            'survey_start_time': survey_start_time.iso,
+                            'code_version': code_version()}
+            if metadata is not None:
+                run_metadata.update(metadata)
+            self.writer = ParquetSummaryWriter(run_name,
+                                               metadata=run_metadata)
+        elif hasattr(writer, 'write'):
+            self.writer = writer
+        else:
+            raise ValueError('Unknown pointing writer {}'.format(writer))
+
+    @timed('log_pointing')
+    def log_pointing(self, state, request):
+        """Buffer the minimal description of a completed exposure.
+
+        The remaining Summary columns are pure functions of the pointing
+        and exposure time, and are computed for all buffered exposures at
+        once by flush()."""
+
+        exposure_time = request['target_exposure_time'].to(u.second).value
+        # times are recorded at start of exposure
+        exposure_start_mjd = state['current_time'].mjd - \
+            exposure_time / (1 * u.day).to(u.second).value
+
+        record = {}
+        # don't use request_id here, but
+        # let sqlite create a unique non-null key
+        #record['obsHistID'] = request['request_id']
+        record['propID'] = request['target_program_id']
+        record['fieldID'] = request['target_field_id']
+        record['ra'] = request['target_ra']
+        record['dec'] = request['target_dec']
+        record['filter_id'] = request['target_filter_id']
+        record['expMJD'] = exposure_start_mjd
+        record['visitTime'] = exposure_time
+        record['zenith_seeing'] = state['current_zenith_seeing'].to(
+            u.arcsec).value
+        record['filtSkyBright'] = request['target_sky_brightness']
+        record['fiveSigmaDepth'] = request['target_limiting_mag']
+
+        # ztf_sim specific keywords!
+        record['requestNumberTonight'] = \
+            request['target_request_number_tonight']
+        record['totalRequestsTonight'] = \
+            request['target_total_requests_tonight']
+        record['metricValue'] = \
+            request['target_metric_value']
+
+        # previous pointing, for the slew columns
+        if self.prev_obs is not None:
+            record['prev_ra'] = self.prev_obs['ra']
+            record['prev_dec'] = self.prev_obs['dec']
+            record['prev_end_mjd'] = self.prev_obs['expMJD'] + \
+                self.prev_obs['visitTime'] / (1 * u.day).to(u.second).value
+        else:
+            record['prev_ra'] = np.nan
+            record['prev_dec'] = np.nan
+            record['prev_end_mjd'] = np.nan
+
+        self.records.append(record)
+        if len(self.records) >= self.flush_every:
+            self.flush()
+
+        # save record for next obs
+        self.prev_obs = record
+
+    def summary_columns(self, records):
+        """Compute the Summary table columns for a list of buffered
+        records.
+
+        Returns a DataFrame with one row per record."""
+
+        obs = pd.DataFrame(records)
+        n = len(obs)
+
+        exposure_start = Time(obs['expMJD'].values, format='mjd',
+                              scale='utc', location=P48_loc)
+        # see note in utils.py
+        exposure_start.delta_ut1_utc = 0.
+
+        df = pd.DataFrame(index=obs.index)
+        df['sessionID'] = np.zeros(n, dtype=int)
+        df['propID'] = obs['propID']
+        df['fieldID'] = obs['fieldID']
+        df['fieldRA'] = np.radians(obs['ra'])
+        df['fieldDec'] = np.radians(obs['dec'])
+        df['filter'] = [FILTER_ID_TO_NAME[f] for f in obs['filter_id']]
+
+        day_to_sec = (1 * u.day).to(u.second).value
+        elapsed = obs['expMJD'].values - self.survey_start_time.mjd
+        df['expDate'] = elapsed * day_to_sec
+        df['expMJD'] = obs['expMJD']
+        df['night'] = np.floor(elapsed).astype(int)
+        df['visitTime'] = obs['visitTime']
+        df['visitExpTime'] = obs['visitTime']
+
+        # compute some values we will need
+        sc = coord.SkyCoord(obs['ra'].values * u.deg,
+                            obs['dec'].values * u.deg)
+        altaz = skycoord_to_altaz(sc, exposure_start)
+
+        pointing_seeing = seeing_at_pointing(obs['zenith_seeing'].values,
+                                             altaz.alt.to(u.deg).value)
+        df['FWHMgeom'] = pointing_seeing
+        df['FWHMeff'] = pointing_seeing
+        # transparency
+
+        # finRank
+        df['airmass'] = altaz.secz.value
+        # vSkyBright
+        df['filtSkyBright'] = obs['filtSkyBright']
+        df['rotSkyPos'] = 0.  # TODO: confirm
+        df['rotTelPos'] = 0.
+        # despite the docs, it seems lst is stored as radians
+        df['lst'] = np.radians(exposure_start.sidereal_time(
+            'apparent').to(u.hourangle).value / 24. * 360.)
+        df['altitude'] = altaz.alt.to(u.radian).value
+        df['azimuth'] = altaz.az.to(u.radian).value
+
+        if self.ephemeris is not None:
+            eph = self.ephemeris.at(exposure_start)
+            df['dist2Moon'] = np.radians(angular_separation_deg(
+                obs['ra'].values, obs['dec'].values,
+                eph['moon_ra'], eph['moon_dec']))
+            df['solarElong'] = angular_separation_deg(
+                obs['ra'].values, obs['dec'].values,
+                eph['sun_ra'], eph['sun_dec'])
+            df['moonRA'] = np.radians(eph['moon_ra'])
+            df['moonDec'] = np.radians(eph['moon_dec'])
+            df['moonAlt'] = np.radians(eph['moon_alt'])
+            df['moonAZ'] = np.radians(eph['moon_az'])
+            df['moonPhase'] = eph['moon_illumination'] * 100.
+            df['sunAlt'] = np.radians(eph['sun_alt'])
+            df['sunAz'] = np.radians(eph['sun_az'])
+        else:
+            import astroplan.moon
+            sun = coord.get_sun(exposure_start)
+            sun_altaz = skycoord_to_altaz(sun, exposure_start)
+            moon = coord.get_moon(exposure_start, P48_loc)
+            moon_altaz = skycoord_to_altaz(moon, exposure_start)
+            df['dist2Moon'] = sc.separation(moon).to(u.radian).value
+            df['solarElong'] = sc.separation(sun).to(u.deg).value
+            df['moonRA'] = moon.ra.to(u.radian).value
+            df['moonDec'] = moon.dec.to(u.radian).value
+            df['moonAlt'] = moon_altaz.alt.to(u.radian).value
+            df['moonAZ'] = moon_altaz.az.to(u.radian).value
+            df['moonPhase'] = astroplan.moon.moon_illumination(
+                # Don't use P48_loc to avoid astropy bug:
+                # https://github.com/astropy/astroplan/pull/213
+                exposure_start) * 100.
+            df['sunAlt'] = sun_altaz.alt.to(u.radian).value
+            df['sunAz'] = sun_altaz.az.to(u.radian).value
+        # phaseAngle, rScatter, mieScatter, moonBright, darkBright
+        # rawSeeing
+        # wind
+        # humidity
+
+        # NaN (stored as NULL) for the first exposure after a break
+        df['slewDist'] = np.radians(angular_separation_deg(
+            obs['ra'].values, obs['dec'].values,
+            obs['prev_ra'].values, obs['prev_dec'].values))
+        df['slewTime'] = (obs['expMJD'].values -
+                          obs['prev_end_mjd'].values) * day_to_sec
+        df['fiveSigmaDepth'] = obs['fiveSigmaDepth']
+        df['ditheredRA'] = 0.
+        df['ditheredDec'] = 0.
+
+        # ztf_sim specific keywords!
+        df['requestNumberTonight'] = obs['requestNumberTonight']
+        df['totalRequestsTonight'] = obs['totalRequestsTonight']
+        df['metricValue'] = obs['metricValue']
+
+        return df
+
+    @timed('log_flush')
+    def flush(self):
+        """Compute the Summary columns for the buffered pointings and pass
+        them to the writer."""
+
+        if not len(self.records):
+            return
+
+        self.writer.write(self.summary_columns(self.records))
+        self.records = []
+
+    def close(self):
+        """Flush any buffered pointings and close the output."""
+        self.flush()
+        self.writer.close()
+
+
+class SQLiteSummaryWriter(object):
+    """Write pointings to the Field and Summary tables of
+    ../sims/{run_name}.db, one transaction per batch."""
+
+    def __init__(self, run_name, directory='../sims',
+                 sqlite_pragmas=None, fields=None):
+        # Fields object for the Field table; if None, load the default grid
+        self.fields = fields
+        from sqlalchemy import create_engine, event
+        self.engine = create_engine('sqlite:///{}/{}.db'.format(
+            directory, run_name))
+
+        if sqlite_pragmas:
+            @event.listens_for(self.engine, 'connect')
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for pragma, value in sqlite_pragmas.items():
+                    cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+                cursor.close()
+
         self.conn = self.engine.connect()
         self.create_fields_table(clobber=True)
         self.create_pointing_log(clobber=True)
@@ -44,8 +288,9 @@ class ObsLogger:
         fieldEB   REAL
         )""")
 
-        f = Fields()
-        df = f.fields.reset_index()
+        if self.fields is None:
+            self.fields = Fields()
+        df = self.fields.field_grid.reset_index()
         df.rename(columns={'field_id': 'fieldID',
                            'ra': 'fieldRA',
                            'dec': 'fieldDec',
@@ -54,16 +299,7 @@ class ObsLogger:
                            'ecliptic_lon': 'fieldEL',
                            'ecliptic_lat': 'fieldEB'}, inplace=True)
         df.set_index(['fieldID'], inplace=True)
-        df.drop([u'grid_id', u'last_observed_1_1',
-                 u'first_obs_tonight_1_1',     u'last_observed_1_2',
-                 u'first_obs_tonight_1_2',     u'last_observed_2_1',
-                 u'first_obs_tonight_2_1',     u'last_observed_2_2',
-                 u'first_obs_tonight_2_2',     u'last_observed_3_1',
-                 u'first_obs_tonight_3_1',     u'last_observed_3_2',
-                 u'first_obs_tonight_3_2',             u'n_obs_1_1',
-                 u'n_obs_1_2',             u'n_obs_2_1',
-                 u'n_obs_2_2',             u'n_obs_3_1',
-                 u'n_obs_3_2'], axis=1, inplace=True)
+        df.drop(['grid_id'], axis=1, inplace=True)
 
         # (circumscribed) field diameter in degrees
         df['fieldFov'] = 10.428
@@ -131,116 +367,86 @@ class ObsLogger:
         metricValue        REAL
         )""")
 
-    def log_pointing(self, state, request):
+    def write(self, df):
+        """Insert a DataFrame of Summary rows in a single transaction."""
 
-        record = {}
-        # don't use request_id here, but
-        # let sqlite create a unique non-null key
-        #record['obsHistID'] = request['request_id']
-        record['sessionID'] = 0
-        record['propID'] = request['target_program_id']
-        record['fieldID'] = request['target_field_id']
-        record['fieldRA'] = np.radians(request['target_ra'])
-        record['fieldDec'] = np.radians(request['target_dec'])
+        from sqlalchemy import text
+        columns = list(df.columns)
+        query = text('INSERT INTO Summary ({}) VALUES ({})'.format(
+            ', '.join(columns), ', '.join([':' + c for c in columns])))
+        # sqlite3 can't bind numpy scalars
+        rows = [{c: (v.item() if isinstance(v, np.generic) else v)
+                 for c, v in zip(columns, values)}
+                for values in df.itertuples(index=False)]
 
-        record['filter'] = '\"' + \
-            FILTER_ID_TO_NAME[request['target_filter_id']] + '\"'
-        # times are recorded at start of exposure
-        exposure_start = state['current_time'] - \
-            request['target_exposure_time']
-        # see note in utils.py
-        exposure_start.delta_ut1_utc = 0.
+        with self.engine.begin() as conn:
+            conn.execute(query, rows)
 
-        record['expDate'] = (exposure_start - self.survey_start_time).sec
-        record['expMJD'] = exposure_start.mjd
+    def close(self):
+        self.conn.close()
+        self.engine.dispose()
 
-        record['night'] = np.floor((exposure_start - self.survey_start_time).jd
-                                   ).astype(np.int)
-        record['visitTime'] = request[
-            'target_exposure_time'].to(u.second).value
-        record['visitExpTime'] = request[
-            'target_exposure_time'].to(u.second).value
 
-        # compute some values we will need
-        sc = coord.SkyCoord(record['fieldRA'] * u.radian,
-                            record['fieldDec'] * u.radian)
-        altaz = skycoord_to_altaz(sc, exposure_start)
+class ParquetSummaryWriter(object):
+    """Write pointings to ../sims/{run_name}.parquet, one row group per
+    night, with the run metadata stored as JSON under the 'ztf_sim' key of
+    the file metadata.
 
-        pointing_seeing = seeing_at_pointing(state['current_zenith_seeing'].to(
-            u.arcsec).value, altaz.alt.value)
-        record['FWHMgeom'] = pointing_seeing
-        record['FWHMeff'] = pointing_seeing
-        # transparency
+    Requires pyarrow."""
 
-        # finRank
-        record['airmass'] = altaz.secz.value
-        # vSkyBright
-        record['filtSkyBright'] = request['target_sky_brightness']
-        record['rotSkyPos'] = 0.  # TODO: confirm
-        record['rotTelPos'] = 0.
-        # despite the docs, it seems lst is stored as radians
-        record['lst'] = np.radians(exposure_start.sidereal_time('apparent').to(
-            u.hourangle).value/24.*360.)
-        record['altitude'] = altaz.alt.to(u.radian).value
-        record['azimuth'] = altaz.az.to(u.radian).value
-
-        sun = coord.get_sun(exposure_start)
-        sun_altaz = skycoord_to_altaz(sun, exposure_start)
-        moon = coord.get_moon(exposure_start, P48_loc)
-        moon_altaz = skycoord_to_altaz(moon, exposure_start)
-        record['dist2Moon'] = sc.separation(moon).to(u.radian).value
-        record['solarElong'] = sc.separation(sun).to(u.deg).value
-        record['moonRA'] = moon.ra.to(u.radian).value
-        record['moonDec'] = moon.dec.to(u.radian).value
-        record['moonAlt'] = moon_altaz.alt.to(u.radian).value
-        record['moonAZ'] = moon_altaz.az.to(u.radian).value
-
-        # store tonight's mjd so that we can avoid recomputing moon
-        # illumination, which profiling shows is weirdly expensive
-        if np.floor(exposure_start.mjd) != self.mjd_tonight:
-            self.moon_illumination_tonight = astroplan.moon.moon_illumination(
-                # Don't use P48_loc to avoid astropy bug:
-                # https://github.com/astropy/astroplan/pull/213
-                # exposure_start, P48_loc) * 100.
-                exposure_start) * 100.
-            self.mjd_tonight = np.floor(exposure_start.mjd)
+    def __init__(self, run_name, directory='../sims', metadata=None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('The parquet pointing writer requires pyarrow')
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
 
-        record['moonPhase'] = self.moon_illumination_tonight
+        self.filename = '{}/{}.parquet'.format(directory, run_name)
+        if metadata is None:
+            metadata = {}
+        self.metadata = json.dumps(metadata)
+        self.parquet_writer = None
+        # Summary rows of the night in progress
+        self.pending = []
 
-        record['sunAlt'] = sun_altaz.alt.to(u.radian).value
-        record['sunAz'] = sun_altaz.az.to(u.radian).value
-        # phaseAngle, rScatter, mieScatter, moonBright, darkBright
-        # rawSeeing
-        # wind
-        # humidity
-        if self.prev_obs is not None:
-            sc_prev = coord.SkyCoord(self.prev_obs['fieldRA'] * u.radian,
-                                     self.prev_obs['fieldDec'] * u.radian)
-            record['slewDist'] = sc.separation(sc_prev).to(u.radian).value
-            record['slewTime'] = (record['expDate'] -
-                                  (self.prev_obs['expDate'] +
-                                      self.prev_obs['visitTime']))
-        record['fiveSigmaDepth'] = request['target_limiting_mag']
-        record['ditheredRA'] = 0.
-        record['ditheredDec'] = 0.
+    def write(self, df):
+        """Buffer a DataFrame of Summary rows; each night is written as a
+        row group once the next night begins."""
 
-        # ztf_sim specific keywords!
-        record['requestNumberTonight'] = \
-            request['target_request_number_tonight']
-        record['totalRequestsTonight'] = \
-            request['target_total_requests_tonight']
-        record['metricValue'] = \
-            request['target_metric_value']
+        for night in np.unique(df['night']):
+            if len(self.pending) and (self.pending[0]['night'].iloc[0] !=
+                                      night):
+                self._write_row_group()
+            self.pending.append(df[df['night'] == night])
 
-        # use placeholders to create the INSERT query
-        columns = ', '.join(record.keys())
-        placeholders = '{' + '}, {'.join(record.keys()) + '}'
-        query = 'INSERT INTO Summary ({}) VALUES ({})'.format(
-            columns, placeholders)
-        query_filled = query.format(**record)
-        self.conn.execute(query_filled)
+    def _write_row_group(self):
 
-        # save record for next obs
-        self.prev_obs = record
+        df = pd.concat(self.pending, ignore_index=True)
+        self.pending = []
+
+        for column in df.columns:
+            if column == 'filter':
+                df[column] = pd.Categorical(
+                    df[column], categories=sorted(FILTER_NAME_TO_ID.keys()))
+            elif column in PARQUET_INT_COLUMNS:
+                df[column] = df[column].astype(np.int32)
+            elif column not in PARQUET_FLOAT64_COLUMNS:
+                df[column] = df[column].astype(np.float32)
+
+        table = self.pa.Table.from_pandas(df, preserve_index=False)
+
+        if self.parquet_writer is None:
+            metadata = dict(table.schema.metadata)
+            metadata[b'ztf_sim'] = self.metadata.encode('utf-8')
+            self.parquet_writer = self.pq.ParquetWriter(
+                self.filename, table.schema.with_metadata(metadata))
+
+        self.parquet_writer.write_table(table, row_group_size=len(table))
 
-        pass
+    def close(self):
+        if len(self.pending):
+            self._write_row_group()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
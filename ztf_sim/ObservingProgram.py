@@ -25,7 +25,7 @@ class ObservingProgram(object):
         self.filter_choice = filter_choice
 
     def assign_nightly_requests(self, time, fields, block_programs=True,
-                                **kwargs):
+                                calendar=None, **kwargs):
 
         # need a way to make this flexible without coding a new class for
         # every single way we could pick which fields to observe
@@ -61,7 +61,7 @@ class ObservingProgram(object):
         #   use hard-coded sequence given in filter_ids
 
         # compute nightly altaz blocks and observability windows
-        fields.compute_blocks(time)
+        fields.compute_blocks(time, calendar=calendar)
         fields.compute_observability()
 
         n_filters = len(set(self.filter_ids))
@@ -73,7 +73,7 @@ class ObservingProgram(object):
             filter_ids_tonight = list(set(self.filter_ids))
 
         # how many fields can we observe tonight?
-        n_requests = self.number_of_allowed_requests(time)
+        n_requests = self.number_of_allowed_requests(time, calendar=calendar)
 
         n_fields = np.round(n_requests / self.n_visits_per_night)
 
@@ -223,8 +223,11 @@ class ObservingProgram(object):
 
         return request_set
 
-    def number_of_allowed_requests(self, time):
-        """ Count the (maximal) number of requests allowed for this program tonight."""
+    def number_of_allowed_requests(self, time, calendar=None):
+        """ Count the (maximal) number of requests allowed for this program tonight.
+
+        If a SurveyCalendar is supplied, use its exact hours of darkness
+        rather than the analytic approximation."""
 
         # TODO: implement balancing of program observing time
 
@@ -233,8 +236,11 @@ class ObservingProgram(object):
         # TODO: test how much we need this...
         FUDGE_FACTOR = 1.15
 
-        obs_time = approx_hours_of_darkness(
-            time) * self.observing_time_fraction
+        if calendar is not None:
+            hours_of_darkness = calendar.hours_of_darkness(time)
+        else:
+            hours_of_darkness = approx_hours_of_darkness(time)
+        obs_time = hours_of_darkness * self.observing_time_fraction
 
         n_requests = (obs_time.to(u.min) /
                       (EXPOSURE_TIME + READOUT_TIME).to(u.min)).value[0]  \
@@ -8,6 +8,16 @@ import astropy.coordinates as coord
 from cadence import *
 from constants import *
 from utils import *
+from instrumentation import timed, timer, count
+
+
+# minimum altitude (degrees) of requests in the queue
+MIN_QUEUE_ALTITUDE = 20.
+
+# minimum altitude (degrees) at the block midpoint of the precomputed sky
+# brightness and limiting magnitudes; fields move less than 2.5 degrees in
+# altitude in half a block, and the rest are computed when needed
+MIN_BLOCK_SKY_ALTITUDE = MIN_QUEUE_ALTITUDE - 5.
 
 
 class QueueEmptyError(Exception):
@@ -18,7 +28,8 @@ class QueueEmptyError(Exception):
 class QueueManager(object):
 
     def __init__(self, observing_programs=[], rp=None, fields=None,
-                 block_programs=True):
+                 block_programs=True, ephemeris=None, calendar=None,
+                 sky=None, precompute_sky=False):
 
         # list of ObservingPrograms
         self.observing_programs = observing_programs
@@ -27,7 +38,7 @@ class QueueManager(object):
         self.queue_block = None
 
         # the queue itself
-        self.queue = pd.DataFrame()
+        self._set_queue(pd.DataFrame())
 
         # should we only consider fields from one program in a given
         # observing block?
@@ -44,11 +55,25 @@ class QueueManager(object):
         else:
             self.fields = fields
 
-        self.Sky = SkyBrightness()
+        # precomputed Sun/Moon ephemeris; if None, use astropy directly
+        self.ephemeris = ephemeris
+
+        # precomputed twilight calendar; if None, compute nightly
+        self.calendar = calendar
+
+        if sky is None:
+            self.Sky = SkyBrightness()
+        else:
+            self.Sky = sky
+
+        # compute sky brightness and limiting magnitude for every field,
+        # filter, and block at the start of the night?
+        self.precompute_sky = precompute_sky
 
     def add_observing_program(self, observing_program):
         self.observing_programs.append(observing_program)
 
+    @timed('assign_nightly_requests')
     def assign_nightly_requests(self, current_state):
         # clear previous request pool
         self.rp.clear_all_requests()
@@ -59,7 +84,7 @@ class QueueManager(object):
 
             request_sets = program.assign_nightly_requests(
                 current_state['current_time'], self.fields,
-                block_programs=self.block_programs)
+                block_programs=self.block_programs, calendar=self.calendar)
             for rs in request_sets:
                 self.rp.add_requests(rs['program_id'], rs['field_ids'],
                                      rs['filter_id'], rs['cadence_func'],
@@ -70,6 +95,138 @@ class QueueManager(object):
 
         assert(len(self.rp.pool) > 0)
 
+        if self.precompute_sky and (self.fields.current_blocks is not None):
+            self._compute_block_sky(current_state)
+
+    def _add_sky_inputs(self, df, time):
+        """Add the Sun and Moon columns used by the sky brightness model
+        to df (which has ra and dec columns) at time."""
+
+        if self.ephemeris is not None:
+            eph = self.ephemeris.at(time)
+            df.loc[:, 'moonillf'] = eph['moon_illumination']
+            df.loc[:, 'moon_dist'] = angular_separation_deg(
+                df['ra'].values, df['dec'].values,
+                eph['moon_ra'], eph['moon_dec'])
+            df.loc[:, 'moonalt'] = eph['moon_alt']
+            df.loc[:, 'sunalt'] = eph['sun_alt']
+        else:
+            import astroplan.moon
+            sc = coord.SkyCoord(df['ra'], df['dec'], frame='icrs', unit='deg')
+            sun = coord.get_sun(time)
+            sun_altaz = skycoord_to_altaz(sun, time)
+            moon = coord.get_moon(time, location=P48_loc)
+            moon_altaz = skycoord_to_altaz(moon, time)
+            df.loc[:, 'moonillf'] = astroplan.moon.moon_illumination(
+                # Don't use P48_loc to avoid astropy bug:
+                # https://github.com/astropy/astroplan/pull/213
+                time)
+            # time, P48_loc)
+            df.loc[:, 'moon_dist'] = sc.separation(moon).to(u.deg).value
+            df.loc[:, 'moonalt'] = moon_altaz.alt.to(u.deg).value
+            df.loc[:, 'sunalt'] = sun_altaz.alt.to(u.deg).value
+
+    def _sky_and_limiting_mag(self, df, current_state):
+        """Add sky_brightness and limiting_mag columns to df (which has
+        seeing, altitude, and azimuth columns) at the current time."""
+
+        self._add_sky_inputs(df, current_state['current_time'])
+
+        with timer('sky_brightness'):
+            df.loc[:, 'sky_brightness'] = self.Sky.predict(df)
+
+        df.loc[:, 'limiting_mag'] = limiting_mag(EXPOSURE_TIME, df['seeing'],
+                                                 df['sky_brightness'],
+                                                 filter_id=df['filter_id'],
+                                                 altitude=df['altitude'], SNR=5.)
+        return df
+
+    @timed('block_sky')
+    def _compute_block_sky(self, current_state):
+        """Fill the sky brightness and limiting magnitude cubes of
+        tonight's blocks (see Fields.clear_block_sky) for the fields in the
+        request pool, with one call to the sky brightness model.
+
+        Uses the altitudes, azimuths, and Sun and Moon positions at the
+        block midpoints and the current zenith seeing."""
+
+        fields = self.fields
+        rows = np.unique(fields.field_rows(self.rp.pool['field_id'].values))
+        alt = fields.block_alt.values[rows, :]
+        az = fields.block_az.values[rows, :]
+
+        block_dfs = []
+        for bi, time in enumerate(fields.block_times):
+            w = alt[:, bi] > MIN_BLOCK_SKY_ALTITUDE
+            if not np.sum(w):
+                continue
+            df = fields.field_grid.iloc[rows[w]].loc[:, ['ra', 'dec']].copy()
+            df.loc[:, 'altitude'] = alt[w, bi]
+            df.loc[:, 'azimuth'] = az[w, bi]
+            self._add_sky_inputs(df, time)
+            df.loc[:, 'row'] = rows[w]
+            df.loc[:, 'block_index'] = bi
+            block_dfs.append(df)
+
+        shape = (len(fields.field_grid), len(FILTER_IDS),
+                 len(fields.current_blocks))
+        fields.block_sky_brightness = np.full(shape, np.nan, dtype=np.float32)
+        fields.block_limiting_mag = np.full(shape, np.nan, dtype=np.float32)
+        fields.block_zenith_seeing = current_state['current_zenith_seeing']
+
+        if not len(block_dfs):
+            return
+
+        df = pd.concat(block_dfs, ignore_index=True)
+        df = pd.concat([df.assign(filter_id=filter_id, filter_index=fi)
+                        for fi, filter_id in enumerate(FILTER_IDS)],
+                       ignore_index=True)
+
+        with timer('sky_brightness'):
+            sky = self.Sky.predict(df)
+        seeing = seeing_at_pointing(current_state['current_zenith_seeing'],
+                                    df['altitude'])
+        limmag = limiting_mag(EXPOSURE_TIME, seeing, sky,
+                              filter_id=df['filter_id'],
+                              altitude=df['altitude'], SNR=5.)
+
+        index = (df['row'].values, df['filter_index'].values,
+                 df['block_index'].values)
+        fields.block_sky_brightness[index] = np.asarray(sky)
+        fields.block_limiting_mag[index] = np.asarray(limmag)
+
+    def _lookup_block_sky(self, df, current_state, i_block):
+        """Add sky_brightness and limiting_mag columns to df from
+        tonight's cubes, computing any that are missing."""
+
+        fields = self.fields
+        rows = fields.field_rows(df['field_id'].values)
+        _, fi = fields.program_filter_index(df['program_id'].values,
+                                            df['filter_id'].values)
+
+        df.loc[:, 'sky_brightness'] = \
+            fields.block_sky_brightness[rows, fi, i_block].astype(float)
+        if current_state['current_zenith_seeing'] == \
+                fields.block_zenith_seeing:
+            df.loc[:, 'limiting_mag'] = \
+                fields.block_limiting_mag[rows, fi, i_block].astype(float)
+        else:
+            df.loc[:, 'limiting_mag'] = limiting_mag(
+                EXPOSURE_TIME, df['seeing'], df['sky_brightness'],
+                filter_id=df['filter_id'], altitude=df['altitude'], SNR=5.)
+
+        # fields below MIN_BLOCK_SKY_ALTITUDE at the block midpoint
+        missing = np.isnan(df['limiting_mag'].values)
+        if np.sum(missing):
+            count('block_sky_misses', np.sum(missing))
+            computed = self._sky_and_limiting_mag(df.loc[missing, :].copy(),
+                                                  current_state)
+            df.loc[missing, 'sky_brightness'] = \
+                computed['sky_brightness'].values
+            df.loc[missing, 'limiting_mag'] = computed['limiting_mag'].values
+
+        return df
+
     def next_obs(self, current_state):
         """Given current state, return the parameters for the next request"""
         # don't store the telescope state locally!
@@ -83,10 +240,77 @@ class QueueManager(object):
         # define functions that actually do the work in subclasses
         return self._update_queue(current_state)
 
+    def next_event_time(self, current_state):
+        """Earliest future time at which the queue can change: the end of
+        the current block, the opening of a cadence window, or a request's
+        field rising above MIN_QUEUE_ALTITUDE.
+
+        Returns an astropy Time."""
+
+        now = current_state['current_time']
+        next_mjd = block_index_to_time(block_index(now)[0], now,
+                                       where='end')[0].mjd
+
+        if self.rp.n_requests():
+            df = self.rp.pool.loc[self.rp.active, :].join(
+                self.fields.field_grid, on='field_id')
+            next_mjd = min(next_mjd,
+                           next_window_opening(df, current_state,
+                                               self.fields))
+            rise = days_until_rise(df['ra'].values, df['dec'].values,
+                                   now.mjd, MIN_QUEUE_ALTITUDE)
+            next_mjd = min(next_mjd, now.mjd + np.min(rise))
+
+        return Time(next_mjd, format='mjd', scale='utc', location=P48_loc)
+
+    def _set_queue(self, df):
+        """Store a newly calculated queue.
+
+        The queue DataFrame is fixed until the next recalculation;
+        removed requests are only flagged in the active-row mask, and
+        per-exposure quantities are updated in place in preallocated
+        arrays aligned with the rows of the queue."""
+
+        self.queue = df
+        n = len(df)
+        self.queue_active = np.ones(n, dtype=bool)
+        self._queue_position = {request_id: i for i, request_id in
+                                enumerate(df.index)}
+        self._queue_overhead = np.zeros(n)
+        self._queue_altitude = np.zeros(n)
+        self._queue_azimuth = np.zeros(n)
+        self._queue_value = np.zeros(n)
+        self._queue_scratch = np.zeros(n)
+        for col, arr in [('overhead_time', self._queue_overhead),
+                         ('altitude', self._queue_altitude),
+                         ('azimuth', self._queue_azimuth),
+                         ('value', self._queue_value)]:
+            if col in df:
+                arr[:] = df[col].values
+        # inputs of the in-place updates
+        self._queue_field_rows = np.zeros(n, dtype=int)
+        self._queue_filter_ids = np.zeros(n, dtype=int)
+        self._queue_mag_weight = np.zeros(n)
+        if n:
+            self._queue_field_rows[:] = self.fields.field_rows(
+                df['field_id'].values)
+            self._queue_filter_ids[:] = df['filter_id'].values
+            self._queue_mag_weight[:] = self._limiting_mag_weight(
+                df['limiting_mag'].values)
+
+    def in_queue(self, request_id):
+        """Is request_id an active request in the current queue?"""
+        i = self._queue_position.get(request_id)
+        return (i is not None) and self.queue_active[i]
+
     def remove_requests(self, request_id):
         """Remove a request from both the queue and the request pool"""
 
-        self.queue = self.queue.drop(request_id)
+        for rid in np.atleast_1d(request_id):
+            i = self._queue_position.get(rid)
+            if i is not None:
+                self.queue_active[i] = False
+                self._queue_value[i] = -np.inf
         self.rp.remove_requests(request_id)
 
 
@@ -95,35 +319,37 @@ class GreedyQueueManager(QueueManager):
     def __init__(self, **kwargs):
         super(GreedyQueueManager, self).__init__(**kwargs)
 
+    @timed('next_obs')
     def _next_obs(self, current_state):
         """Select the highest value request."""
 
         # since this is a greedy queue, we update the queue after each obs
         # for speed, only do the whole recalculation if we're in a new block
         if ((block_index(current_state['current_time'])[0] != self.queue_block)
-                or (len(self.queue) == 0)):
+                or (not np.any(self.queue_active))):
             self._update_queue(current_state)
         else:
             # otherwise just recalculate the overhead times
             _ = self._update_overhead(current_state)
 
-        # request_id of the highest value request
-        max_idx = self.queue.value.argmax()
+        # highest value request; removed requests have value -inf
+        i = np.argmax(self._queue_value)
+        row = self.queue.iloc[i]
 
-        return {'target_field_id': self.queue.ix[max_idx].field_id,
-                'target_ra': self.queue.ix[max_idx].ra,
-                'target_dec': self.queue.ix[max_idx].dec,
-                'target_filter_id': self.queue.ix[max_idx].filter_id,
-                'target_program_id': self.queue.ix[max_idx].program_id,
+        return {'target_field_id': row['field_id'],
+                'target_ra': row['ra'],
+                'target_dec': row['dec'],
+                'target_filter_id': row['filter_id'],
+                'target_program_id': row['program_id'],
                 'target_exposure_time': EXPOSURE_TIME,
-                'target_sky_brightness': self.queue.ix[max_idx].sky_brightness,
-                'target_limiting_mag': self.queue.ix[max_idx].limiting_mag,
-                'target_metric_value':  self.queue.ix[max_idx].value,
+                'target_sky_brightness': row['sky_brightness'],
+                'target_limiting_mag': row['limiting_mag'],
+                'target_metric_value': self._queue_value[i],
                 'target_request_number_tonight':
-                self.queue.ix[max_idx].request_number_tonight,
+                row['request_number_tonight'],
                 'target_total_requests_tonight':
-                self.queue.ix[max_idx].total_requests_tonight,
-                'request_id': max_idx}
+                row['total_requests_tonight'],
+                'request_id': self.queue.index[i]}
 
     def _metric(self, df):
         """Calculate metric for prioritizing fields.
@@ -133,55 +359,71 @@ class GreedyQueueManager(QueueManager):
         moon phase and distance, overhead time
         == 1 for 21st mag, 15 sec overhead."""
         # df.loc[:, 'value'] =
-        return 10.**(0.6 * (df['limiting_mag'] - 21)) / \
-            ((EXPOSURE_TIME.value + df['overhead_time']) /
-             (EXPOSURE_TIME.value + 15.))
+        return self._limiting_mag_weight(df['limiting_mag']) / \
+            (EXPOSURE_TIME.value + df['overhead_time'])
+
+    def _limiting_mag_weight(self, limiting_mag):
+        """Overhead-independent part of _metric, cached for each queue."""
+        return 10.**(0.6 * (limiting_mag - 21)) * (EXPOSURE_TIME.value + 15.)
 
+    @timed('update_overhead')
     def _update_overhead(self, current_state, df=None):
         """recalculate overhead values without regenerating whole queue"""
 
-        inplace = df is None
-
-        if inplace:
-            # no dataframe supplied, so replace existing self.queue on exit
-            df = self.queue
-            df.drop(['overhead_time', 'altitude', 'azimuth'], axis=1,
-                    inplace=True)
-
-        # compute readout/slew overhead times, plus current alt/az
-        df_overhead, df_altaz = self.fields.overhead_time(current_state)
-
-        # nb: df has index request_id, not field_id
-        df = pd.merge(df, df_overhead, left_on='field_id', right_index=True)
-        df = pd.merge(df, df_altaz, left_on='field_id', right_index=True)
-        # TODO: standardize this naming
-        df.rename(columns={'alt': 'altitude', 'az': 'azimuth'}, inplace=True)
-
-        # add overhead for filter changes
-        w = df['filter_id'] != current_state['current_filter_id']
-        if np.sum(w):
-            df.loc[w, 'overhead_time'] += FILTER_CHANGE_TIME.to(u.second).value
-
-        if inplace:
-            df.loc[:, 'value'] = self._metric(df)
-            self.queue = df
-
-        return df
-
+        filter_change_time = FILTER_CHANGE_TIME.to(u.second).value
+
+        if df is not None:
+            # compute readout/slew overhead times, plus current alt/az
+            # nb: df has index request_id, not field_id
+            rows = self.fields.field_rows(df['field_id'].values)
+            overhead, alt, az = self.fields.overhead_arrays(current_state,
+                                                            rows=rows)
+            # add overhead for filter changes
+            w = df['filter_id'].values != current_state['current_filter_id']
+            overhead[w] += filter_change_time
+            # TODO: standardize this naming
+            df['overhead_time'] = overhead
+            df['altitude'] = alt
+            df['azimuth'] = az
+            return df
+
+        # no dataframe supplied, so update the queue arrays in place
+        overhead, alt, az = self.fields.overhead_arrays(
+            current_state, rows=self._queue_field_rows)
+        self._queue_overhead[:] = overhead
+        self._queue_altitude[:] = alt
+        self._queue_azimuth[:] = az
+        self._queue_overhead[self._queue_filter_ids !=
+                             current_state['current_filter_id']] += \
+            filter_change_time
+
+        np.add(self._queue_overhead, EXPOSURE_TIME.value,
+               out=self._queue_scratch)
+        np.divide(self._queue_mag_weight, self._queue_scratch,
+                  out=self._queue_value)
+        self._queue_value[~self.queue_active] = -np.inf
+
+    @timed('update_queue')
     def _update_queue(self, current_state):
         """Calculate greedy weighting of requests in the Pool using current
         telescope state only"""
 
+        count('queue_rebuilds')
+
         # store block index for which these values were calculated
         self.queue_block = block_index(current_state['current_time'])
 
+        # discard the previous queue, in case we raise QueueEmptyError
+        self._set_queue(pd.DataFrame())
+
         # check that the pool has fields in it
-        if len(self.rp.pool) == 0:
+        if self.rp.n_requests() == 0:
             raise QueueEmptyError("No fields in pool")
 
         # join with fields so we have the information we need
         # make a copy so rp.pool and self.queue are not linked
-        df = self.rp.pool.join(self.fields.fields, on='field_id').copy()
+        df = self.rp.pool.loc[self.rp.active, :].join(
+            self.fields.field_grid, on='field_id').copy()
 
         df = self._update_overhead(current_state, df=df)
 
@@ -189,7 +431,7 @@ class GreedyQueueManager(QueueManager):
         # airmass weighting applied naturally below
         # also make a copy because otherwise it retains knowledge of
         # (discarded) previous reference and raises SettingWithCopyWarnings
-        df = df.loc[df['altitude'] > 20, :].copy()
+        df = df.loc[df['altitude'] > MIN_QUEUE_ALTITUDE, :].copy()
 
         if len(df) == 0:
             raise QueueEmptyError("No fields in queue above altitude cut")
@@ -201,21 +443,14 @@ class GreedyQueueManager(QueueManager):
             df = df.loc[df['program_id'] == current_block_program, :]
 
         # use cadence functions to compute requests with active cadence windows
-        # this is slow, so do it after our altitude cut
-        in_window = {}
-        for idx, row in df.iterrows():
-            # this is way, way slower
-            # df['in_cadence_window'].ix[idx] = \
-            in_window[idx] = eval(
-                '{}(row, current_state)'.format(row['cadence_func']))
-
-        cadence_cuts = pd.Series(in_window)
+        in_window = enabled_cadence_windows(df, current_state, self.fields)
+
         # TODO: handle if cadence cuts returns no fields
-        if np.sum(cadence_cuts) == 0:
+        if np.sum(in_window) == 0:
             raise QueueEmptyError("No fields with observable cadence windows")
         # also make a copy because otherwise it retains knowledge of
         # (discarded) previous reference and raises SettingWithCopyWarnings
-        df = df.loc[cadence_cuts, :].copy()
+        df = df.loc[in_window, :].copy()
 
         # compute airmasses by field_id
         # airmass = zenith_angle_to_airmass(90. - df_alt)
@@ -225,42 +460,26 @@ class GreedyQueueManager(QueueManager):
         # airmass cut (or add airmass weighting to value below)
         # df = df[(df['airmass'] <= MAX_AIRMASS) & (df['airmass'] > 0)]
 
-        # compute inputs for sky brightness
-        sc = coord.SkyCoord(df['ra'], df['dec'], frame='icrs', unit='deg')
-        sun = coord.get_sun(current_state['current_time'])
-        sun_altaz = skycoord_to_altaz(sun, current_state['current_time'])
-        moon = coord.get_moon(current_state['current_time'],
-                              location=P48_loc)
-        moon_altaz = skycoord_to_altaz(moon, current_state['current_time'])
-        df.loc[:, 'moonillf'] = astroplan.moon.moon_illumination(
-            # Don't use P48_loc to avoid astropy bug:
-            # https://github.com/astropy/astroplan/pull/213
-            current_state['current_time'])
-        # current_state['current_time'], P48_loc)
-        df.loc[:, 'moon_dist'] = sc.separation(moon).to(u.deg).value
-        df.loc[:, 'moonalt'] = moon_altaz.alt.to(u.deg).value
-        df.loc[:, 'sunalt'] = sun_altaz.alt.to(u.deg).value
-
-        # compute sky brightness
-        df.loc[:, 'sky_brightness'] = self.Sky.predict(df)
-        #df = pd.merge(df, df_sky, left_on='field_id', right_index=True)
-
         # compute seeing at each pointing
         df.loc[:, 'seeing'] = seeing_at_pointing(current_state['current_zenith_seeing'],
                                                  df['altitude'])
         #df_seeing.name = 'seeing'
         #df = pd.merge(df, df_seeing, left_on='field_id', right_index=True)
 
-        df.loc[:, 'limiting_mag'] = limiting_mag(EXPOSURE_TIME, df['seeing'],
-                                                 df['sky_brightness'],
-                                                 filter_id=df['filter_id'],
-                                                 altitude=df['altitude'], SNR=5.)
-        #df_limmag.name = 'limiting_mag'
-        #df = pd.merge(df, df_limmag, left_on='field_id', right_index=True)
+        # sky brightness and limiting magnitude, from tonight's cubes if
+        # they were precomputed
+        i_block = None
+        if self.precompute_sky:
+            i_block = self.fields.block_sky_index(
+                np.atleast_1d(self.queue_block)[0])
+        if i_block is None:
+            df = self._sky_and_limiting_mag(df, current_state)
+        else:
+            df = self._lookup_block_sky(df, current_state, i_block)
 
         df.loc[:, 'value'] = self._metric(df)
 
-        self.queue = df
+        self._set_queue(df)
 
 
 class RequestPool(object):
@@ -269,8 +488,7 @@ class RequestPool(object):
         # initialize empty dataframe to add to
         # TODO: currently treating the index as the request_id; should it be
         # unique across sessions?
-        self.pool = pd.DataFrame()
-        pass
+        self.clear_all_requests()
 
     def add_requests(self, program_id, field_ids, filter_id,
                      cadence_func, cadence_pars, request_number_tonight,
@@ -286,30 +504,36 @@ class RequestPool(object):
         if n_fields == 1:
             field_ids = [field_ids]
 
-        # build df as a list of dicts
-        requests = []
-        for i, field_id in enumerate(field_ids):
-            requests.append({
-                'program_id': program_id,
-                'field_id': field_id,
-                'filter_id': filter_id,
-                'cadence_func': cadence_func,
-                'cadence_pars': cadence_pars,
-                'request_number_tonight': request_number_tonight,
-                'total_requests_tonight': total_requests_tonight,
-                'priority': priority})
-
+        # cadence_pars are stored as numeric columns
+        # so cadence windows can be evaluated for the whole pool at once
+        requests = cadence_pars_to_columns(cadence_pars)
+        requests.update({
+            'program_id': program_id,
+            'field_id': np.asarray(field_ids),
+            'filter_id': filter_id,
+            'cadence_func': cadence_func,
+            'request_number_tonight': request_number_tonight,
+            'total_requests_tonight': total_requests_tonight,
+            'priority': priority})
+
+        # request_ids are row positions in the pool
         self.pool = self.pool.append(pd.DataFrame(requests), ignore_index=True)
+        self.active = np.concatenate([self.active,
+                                      np.ones(n_fields, dtype=bool)])
 
     def n_requests(self):
-        return len(self.pool)
+        return np.sum(self.active)
 
     def remove_requests(self, request_ids):
         """Remove completed or otherwise unwanted requests by request_id
 
         request_ids : scalar or list
-            requests to drop (index of self.pool)"""
-        self.pool = self.pool.drop(request_ids)
+            requests to drop (index of self.pool)
+
+        Requests are only flagged inactive, so the pool is not copied."""
+        self.active[request_ids] = False
 
     def clear_all_requests(self):
         self.pool = pd.DataFrame()
+        # active-request mask, aligned with the rows of self.pool
+        self.active = np.zeros(0, dtype=bool)
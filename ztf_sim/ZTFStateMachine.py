@@ -1,15 +1,15 @@
-from transitions import Machine
 from astropy.time import Time
 import numpy as np
 import astropy.units as u
 import astropy.coordinates as coord
 from utils import *
 from constants import *
+from slew import SlewModel, axis_separation
+from state_machine import NativeMachine, STATE_MACHINE_BACKENDS
 import logging
-from transitions import logger
 
 
-class ZTFStateMachine(Machine):
+class ZTFStateMachine(object):
 
     def __init__(self, current_time=Time('2018-01-01', scale='utc',
                                          location=P48_loc),
@@ -19,7 +19,12 @@ class ZTFStateMachine(Machine):
                  current_zenith_seeing=2.0 * u.arcsec,
                  target_skycoord=None,
                  logfile='../sims/log_ztf_sim',
-                 historical_observability_year=2015):
+                 historical_observability_year=2015,
+                 ephemeris=None, calendar=None, observability=None,
+                 slew_model=None, state_machine='transitions'):
+        """state_machine : 'transitions' (the transitions library) or
+            'native' (state_machine.NativeMachine, with the same states,
+            transitions, and return values but less dispatch overhead)"""
 
         # Define some states.
         states = ['ready', 'cant_observe',
@@ -49,24 +54,46 @@ class ZTFStateMachine(Machine):
                 'dest': 'cant_observe'}
         ]
 
+        # telescope state as plain floats; the current_* attributes are
+        # astropy views of it
+        self.telescope = TelescopeState(
+            current_time.mjd, current_ha.to(u.deg).value,
+            current_dec.to(u.deg).value, current_domeaz.to(u.deg).value,
+            current_filter_id, current_zenith_seeing.to(u.arcsec).value,
+            filters, target_skycoord=target_skycoord)
+
         # Initialize the state machine.  syntax from
         # https://github.com/tyarkoni/transitions
-        Machine.__init__(self, states=states,
-                         transitions=transitions,
-                         initial='ready')
-
-        self.current_time = current_time
-        self.current_ha = current_ha
-        self.current_dec = current_dec
-        self.current_domeaz = current_domeaz
-        self.current_filter_id = current_filter_id
-        self.filters = filters
-        self.current_zenith_seeing = current_zenith_seeing
-        self.target_skycoord = target_skycoord
+        if state_machine not in STATE_MACHINE_BACKENDS:
+            raise ValueError('Unknown state machine {}'.format(state_machine))
+        if state_machine == 'transitions':
+            from transitions import Machine, logger
+            self.machine = Machine(model=self, states=states,
+                                   transitions=transitions,
+                                   initial='ready')
+        else:
+            self.machine = NativeMachine(self, states, transitions,
+                                         initial='ready')
+            logger = logging.getLogger('ztf_sim')
 
         # historical observability
         self.historical_observability_year = historical_observability_year
-        self.observability = PTFObservabilityDB()
+        if (observability is None) and \
+                (historical_observability_year is not None):
+            self.observability = PTFObservabilityDB()
+        else:
+            self.observability = observability
+
+        # precomputed Sun/Moon ephemeris; if None, use astropy directly
+        self.ephemeris = ephemeris
+
+        # precomputed twilight calendar; if None, use the Sun altitude
+        self.calendar = calendar
+
+        # slew time tables; share with Fields so overheads agree
+        if slew_model is None:
+            slew_model = SlewModel()
+        self.slew_model = slew_model
 
         # logging.  wipe out existing log.
         fh = logging.FileHandler(logfile, mode='w')
@@ -75,49 +102,128 @@ class ZTFStateMachine(Machine):
         self.logger.setLevel(logging.INFO)
         self.logger.addHandler(fh)
 
+    @property
+    def current_mjd(self):
+        return self.telescope.mjd
+
+    @current_mjd.setter
+    def current_mjd(self, mjd):
+        self.telescope.mjd = mjd
+
+    @property
+    def current_time(self):
+        return self.telescope.time
+
+    @current_time.setter
+    def current_time(self, time):
+        self.telescope.mjd = time.mjd
+
+    @property
+    def current_ha(self):
+        return self.telescope.ha * u.deg
+
+    @current_ha.setter
+    def current_ha(self, ha):
+        self.telescope.ha = ha.to(u.deg).value
+
+    @property
+    def current_dec(self):
+        return self.telescope.dec * u.deg
+
+    @current_dec.setter
+    def current_dec(self, dec):
+        self.telescope.dec = dec.to(u.deg).value
+
+    @property
+    def current_domeaz(self):
+        return self.telescope.domeaz * u.deg
+
+    @current_domeaz.setter
+    def current_domeaz(self, domeaz):
+        self.telescope.domeaz = domeaz.to(u.deg).value
+
+    @property
+    def current_filter_id(self):
+        return self.telescope.filter_id
+
+    @current_filter_id.setter
+    def current_filter_id(self, filter_id):
+        self.telescope.filter_id = filter_id
+
+    @property
+    def current_zenith_seeing(self):
+        return self.telescope.zenith_seeing * u.arcsec
+
+    @current_zenith_seeing.setter
+    def current_zenith_seeing(self, seeing):
+        self.telescope.zenith_seeing = seeing.to(u.arcsec).value
+
+    @property
+    def filters(self):
+        return self.telescope.filters
+
+    @property
+    def target_skycoord(self):
+        return self.telescope.target_skycoord
+
+    @target_skycoord.setter
+    def target_skycoord(self, target_skycoord):
+        self.telescope.target_skycoord = target_skycoord
+
     def current_state_dict(self):
-        """Return current state parameters in a dictionary"""
-        return {'current_time': self.current_time,
-                'current_ha': self.current_ha,
-                'current_dec': self.current_dec,
-                'current_domeaz': self.current_domeaz,
-                'current_filter_id': self.current_filter_id,
-                'current_zenith_seeing': self.current_zenith_seeing,
-                'filters': self.filters,
-                'target_skycoord': self.target_skycoord}
+        """Return a snapshot of the current state parameters, read like a
+        dictionary (see TelescopeState)"""
+        return self.telescope.copy()
 
     def can_observe(self):
         """Check for night and weather"""
         self.logger.info(self.current_time.iso)
 
         # start by checking for 12 degree twilight
-        if coord.get_sun(self.current_time).transform_to(
-                coord.AltAz(obstime=self.current_time,
-                            location=P48_loc)).alt.is_within_bounds(
-                upper=-12. * u.deg):
+        if self.calendar is not None:
+            is_dark = self.calendar.is_dark(self.telescope.mjd)
+        else:
+            if self.ephemeris is not None:
+                sun_alt = self.ephemeris.at(
+                    self.current_time)['sun_alt'] * u.deg
+            else:
+                sun_alt = coord.get_sun(self.current_time).transform_to(
+                    coord.AltAz(obstime=self.current_time,
+                                location=P48_loc)).alt
+            is_dark = sun_alt <= -12. * u.deg
+        if is_dark:
             if self.historical_observability_year is None:
                 # don't use weather, just use 12 degree twilight
                 return True
             else:
                 is_observable = self.observability.check_historical_observability(
-                    self.current_time, year=self.historical_observability_year)
+                    self.telescope.mjd, year=self.historical_observability_year)
                 if not is_observable:
-                    # optimization: fast-forward to start of next block
-                    block_now = block_index(self.current_time)
-                    block_end_time = block_index_to_time(block_now,
-                        self.current_time, where='end')[0]
-                    self.logger.info('Weathered out.  Fast forwarding to end of this block: {}'.format(
-                        block_end_time.iso))
-                    self.current_time = block_end_time
+                    # optimization: fast-forward over the weathered-out
+                    # blocks to the start of the next observable one
+                    _, next_mjd = self.observability.next_observable_block(
+                        self.telescope.mjd,
+                        year=self.historical_observability_year)
+                    if next_mjd is None:
+                        block_now = block_index_mjd(self.telescope.mjd)
+                        next_mjd = block_index_to_mjd(block_now,
+                            self.telescope.mjd, where='end')[0]
+                    self.telescope.mjd = next_mjd
+                    self.logger.info('Weathered out.  Fast forwarding to next observable block: {}'.format(
+                        self.current_time.iso))
 
                 return is_observable
         else:
             # daytime
             # optimization: fast-forward to sunset
-            next_twilight = next_12deg_evening_twilight(self.current_time)
+            if self.calendar is not None:
+                self.telescope.mjd = self.calendar.next_evening_twilight(
+                    self.telescope.mjd)
+            else:
+                self.current_time = next_12deg_evening_twilight(
+                    self.current_time)
             self.logger.info('Fast forwarding to 12 deg twilight: {}'.format(
-                next_twilight.iso))
-            self.current_time = next_twilight
+                self.current_time.iso))
             return False
 
     def slew_allowed(self, target_skycoord):
@@ -145,20 +251,19 @@ class ZTFStateMachine(Machine):
         target_dec = target_skycoord.dec
 
         # calculate time required to slew
-        # TODO: duplicates codes in fields.py--consider refactoring
-        axis_slew_times = [READOUT_TIME]
-        for axis in ['ha', 'dec', 'domeaz']:
-            dangle = np.abs(eval("target_{}".format(axis)) -
-                            eval("self.current_{}".format(axis)))
-            angle = np.where(dangle < (360. * u.deg - dangle), dangle,
-                             360. * u.deg - dangle)
-            axis_slew_times.append(slew_time(axis[:4], angle * u.deg))
-
-        net_slew_time = np.max([st.value for st in axis_slew_times]) *\
-            axis_slew_times[0].unit
+        angles = {'ha': axis_separation(target_ha.to(u.deg).value,
+                                        self.telescope.ha),
+                  'dec': axis_separation(target_dec.to(u.deg).value,
+                                         self.telescope.dec),
+                  'dome': axis_separation(target_domeaz.to(u.deg).value,
+                                          self.telescope.domeaz)}
+        net_slew_time = readout_time.to(u.second).value
+        for axis, angle in angles.items():
+            net_slew_time = max(net_slew_time,
+                                self.slew_model.slew_time(axis, angle))
 
         # update the time
-        self.current_time += net_slew_time
+        self.telescope.mjd += net_slew_time * u.second.to(u.day)
         # small deviation here: ha, az of target ra shifts (usually!)
         # modestly during slew,
         # so store the value after the slew is complete.
@@ -174,14 +279,14 @@ class ZTFStateMachine(Machine):
                               filter_change_time=FILTER_CHANGE_TIME):
         if self.current_filter_id != target_filter_id:
             self.current_filter_id = target_filter_id
-            self.current_time += filter_change_time
+            self.telescope.mjd += filter_change_time.to(u.day).value
         # TODO: put in actual treatment of filter change (e.g., slew to stow
         # position)
 
     def process_exposure(self, exposure_time=EXPOSURE_TIME):
         # annoyingly, transitions doesn't let me modify object
         # variables in the trigger functions themselves
-        self.current_time += exposure_time
+        self.telescope.mjd += exposure_time.to(u.day).value
         # update ha and domeaz for tracking during the exposure
         target_ha = RA_to_HA(self.target_skycoord.ra, self.current_time)
         target_domeaz = skycoord_to_altaz(self.target_skycoord,
@@ -193,14 +298,141 @@ class ZTFStateMachine(Machine):
         # long and slow dome slews during the exposure
 
     def wait(self, wait_time=EXPOSURE_TIME):
-        self.current_time += wait_time
+        """Advance the clock by a Quantity or TimeDelta."""
+        if hasattr(wait_time, 'jd'):
+            self.telescope.mjd += wait_time.jd
+        else:
+            self.telescope.mjd += wait_time.to(u.day).value
+
+
+class TelescopeState(object):
+    """Telescope state as plain floats: MJD, angles in degrees, and
+    zenith seeing in arcsec.
+
+    Snapshots (ZTFStateMachine.current_state_dict) also read like a
+    dictionary of astropy values with keys in STATE_KEYS.  The astropy
+    Time is built on first access and kept until the MJD changes."""
+
+    __slots__ = ['_mjd', '_time', 'ha', 'dec', 'domeaz', 'filter_id',
+                 'zenith_seeing', 'filters', 'target_skycoord']
+
+    STATE_KEYS = ['current_time', 'current_ha', 'current_dec',
+                  'current_domeaz', 'current_filter_id',
+                  'current_zenith_seeing', 'filters', 'target_skycoord']
+
+    def __init__(self, mjd, ha, dec, domeaz, filter_id, zenith_seeing,
+                 filters, target_skycoord=None):
+        self.mjd = mjd
+        self.ha = ha
+        self.dec = dec
+        self.domeaz = domeaz
+        self.filter_id = filter_id
+        self.zenith_seeing = zenith_seeing
+        self.filters = filters
+        self.target_skycoord = target_skycoord
+
+    @property
+    def mjd(self):
+        return self._mjd
+
+    @mjd.setter
+    def mjd(self, mjd):
+        self._mjd = float(mjd)
+        self._time = None
+
+    @property
+    def time(self):
+        if self._time is None:
+            self._time = Time(self._mjd, format='mjd', scale='utc',
+                              location=P48_loc)
+        return self._time
+
+    def copy(self):
+        state = TelescopeState(self._mjd, self.ha, self.dec, self.domeaz,
+                               self.filter_id, self.zenith_seeing,
+                               self.filters,
+                               target_skycoord=self.target_skycoord)
+        state._time = self._time
+        return state
+
+    def __getitem__(self, key):
+        if key == 'current_time':
+            return self.time
+        elif key == 'current_ha':
+            return self.ha * u.deg
+        elif key == 'current_dec':
+            return self.dec * u.deg
+        elif key == 'current_domeaz':
+            return self.domeaz * u.deg
+        elif key == 'current_filter_id':
+            return self.filter_id
+        elif key == 'current_zenith_seeing':
+            return self.zenith_seeing * u.arcsec
+        elif key == 'filters':
+            return self.filters
+        elif key == 'target_skycoord':
+            return self.target_skycoord
+        else:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self.STATE_KEYS:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        return key in self.STATE_KEYS
+
+    def __iter__(self):
+        return iter(self.STATE_KEYS)
+
+    def keys(self):
+        return list(self.STATE_KEYS)
+
+    def to_dict(self):
+        """Dictionary of astropy values."""
+        return {key: self[key] for key in self.STATE_KEYS}
 
 
 class PTFObservabilityDB(object):
+    """Number of PTF exposures in each time block of each historical year,
+    for modeling weather losses.
 
-    def __init__(self):
+    The counts are held in a dense (year, block) uint8 array; blocks with
+    no exposures are zero."""
+
+    def __init__(self, time_block_size=TIME_BLOCK_SIZE):
         df = df_read_from_sqlite('weather_blocks')
-        self.df = df.set_index(['year', 'block'])
+
+        self.time_block_size = time_block_size
+        self.blocks_per_day = (1. * u.day / time_block_size).to(
+            u.dimensionless_unscaled).value
+        self.years = np.array(PTF_WEATHER_YEARS)
+        n_blocks = int(np.ceil(366. * self.blocks_per_day))
+
+        self.nexps = np.zeros((len(self.years), n_blocks), dtype=np.uint8)
+        w = (df['year'].isin(self.years) & (df['block'] >= 0) &
+             (df['block'] < n_blocks)).values
+        self.nexps[np.searchsorted(self.years, df['year'].values[w]),
+                   df['block'].values[w]] = \
+            np.clip(df['nexps'].values[w], 0, 255)
+
+    def _year_row(self, year):
+        assert(year in PTF_WEATHER_YEARS)
+        return np.searchsorted(self.years, year)
+
+    def observable_blocks(self, blocks, year=2015, nobs_min=5):
+        """Boolean array: did PTF take at least nobs_min exposures in each
+        of the given blocks in the specified year?"""
+
+        assert((nobs_min > 0))
+
+        blocks = np.atleast_1d(blocks)
+        n_blocks = self.nexps.shape[1]
+        in_range = (blocks >= 0) & (blocks < n_blocks)
+        nexps = self.nexps[self._year_row(year),
+                           np.clip(blocks, 0, n_blocks - 1)]
+        return in_range & (nexps >= nobs_min)
 
     def check_historical_observability(self, time, year=2015, nobs_min=5):
         """Given a (possibly future) UTC time, look up whether PTF 
@@ -208,7 +440,7 @@ class PTFObservabilityDB(object):
 
         Parameters
         ----------
-        time : scalar astropy Time object
+        time : scalar astropy Time object or MJD
             UTC Time
         year : int [2009 -- 2015]
             year to check PTF historical observing
@@ -220,13 +452,37 @@ class PTFObservabilityDB(object):
         boolean if nobs > nobs_min
         """
 
-        assert((year >= 2009) and (year <= 2015))
-        assert((nobs_min > 0))
-
-        block = block_index(time, time_block_size=TIME_BLOCK_SIZE)
-
-        try:
-            return self.df.loc[(year, block[0])].values[0] >= nobs_min
-        except TypeError, KeyError:
-            # blocks are unfilled if there are no observations
-            return False
+        mjd = getattr(time, 'mjd', time)
+        block = block_index_mjd(mjd, time_block_size=self.time_block_size)
+
+        return bool(self.observable_blocks(block, year=year,
+                                           nobs_min=nobs_min)[0])
+
+    def next_observable_block(self, time, year=2015, nobs_min=5):
+        """Find the first observable block at or after time (see
+        check_historical_observability), continuing into the next calendar
+        year if needed.
+
+        Returns the block index (counted from the start of its year) and
+        the MJD of the start of the block, or (None, None) if there is
+        none."""
+
+        mjd = getattr(time, 'mjd', time)
+        observable = self.nexps[self._year_row(year)] >= nobs_min
+
+        block = block_index_mjd(mjd, time_block_size=self.time_block_size)[0]
+        year_start = year_start_mjd(mjd)
+        for _ in range(2):
+            next_year_start = year_start_mjd(year_start + 366.)
+            n_blocks = int(np.ceil((next_year_start - year_start) *
+                                   self.blocks_per_day))
+            w = np.flatnonzero(observable[block:n_blocks])
+            if len(w):
+                block += w[0]
+                return block, block_index_to_mjd(
+                    block, year_start, where='start',
+                    time_block_size=self.time_block_size)[0]
+            year_start = next_year_start
+            block = 0
+
+        return None, None
@@ -1,94 +1,210 @@
+"""Functions defining cadence windows.
 
-"""Functions defining cadence windows.  Return True if the field can
-be observed at the supplied time."""
+Each cadence function takes a DataFrame of requests, the current telescope
+state, and the Fields object holding the observation history, and returns
+a boolean array that is True for requests which can be observed at the
+supplied time.
+
+Cadence parameters are stored in the request pool as numeric columns
+(see cadence_pars_to_columns) so that the windows can be evaluated for
+all requests at once."""
 
 import numpy as np
 from constants import *
+from instrumentation import timed
 
+# numeric encoding of the cadence_pars dictionaries
+REF_OBS_CODES = {'last_observed': 0, 'first_obs_tonight': 1}
+REF_OBS_NAMES = {v: k for k, v in REF_OBS_CODES.items()}
 
-def no_cadence(*args):
-    """No cadence requirement--can be observed at any time."""
-    return True
+# prev_filter is stored as a filter_id, or as one of these special values
+PREV_FILTER_ANY = 0
+PREV_FILTER_SAME = -1
+PREV_FILTER_OTHER = -2
+PREV_FILTER_CODES = {'any': PREV_FILTER_ANY, 'same': PREV_FILTER_SAME,
+                     'other': PREV_FILTER_OTHER}
+
+CADENCE_COLUMNS = ['cadence_ref_obs', 'cadence_prev_filter',
+                   'cadence_window_start', 'cadence_window_stop']
 
 
-def time_since_obs(request_row, current_state):
-    """
+def cadence_pars_to_columns(cadence_pars):
+    """Convert a cadence_pars dictionary into numeric request columns.
 
     parameters for the cadence window are given in the cadence_pars
-    dictionary of the row:
+    dictionary:
         'ref_obs': ['last_observed', 'first_obs_tonight']
             which previous observation to use as reference time
-        'prev_filter': ['same','other', 'any']
+        'prev_filter': ['same','other', 'any', [specific filter_id]]
             which filter the previous observation should be in
-        'window_start', 'window_stop'
-            relative time bounds for the window after the ref_obs time
-            e.g, window_start = 1.0*u.hour starts at ref_obs + 1 hour
-        'filter_id'
-            which filter to observe in
-        'program_id'
-            program requesting the observation
     One pair of :
-        window_start : time delta (astropy quantity)
+        window_start : time delta (days)
             time since ref observation after which observations can begin
-        window_stop : time delta (astropy quantity)
+        window_stop : time delta (days)
             time since ref observation after which observations stop.
     or:
-        window_center : time (astropy quantity)
+        window_center : time delta (days)
             middle of acceptable window since ref observation
-        window_half_width : time delta (astropy quantity)
+        window_half_width : time delta (days)
             half width of acceptable window.
 
-    prev_filter : {'same','any', 'other', [specific filterkey]}
-        which filter to use to determine time of last observation
-    """
+    Returns a dictionary keyed by CADENCE_COLUMNS; parameters not given
+    are stored as NaN."""
 
-    now = current_state['current_time'].mjd
-    pars = request_row['cadence_pars']
+    if cadence_pars is None:
+        cadence_pars = {}
 
-    # which filter are we using to determine the time of last observation?
-    # TODO: for now, require last observation to be from the same program
-    if pars['prev_filter'] == 'any':
-        ref_obses = []
-        for filter_id in FILTER_IDS:
-            ref_obses.append(request_row['{}_{}_{}'.format(
-                pars['ref_obs'],
-                request_row['program_id'], filter_id)])
-        ref_obses = np.array(ref_obses)
-        if np.sum(np.isfinite(ref_obses)):
-            ref_obs = np.max(ref_obses[np.isfinite(ref_obses)])
+    columns = {'cadence_ref_obs': np.nan, 'cadence_prev_filter': np.nan,
+               'cadence_window_start': np.nan, 'cadence_window_stop': np.nan}
+
+    if 'ref_obs' in cadence_pars:
+        columns['cadence_ref_obs'] = REF_OBS_CODES[cadence_pars['ref_obs']]
+
+    if 'prev_filter' in cadence_pars:
+        prev_filter = cadence_pars['prev_filter']
+        if prev_filter in PREV_FILTER_CODES:
+            columns['cadence_prev_filter'] = PREV_FILTER_CODES[prev_filter]
+        elif prev_filter in FILTER_IDS:
+            columns['cadence_prev_filter'] = prev_filter
         else:
-            # no previous observations
-            ref_obs = np.nan
-    else:
-        if pars['prev_filter'] == 'same':
-            ref_obs_filter = request_row['filter_id']
-        elif pars['prev_filter'] == 'other':
-            assert(len(FILTER_IDS) == 2)
-            raise NotImplementedError
-        elif pars['prev_filter'] in FILTER_IDS:
-            ref_obs_filter = pars['prev_filter']
-
-        ref_obs = request_row['{}_{}_{}'.format(
-            pars['ref_obs'],
-            request_row['program_id'], request_row['filter_id'])]
-
-    if np.isnan(ref_obs):
-        # for first_obs_tonight scheduling, have to wait until first obs is
-        # taken
-        return False
-
-    if pars.has_key('window_start') and pars.has_key('window_stop'):
-        window_start_ut = ref_obs + pars['window_start']
-        window_stop_ut = ref_obs + pars['window_stop']
-    elif pars.has_key('window_center') and pars.has_key('window_half_width'):
-        window_start_ut = ref_obs + \
-            pars['window_center'] - pars['window_half_width']
-        window_stop_ut = ref_obs + \
-            pars['window_center'] + pars['window_half_width']
-
-    return window_start_ut <= now <= window_stop_ut
-
-
-def absolute_time_window(request_row, current_state):
+            raise ValueError('Unknown prev_filter {}'.format(prev_filter))
+
+    if ('window_start' in cadence_pars) and ('window_stop' in cadence_pars):
+        columns['cadence_window_start'] = cadence_pars['window_start']
+        columns['cadence_window_stop'] = cadence_pars['window_stop']
+    elif (('window_center' in cadence_pars) and
+          ('window_half_width' in cadence_pars)):
+        columns['cadence_window_start'] = \
+            cadence_pars['window_center'] - cadence_pars['window_half_width']
+        columns['cadence_window_stop'] = \
+            cadence_pars['window_center'] + cadence_pars['window_half_width']
+
+    return columns
+
+
+def no_cadence(df, current_state, fields):
+    """No cadence requirement--can be observed at any time."""
+    return np.ones(len(df), dtype=bool)
+
+
+def _reference_times(df, fields):
+    """Return an array (n_requests, n_filters) of reference observation
+    times, taken from the observation state arrays of fields."""
+
+    ref_codes = df['cadence_ref_obs'].values
+    program_ids = df['program_id'].values
+    rows = fields.field_rows(df['field_id'].values)
+
+    ref_times = np.full((len(df), len(FILTER_IDS)), np.nan)
+    for ref_code, ref_name in REF_OBS_NAMES.items():
+        # Fields.last_observed or Fields.first_obs_tonight;
+        # the last axis is ordered as FILTER_IDS
+        state = getattr(fields, ref_name)
+        for program_id in PROGRAM_IDS:
+            w = (ref_codes == ref_code) & (program_ids == program_id)
+            if not np.sum(w):
+                continue
+            pi, _ = fields.program_filter_index(program_id,
+                                                list(FILTER_IDS))
+            ref_times[w, :] = state[rows[w], pi[0], :]
+
+    return ref_times
+
+
+def _time_since_obs_windows(df, fields):
+    """Return arrays of the start and stop MJDs of the time_since_obs
+    windows of the requests in df; NaN if there is no reference
+    observation."""
+
+    prev_filter = df['cadence_prev_filter'].values
+
+    if np.sum(prev_filter == PREV_FILTER_OTHER):
+        assert(len(FILTER_IDS) == 2)
+        raise NotImplementedError
+
+    ref_times = _reference_times(df, fields)
+
+    # which filter are we using to determine the time of last observation?
+    ref_filter = np.where(prev_filter == PREV_FILTER_SAME,
+                          df['filter_id'].values, prev_filter)
+    ref_obs = np.full(len(df), np.nan)
+    for i, filter_id in enumerate(FILTER_IDS):
+        w = ref_filter == filter_id
+        ref_obs[w] = ref_times[w, i]
+
+    w_any = prev_filter == PREV_FILTER_ANY
+    if np.sum(w_any):
+        # most recent observation in any filter; all-NaN rows stay NaN
+        any_times = ref_times[w_any, :]
+        finite = np.isfinite(any_times)
+        latest = np.where(finite, any_times, -np.inf).max(axis=1)
+        latest[~finite.any(axis=1)] = np.nan
+        ref_obs[w_any] = latest
+
+    # NaN reference times (e.g., first_obs_tonight scheduling before the
+    # first obs is taken) compare False, so are never in the window
+    window_start_ut = ref_obs + df['cadence_window_start'].values
+    window_stop_ut = ref_obs + df['cadence_window_stop'].values
+
+    return window_start_ut, window_stop_ut
+
+
+def time_since_obs(df, current_state, fields):
+    """Requests are observable within a window relative to a previous
+    observation of the field.
+
+    Uses the cadence_ref_obs, cadence_prev_filter, cadence_window_start,
+    and cadence_window_stop columns of df (see cadence_pars_to_columns).
+    TODO: for now, require last observation to be from the same program"""
+
+    now = current_state['current_time'].mjd
+    window_start_ut, window_stop_ut = _time_since_obs_windows(df, fields)
+
+    return (window_start_ut <= now) & (now <= window_stop_ut)
+
+
+def absolute_time_window(df, current_state, fields):
     """stub for assigning fields specific UTC slots"""
     raise NotImplementedError
+
+
+# registry of cadence functions, keyed by the cadence_func request column
+CADENCE_FUNCTIONS = {'no_cadence': no_cadence,
+                     'time_since_obs': time_since_obs,
+                     'absolute_time_window': absolute_time_window}
+
+
+@timed('cadence')
+def enabled_cadence_windows(df, current_state, fields):
+    """Evaluate the cadence function of every request in df, using the
+    observation history stored in fields.
+
+    Returns a boolean array aligned with the rows of df."""
+
+    in_window = np.zeros(len(df), dtype=bool)
+    cadence_funcs = df['cadence_func'].values
+    for cadence_func in np.unique(cadence_funcs):
+        if cadence_func not in CADENCE_FUNCTIONS:
+            raise ValueError('Unknown cadence function {}'.format(
+                cadence_func))
+        w = cadence_funcs == cadence_func
+        in_window[w] = CADENCE_FUNCTIONS[cadence_func](df[w], current_state,
+                                                       fields)
+
+    return in_window
+
+
+def next_window_opening(df, current_state, fields):
+    """Return the earliest MJD after the current time at which a cadence
+    window of a request in df opens, or inf if none will."""
+
+    now = current_state['current_time'].mjd
+    w = df['cadence_func'].values == 'time_since_obs'
+    if not np.sum(w):
+        return np.inf
+
+    window_start_ut, _ = _time_since_obs_windows(df[w], fields)
+    future = window_start_ut[window_start_ut > now]
+    if not len(future):
+        return np.inf
+    return np.min(future)
@@ -31,10 +31,13 @@ class ZTFConfiguration(object):
                 raise ValueError('{} not in known programs'.format(
                     prog['program_name']))
 
-    def build_observing_programs(self):
+    def build_observing_programs(self, fields=None):
 
         OPs = []
-        f = Fields()
+        if fields is None:
+            f = Fields()
+        else:
+            f = fields
         for prog in self.config['observing_programs']:
             field_ids = f.select_field_ids(**prog['field_selections'])
             OP = ObservingProgram(PROGRAM_NAME_TO_ID[prog['program_name']],
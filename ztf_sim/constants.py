@@ -3,14 +3,23 @@ import numpy as np
 from astropy.time import Time
 import astropy.coordinates as coords
 import astropy.units as u
-import astroplan
 
 P48_loc = coords.EarthLocation(lat=coords.Latitude('33d21m26.35s'),
                                lon=coords.Longitude('-116d51m32.04s'),
                                height=1707.)
 
-# use UTC only
-P48_Observer = astroplan.Observer(location=P48_loc)
+_P48_Observer = None
+
+
+def get_P48_Observer():
+    """astroplan Observer at P48, created (and astroplan imported) on
+    first use."""
+    global _P48_Observer
+    if _P48_Observer is None:
+        import astroplan
+        # use UTC only
+        _P48_Observer = astroplan.Observer(location=P48_loc)
+    return _P48_Observer
 
 # HA and Dec from http://www.oir.caltech.edu/twiki_oir/bin/view/Palomar/ZTF/TelescopeSpecifications v5
 # Dome estimate from Jeff Z email, 9/21/15
@@ -56,6 +65,9 @@ MAX_AIRMASS = 2.5
 
 TIME_BLOCK_SIZE = 20. * u.min
 
+# years of PTF observing history available for historical weather
+PTF_WEATHER_YEARS = range(2009, 2016)
+
 PROGRAM_NAME_TO_ID = {'collaboration': 1, 'MSIP': 2, 'Caltech': 3}
 PROGRAM_NAMES = PROGRAM_NAME_TO_ID.keys()
 PROGRAM_ID_TO_NAME = {v: k for k, v in PROGRAM_NAME_TO_ID.items()}
@@ -72,10 +84,10 @@ FILTER_IDS = FILTER_ID_TO_NAME.keys()
 PIXEL_SCALE = 1.006  # arcsec/pixel
 
 
-def slew_time(axis, angle):
-    vmax = P48_slew_pars[axis]['vmax']
-    acc = P48_slew_pars[axis]['accel']
-    dec = P48_slew_pars[axis]['decel']
+def slew_time(axis, angle, slew_pars=P48_slew_pars):
+    vmax = slew_pars[axis]['vmax']
+    acc = slew_pars[axis]['accel']
+    dec = slew_pars[axis]['decel']
 
     t_acc = vmax / acc
     t_dec = vmax / dec
@@ -0,0 +1,214 @@
+"""Precomputed Sun and Moon ephemeris and nightly twilight calendar for
+the survey span."""
+
+import os
+import numpy as np
+import astropy.coordinates as coord
+import astropy.units as u
+from astropy.time import Time
+from constants import *
+from utils import *
+
+EPHEMERIS_STEP = 5. * u.min
+
+# quantities stored on the time grid.  Angles are in degrees;
+# RA and azimuth are stored unwrapped so they can be interpolated.
+EPHEMERIS_KEYS = ['sun_ra', 'sun_dec', 'sun_alt', 'sun_az',
+                  'moon_ra', 'moon_dec', 'moon_alt', 'moon_az',
+                  'moon_illumination']
+WRAPPED_KEYS = ['sun_ra', 'sun_az', 'moon_ra', 'moon_az']
+
+# maximum interpolation errors of the EPHEMERIS_STEP grid (see
+# check_accuracy): degrees for angles, fraction for moon_illumination.
+# Azimuth errors are largest near the zenith.
+EPHEMERIS_TOLERANCE_DEG = 0.1
+EPHEMERIS_TOLERANCE_ILLUMINATION = 0.001
+
+
+class Ephemeris(object):
+    """Sun and Moon positions and lunar illumination, computed with astropy
+    on a fixed time grid and served by linear interpolation.
+
+    The grid is saved to ../data and reused by later runs over the same
+    dates."""
+
+    def __init__(self, start_time, stop_time, step=EPHEMERIS_STEP,
+                 directory='../data'):
+
+        self.step = step.to(u.day).value
+        # pad by a day so interpolation is valid at the ends of the survey
+        self.mjd_start = np.floor(start_time.mjd) - 1.
+        self.mjd_stop = np.ceil(stop_time.mjd) + 1.
+        n_steps = np.round(
+            (self.mjd_stop - self.mjd_start) / self.step).astype(int)
+        self.mjd = self.mjd_start + np.arange(n_steps + 1) * self.step
+
+        filename = '{}/ephemeris_{:.0f}_{:.0f}_{:.0f}s.npz'.format(
+            directory, self.mjd_start, self.mjd_stop,
+            step.to(u.second).value)
+
+        if os.path.exists(filename):
+            data = np.load(filename)
+            self.data = {k: data[k] for k in EPHEMERIS_KEYS}
+        else:
+            self.data = self._compute(self.mjd)
+            atomic_savez(filename, **self.data)
+
+    @staticmethod
+    def _compute(mjd):
+        """Compute the ephemeris directly with astropy at the given MJDs."""
+        import astroplan.moon
+
+        t = Time(mjd, format='mjd', scale='utc', location=P48_loc)
+
+        sun = coord.get_sun(t)
+        sun_altaz = skycoord_to_altaz(sun, t)
+        moon = coord.get_moon(t, P48_loc)
+        moon_altaz = skycoord_to_altaz(moon, t)
+
+        data = {'sun_ra': sun.ra.to(u.deg).value,
+                'sun_dec': sun.dec.to(u.deg).value,
+                'sun_alt': sun_altaz.alt.to(u.deg).value,
+                'sun_az': sun_altaz.az.to(u.deg).value,
+                'moon_ra': moon.ra.to(u.deg).value,
+                'moon_dec': moon.dec.to(u.deg).value,
+                'moon_alt': moon_altaz.alt.to(u.deg).value,
+                'moon_az': moon_altaz.az.to(u.deg).value,
+                # Don't use P48_loc to avoid astropy bug:
+                # https://github.com/astropy/astroplan/pull/213
+                'moon_illumination': astroplan.moon.moon_illumination(t)}
+
+        for key in WRAPPED_KEYS:
+            if np.ndim(data[key]):
+                data[key] = np.degrees(np.unwrap(np.radians(data[key])))
+
+        return data
+
+    def at(self, time):
+        """Interpolate the ephemeris.
+
+        time : astropy Time or MJD (scalar or array)
+
+        Returns a dictionary keyed by EPHEMERIS_KEYS; angles are in degrees
+        and moon_illumination is a fraction."""
+
+        mjd = getattr(time, 'mjd', time)
+
+        if ((np.min(mjd) < self.mjd[0]) or (np.max(mjd) > self.mjd[-1])):
+            raise ValueError('Time outside of the ephemeris range')
+
+        values = {}
+        for key in EPHEMERIS_KEYS:
+            values[key] = np.interp(mjd, self.mjd, self.data[key])
+            if key in WRAPPED_KEYS:
+                values[key] = values[key] % 360.
+
+        return values
+
+    def check_accuracy(self, n=100, seed=0):
+        """Compare interpolated values to astropy at random times.
+
+        Returns a dictionary of the maximum absolute differences
+        (degrees; fraction for moon_illumination)."""
+
+        rng = np.random.RandomState(seed)
+        mjd = rng.uniform(self.mjd[0], self.mjd[-1], n)
+        direct = self._compute(mjd)
+        interpolated = self.at(mjd)
+
+        max_diff = {}
+        for key in EPHEMERIS_KEYS:
+            diff = interpolated[key] - direct[key]
+            if key in WRAPPED_KEYS:
+                diff = (diff + 180.) % 360. - 180.
+            max_diff[key] = np.max(np.abs(diff))
+
+        return max_diff
+
+
+# UTC time of local noon at P48, as a fraction of a day; nights are
+# labeled by the MJD of the preceding local noon
+LOCAL_NOON_MJD_FRACTION = ((12. - P48_LON_DEG / 15.) / 24.) % 1.
+
+
+class SurveyCalendar(object):
+    """Evening and morning 12 degree twilights, observing block ranges, and
+    hours of darkness for every night of the survey.
+
+    Computed once with astroplan and saved to ../data, keyed by site and
+    date range."""
+
+    def __init__(self, start_time, stop_time,
+                 time_block_size=TIME_BLOCK_SIZE, directory='../data'):
+
+        # pad by a night on each side
+        first_night = np.floor(start_time.mjd) - 1.
+        last_night = np.ceil(stop_time.mjd) + 1.
+        # local noon preceding each night
+        self.noon_mjd = np.arange(first_night, last_night + 1.) + \
+            LOCAL_NOON_MJD_FRACTION
+
+        filename = '{}/calendar_{:.4f}_{:.4f}_{:.0f}_{:.0f}.npz'.format(
+            directory, P48_LAT_DEG, P48_LON_DEG, first_night, last_night)
+
+        if os.path.exists(filename):
+            data = np.load(filename)
+            self.evening_mjd = data['evening_mjd']
+            self.morning_mjd = data['morning_mjd']
+        else:
+            self.evening_mjd = np.zeros(len(self.noon_mjd))
+            self.morning_mjd = np.zeros(len(self.noon_mjd))
+            for i, noon in enumerate(self.noon_mjd):
+                t = Time(noon, format='mjd', scale='utc')
+                self.evening_mjd[i] = next_12deg_evening_twilight(t).mjd
+                self.morning_mjd[i] = next_12deg_morning_twilight(t).mjd
+            atomic_savez(filename, evening_mjd=self.evening_mjd,
+                         morning_mjd=self.morning_mjd)
+
+        self.time_block_size = time_block_size
+        self.block_start = block_index(
+            Time(self.evening_mjd, format='mjd', scale='utc'),
+            time_block_size=time_block_size)
+        self.block_end = block_index(
+            Time(self.morning_mjd, format='mjd', scale='utc'),
+            time_block_size=time_block_size)
+        self.dark_hours = (self.morning_mjd - self.evening_mjd) * 24.
+
+    def night_index(self, mjd):
+        """Index of the night (local noon to local noon) containing mjd."""
+        i = np.searchsorted(self.noon_mjd, mjd, side='right') - 1
+        if (np.min(i) < 0) or (np.max(i) >= len(self.noon_mjd) - 1):
+            raise ValueError('Time outside of the calendar range')
+        return i
+
+    def upcoming_night_index(self, mjd):
+        """Index of the night in progress at mjd, or of the next night
+        if it is daytime (cf. utils.nightly_blocks)."""
+        i = self.night_index(mjd)
+        return np.where(mjd > self.morning_mjd[i], i + 1, i)
+
+    def is_dark(self, mjd):
+        """Is the Sun below 12 degree twilight at mjd?"""
+        i = self.night_index(mjd)
+        return (mjd >= self.evening_mjd[i]) & (mjd < self.morning_mjd[i])
+
+    def next_evening_twilight(self, mjd):
+        """MJD of the next 12 degree evening twilight after mjd."""
+        i = self.night_index(mjd)
+        return np.where(mjd < self.evening_mjd[i], self.evening_mjd[i],
+                        self.evening_mjd[i + 1])
+
+    def nightly_blocks(self, time):
+        """Return block numbers and midpoint times for a given night.
+        Equivalent to utils.nightly_blocks."""
+        i = self.upcoming_night_index(time.mjd)
+        blocks = np.arange(self.block_start[i], self.block_end[i] + 1, 1)
+        times = block_index_to_time(blocks, time,
+                                    time_block_size=self.time_block_size)
+        return blocks, times
+
+    def hours_of_darkness(self, time):
+        """Hours between 12 degree twilights of the night in progress at
+        time, or of the next night.  cf. utils.approx_hours_of_darkness"""
+        i = self.upcoming_night_index(time.mjd)
+        return np.atleast_1d(self.dark_hours[i]) * u.hour
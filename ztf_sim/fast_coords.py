@@ -0,0 +1,126 @@
+"""Analytic alt/az and hour angle transformations for the P48 site.
+
+These work on float arrays of RA/Dec (degrees) and MJD (UTC) and avoid the
+astropy SkyCoord machinery, which remains the reference implementation.
+
+Approximations: GMST from the IAU 1982 polynomial with UT1 = UTC
+(as in utils.RA_to_HA), IAU 1976 precession only (no nutation or
+aberration), and no atmospheric refraction (astropy's AltAz default).
+The resulting alt/az agree with astropy to better than
+FAST_ALTAZ_TOLERANCE_ARCMIN (see tests/test_fast_coords.py)."""
+
+import numpy as np
+import astropy.units as u
+from constants import *
+
+P48_LAT_DEG = P48_loc.lat.to(u.deg).value
+P48_LON_DEG = P48_loc.lon.to(u.deg).value
+
+MJD_J2000 = 51544.5
+
+FAST_ALTAZ_TOLERANCE_ARCMIN = 1.
+
+# length of the sidereal day in solar days
+SIDEREAL_DAY = 0.9972695663
+
+
+def gmst_deg(mjd):
+    """Greenwich mean sidereal time in degrees (IAU 1982)."""
+    d = np.asarray(mjd, dtype=float) - MJD_J2000
+    t = d / 36525.
+    gmst = 280.46061837 + 360.98564736629 * d + \
+        0.000387933 * t**2. - t**3. / 38710000.
+    return gmst % 360.
+
+
+def lst_deg(mjd, longitude=P48_LON_DEG):
+    """Local mean sidereal time in degrees."""
+    return (gmst_deg(mjd) + longitude) % 360.
+
+
+def ra_to_ha_deg(ra, mjd, longitude=P48_LON_DEG):
+    """Convert RA (degrees) to hour angle (degrees, [0, 360))"""
+    return (lst_deg(mjd, longitude=longitude) - ra) % 360.
+
+
+def ha_to_ra_deg(ha, mjd, longitude=P48_LON_DEG):
+    """Convert hour angle (degrees) to RA (degrees, [0, 360))"""
+    return (lst_deg(mjd, longitude=longitude) - ha) % 360.
+
+
+def precess_from_j2000(ra, dec, mjd):
+    """Precess J2000 RA/Dec (degrees) to the mean equator of date."""
+
+    t = (np.asarray(mjd, dtype=float) - MJD_J2000) / 36525.
+    arcsec = np.pi / 180. / 3600.
+    zeta = (2306.2181 * t + 0.30188 * t**2. + 0.017998 * t**3.) * arcsec
+    z = (2306.2181 * t + 1.09468 * t**2. + 0.018203 * t**3.) * arcsec
+    theta = (2004.3109 * t - 0.42665 * t**2. - 0.041833 * t**3.) * arcsec
+
+    ra0 = np.radians(ra)
+    dec0 = np.radians(dec)
+
+    a = np.cos(dec0) * np.sin(ra0 + zeta)
+    b = np.cos(theta) * np.cos(dec0) * np.cos(ra0 + zeta) - \
+        np.sin(theta) * np.sin(dec0)
+    c = np.sin(theta) * np.cos(dec0) * np.cos(ra0 + zeta) + \
+        np.cos(theta) * np.sin(dec0)
+
+    ra_date = np.degrees(np.arctan2(a, b) + z) % 360.
+    dec_date = np.degrees(np.arcsin(np.clip(c, -1., 1.)))
+
+    return ra_date, dec_date
+
+
+def hadec_to_altaz_deg(ha, dec, latitude=P48_LAT_DEG):
+    """Convert hour angle and declination (degrees) to altitude and
+    azimuth (degrees, azimuth measured from North through East)."""
+
+    ha = np.radians(ha)
+    dec = np.radians(dec)
+    lat = np.radians(latitude)
+
+    sin_alt = np.sin(dec) * np.sin(lat) + \
+        np.cos(dec) * np.cos(lat) * np.cos(ha)
+    alt = np.degrees(np.arcsin(np.clip(sin_alt, -1., 1.)))
+    az = np.degrees(np.arctan2(-np.cos(dec) * np.sin(ha),
+                               np.sin(dec) * np.cos(lat) -
+                               np.cos(dec) * np.sin(lat) * np.cos(ha)))
+
+    return alt, az % 360.
+
+
+def altaz_deg(ra, dec, mjd, latitude=P48_LAT_DEG, longitude=P48_LON_DEG):
+    """Compute altitude and azimuth (degrees) of ICRS RA/Dec (degrees)
+    at the given UTC MJD(s)."""
+
+    ra_date, dec_date = precess_from_j2000(ra, dec, mjd)
+    ha = lst_deg(mjd, longitude=longitude) - ra_date
+
+    return hadec_to_altaz_deg(ha, dec_date, latitude=latitude)
+
+
+def days_until_rise(ra, dec, mjd, altitude, latitude=P48_LAT_DEG,
+                    longitude=P48_LON_DEG):
+    """Time (days) from mjd until each ICRS RA/Dec (degrees) next rises
+    through altitude (degrees).
+
+    Positions that are always above or always below the altitude
+    return inf."""
+
+    ra_date, dec_date = precess_from_j2000(ra, dec, mjd)
+    lat = np.radians(latitude)
+    dec_rad = np.radians(dec_date)
+
+    # hour angle at which the position crosses the altitude
+    cos_h0 = ((np.sin(np.radians(altitude)) - np.sin(lat) * np.sin(dec_rad)) /
+              (np.cos(lat) * np.cos(dec_rad)))
+    crosses = np.abs(cos_h0) <= 1.
+    h0 = np.degrees(np.arccos(np.clip(cos_h0, -1., 1.)))
+
+    # rising at hour angle -h0
+    ha = lst_deg(mjd, longitude=longitude) - ra_date
+    dha = (-h0 - ha) % 360.
+
+    return np.where(crosses, dha / 360. * SIDEREAL_DAY, np.inf)
+
@@ -9,59 +9,228 @@ import astropy.units as u
 from astropy.time import Time
 from collections import defaultdict
 import itertools
+import hashlib
+import os
+from slew import SlewModel, axis_separation
+
+# resolution and precession epoch of the LST-indexed alt/az tables
+LST_TABLE_RESOLUTION = 1. * u.min
+# default epoch; observe.py uses the middle of the survey
+LST_TABLE_EPOCH = Time('2019-01-01', scale='utc')
+# accuracy of interpolated lookups within 1.5 years of the epoch
+LST_TABLE_TOLERANCE_ARCMIN = 2.
+
+# largest number of distinct field decs for which dec slew times between
+# all pairs are cached
+MAX_DEC_SLEW_MATRIX_SIZE = 5000
 
 
 class Fields(object):
     """Class for accessing field grid."""
     # TODO: consider using some of PTFFields.py code
 
-    def __init__(self, dbname='test_fields'):
-        self._load_fields(dbname=dbname)
+    def __init__(self, dbname='test_fields', lst_table=False,
+                 lst_resolution=LST_TABLE_RESOLUTION,
+                 lst_interpolate=True, field_grid=None, min_dec=-30.,
+                 slew_model=None, lst_epoch=LST_TABLE_EPOCH):
+        self.dbname = dbname
+        if slew_model is None:
+            slew_model = SlewModel()
+        self.slew_model = slew_model
+        self._load_fields(dbname=dbname, field_grid=field_grid,
+                          min_dec=min_dec)
         self.loc = P48_loc
         self.current_block_night_mjd = None  # np.floor(time.mjd)
         self.current_blocks = None
+        self.block_times = None
         self.block_alt = None
         self.block_az = None
+        self.clear_block_sky()
         self.observable_hours = None
-
-    def _load_fields(self, dbname='test_fields'):
-        """Loads a field grid from ../data/{dbname}.db.
+        self.lst_interpolate = lst_interpolate
+        self.altaz_table = None
+        if lst_table:
+            self._load_altaz_table(lst_resolution=lst_resolution,
+                                   epoch=lst_epoch)
+
+    def _load_fields(self, dbname='test_fields', field_grid=None,
+                     min_dec=-30.):
+        """Loads a field grid from ../data/{dbname}.db, or uses the
+        supplied field_grid DataFrame.
         Expects field_id, ra (deg), dec (deg) columns"""
-        df = df_read_from_sqlite(dbname, index_col='field_id')
+        if field_grid is None:
+            df = df_read_from_sqlite(dbname, index_col='field_id')
+        else:
+            df = field_grid
+            if df.index.name != 'field_id':
+                df = df.set_index('field_id')
 
         # drop fields below dec of -30 degrees for speed
-        df = df[df['dec'] >= -30]
-
-        # initialize the last observed time
-        # TODO: load last observed time per filter & program
-
-        for program_id in PROGRAM_IDS:
-            for filter_id in FILTER_IDS:
-                df['last_observed_{}_{}'.format(program_id, filter_id)] = \
-                    Time('2001-01-01').mjd
-                df['first_obs_tonight_{}_{}'.format(program_id, filter_id)] = \
-                    np.nan
-
-        # TODO: load total observations per filter & program
-
-        for program_id in PROGRAM_IDS:
-            for filter_id in FILTER_IDS:
-                df['n_obs_{}_{}'.format(program_id, filter_id)] = 0
+        df = df[df['dec'] >= min_dec]
+        self.field_grid = df
+
+        # observation state by (field, program, filter), with rows in the
+        # order of self.field_grid
+        # TODO: load last observed time and total observations
+        # per filter & program
+        self._field_rows = {field_id: i for i, field_id in
+                            enumerate(df.index)}
+        self._program_index = {program_id: i for i, program_id in
+                               enumerate(PROGRAM_IDS)}
+        self._filter_index = {filter_id: i for i, filter_id in
+                              enumerate(FILTER_IDS)}
+        # the same indices for vectorized lookups (see program_filter_index)
+        self._program_ids = np.array(list(PROGRAM_IDS))
+        self._program_sorter = np.argsort(self._program_ids)
+        self._filter_ids = np.array(list(FILTER_IDS))
+        self._filter_sorter = np.argsort(self._filter_ids)
+        shape = (len(df), len(PROGRAM_IDS), len(FILTER_IDS))
+        self.last_observed = np.full(shape, Time('2001-01-01').mjd)
+        self.first_obs_tonight = np.full(shape, np.nan)
+        self.n_obs = np.zeros(shape, dtype=int)
+        self._fields_view = None
+        self._dec_slew = None
 
-        self.fields = df
         self.field_coords = self._field_coords()
 
+    @property
+    def fields(self):
+        """DataFrame of the field grid plus last_observed_{p}_{f},
+        first_obs_tonight_{p}_{f}, and n_obs_{p}_{f} columns.
+
+        This is a read-only view of the observation state arrays: it is
+        rebuilt after the state changes, and writes to it are not stored."""
+
+        if self._fields_view is None:
+            df = self.field_grid.copy()
+            for program_id in PROGRAM_IDS:
+                pi = self._program_index[program_id]
+                for filter_id in FILTER_IDS:
+                    fi = self._filter_index[filter_id]
+                    df['last_observed_{}_{}'.format(program_id, filter_id)] = \
+                        self.last_observed[:, pi, fi]
+                    df['first_obs_tonight_{}_{}'.format(program_id,
+                                                        filter_id)] = \
+                        self.first_obs_tonight[:, pi, fi]
+            for program_id in PROGRAM_IDS:
+                pi = self._program_index[program_id]
+                for filter_id in FILTER_IDS:
+                    fi = self._filter_index[filter_id]
+                    df['n_obs_{}_{}'.format(program_id, filter_id)] = \
+                        self.n_obs[:, pi, fi]
+            self._fields_view = df
+        return self._fields_view
+
+    def field_rows(self, field_ids):
+        """Convert field_ids to row indices of the observation state arrays."""
+        rows = self.field_grid.index.get_indexer(np.atleast_1d(field_ids))
+        if np.sum(rows < 0):
+            raise KeyError('Unknown field_ids')
+        return rows
+
+    def program_filter_index(self, program_ids, filter_ids):
+        """Convert program_ids and filter_ids to indices of the second and
+        third axes of the observation state arrays."""
+        pi = _id_index(self._program_ids, self._program_sorter, program_ids)
+        fi = _id_index(self._filter_ids, self._filter_sorter, filter_ids)
+        return pi, fi
+
     def _field_coords(self, cuts=None):
         """Generate an astropy SkyCoord object for current fields"""
         if cuts is None:
-            fields = self.fields
+            fields = self.field_grid
         else:
-            fields = self.fields[cuts]
+            fields = self.field_grid[cuts]
         return coord.SkyCoord(fields['ra'],
                               fields['dec'], frame='icrs', unit='deg')
 
-    def compute_blocks(self, time, time_block_size=TIME_BLOCK_SIZE):
-        """Store alt/az for tonight in blocks"""
+    def _altaz_table_filename(self, n_lst_bins, epoch=LST_TABLE_EPOCH):
+        """Name of the alt/az table file, keyed by a hash of the field grid
+        and the table parameters."""
+        h = hashlib.md5()
+        h.update(self.field_grid.index.values.astype(np.int64).tobytes())
+        h.update(self.field_grid['ra'].values.astype(np.float64).tobytes())
+        h.update(self.field_grid['dec'].values.astype(np.float64).tobytes())
+        h.update('{}_{}'.format(n_lst_bins, epoch.mjd).encode('ascii'))
+        return '../data/{}_altaz_{}.npy'.format(self.dbname,
+                                                h.hexdigest()[:12])
+
+    def _load_altaz_table(self, lst_resolution=LST_TABLE_RESOLUTION,
+                          epoch=LST_TABLE_EPOCH):
+        """Load (building if needed) the (2, LST bins, fields) float32 table
+        of altitude and azimuth for each field.
+
+        For a fixed site alt/az is a function of LST only; positions are
+        precessed to epoch, which should be the middle of the survey.  With
+        interpolation between LST bins (lst_interpolate, the default),
+        lookups agree with skycoord_to_altaz to better than
+        LST_TABLE_TOLERANCE_ARCMIN over a three year survey; without it the
+        1 minute bins give errors of up to 15 arcminutes.  The table is
+        saved next to the field database and memory-mapped."""
+
+        n_lst_bins = np.round(
+            (1. * u.day / lst_resolution).decompose().value).astype(int)
+        filename = self._altaz_table_filename(n_lst_bins, epoch=epoch)
+
+        if not os.path.exists(filename):
+            ra, dec = precess_from_j2000(self.field_grid['ra'].values,
+                                         self.field_grid['dec'].values,
+                                         epoch.mjd)
+            lst = np.arange(n_lst_bins) * 360. / n_lst_bins
+            table = np.zeros((2, n_lst_bins, len(self.field_grid)),
+                             dtype=np.float32)
+            for i, lst_i in enumerate(lst):
+                alt, az = hadec_to_altaz_deg(lst_i - ra, dec)
+                table[0, i, :] = alt
+                table[1, i, :] = az
+            atomic_save(filename, table)
+
+        self.altaz_table = np.load(filename, mmap_mode='r')
+
+    def _lookup_altaz(self, mjd, columns=None):
+        """Look up alt/az (degrees) in the LST table.
+
+        mjd : scalar or array
+        columns : optional index array or boolean mask of fields
+
+        Returns arrays of shape (n_fields,) for scalar mjd,
+        or (n_times, n_fields)."""
+
+        n_lst_bins = self.altaz_table.shape[1]
+        lst_bin = lst_deg(mjd) * n_lst_bins / 360.
+        i0 = np.floor(lst_bin).astype(int) % n_lst_bins
+
+        alt0 = self.altaz_table[0, i0, :]
+        az0 = self.altaz_table[1, i0, :]
+        if columns is not None:
+            alt0 = alt0[..., columns]
+            az0 = az0[..., columns]
+
+        if not self.lst_interpolate:
+            return np.array(alt0), np.array(az0)
+
+        i1 = (i0 + 1) % n_lst_bins
+        alt1 = self.altaz_table[0, i1, :]
+        az1 = self.altaz_table[1, i1, :]
+        if columns is not None:
+            alt1 = alt1[..., columns]
+            az1 = az1[..., columns]
+
+        w = (lst_bin - np.floor(lst_bin))
+        if np.ndim(w):
+            w = w[:, np.newaxis]
+        alt = alt0 + w * (alt1 - alt0)
+        # interpolate azimuth across the 0/360 wrap
+        daz = (az1 - az0 + 180.) % 360. - 180.
+        az = (az0 + w * daz) % 360.
+        return alt, az
+
+    def compute_blocks(self, time, time_block_size=TIME_BLOCK_SIZE,
+                       calendar=None):
+        """Store alt/az for tonight in blocks
+
+        If a SurveyCalendar is supplied, take tonight's blocks from it
+        rather than recomputing the twilight times."""
 
         # TODO: does this really belong in Fields, since it changes night to
         # night?
@@ -72,20 +241,32 @@ class Fields(object):
             return
 
         self.current_block_night_mjd = block_night
+        self.clear_block_sky()
 
-        blocks, times = nightly_blocks(time, time_block_size=time_block_size)
+        if calendar is not None:
+            blocks, times = calendar.nightly_blocks(time)
+        else:
+            blocks, times = nightly_blocks(time,
+                                           time_block_size=time_block_size)
         self.current_blocks = blocks
-
-        alt_blocks = {}
-        az_blocks = {}
-        for bi, ti in zip(blocks, times):
-            altaz = self.alt_az(ti)
-            alt_blocks[bi] = altaz.alt
-            az_blocks[bi] = altaz.az
+        self.block_times = times
 
         # DataFrames indexed by field_id, columns are block numbers
-        self.block_alt = pd.DataFrame(alt_blocks)
-        self.block_az = pd.DataFrame(az_blocks)
+        if self.altaz_table is not None:
+            alt, az = self._lookup_altaz(times.mjd)
+            index = self.field_grid.index
+            self.block_alt = pd.DataFrame(alt.T, index=index, columns=blocks)
+            self.block_az = pd.DataFrame(az.T, index=index, columns=blocks)
+        else:
+            alt_blocks = {}
+            az_blocks = {}
+            for bi, ti in zip(blocks, times):
+                altaz = self.alt_az(ti)
+                alt_blocks[bi] = altaz.alt
+                az_blocks[bi] = altaz.az
+
+            self.block_alt = pd.DataFrame(alt_blocks)
+            self.block_az = pd.DataFrame(az_blocks)
 
         block_airmass = altitude_to_airmass(self.block_alt)
         w = (block_airmass <= MAX_AIRMASS) & (block_airmass >= 1.0)
@@ -94,6 +275,28 @@ class Fields(object):
         mean_observable_airmass.name = 'mean_observable_airmass'
         self.mean_observable_airmass = mean_observable_airmass
 
+    def clear_block_sky(self):
+        """Discard tonight's sky brightness and limiting magnitude cubes.
+
+        block_sky_brightness and block_limiting_mag are float32 arrays of
+        shape (field, filter, block), with the axes in the order of
+        field_grid, FILTER_IDS, and current_blocks, and NaN where they were
+        not computed.  QueueManager fills them at the start of the night."""
+        self.block_sky_brightness = None
+        self.block_limiting_mag = None
+        self.block_zenith_seeing = None
+
+    def block_sky_index(self, block):
+        """Index of block on the last axis of the block sky cubes, or None
+        if they are not computed or do not include it."""
+        if self.block_sky_brightness is None:
+            return None
+        i = np.searchsorted(self.current_blocks, block)
+        if (i == len(self.current_blocks)) or \
+                (self.current_blocks[i] != block):
+            return None
+        return i
+
     def compute_observability(self, max_airmass=MAX_AIRMASS,
                               time_block_size=TIME_BLOCK_SIZE):
         """For each field_id, use the number of nighttime blocks above max_airmass to compute observability time."""
@@ -107,21 +310,103 @@ class Fields(object):
         observable_hours.name = 'observable_hours'
         self.observable_hours = observable_hours
 
+    def _alt_az_arrays(self, time, rows=None):
+        """Altitude & Azimuth arrays (degrees) at a given time for all fields,
+        or for rows (index array or boolean mask into field_grid)."""
+
+        if self.altaz_table is not None:
+            return self._lookup_altaz(time.mjd, columns=rows)
+
+        if get_coordinate_backend() == 'fast':
+            ra = self.field_grid['ra'].values
+            dec = self.field_grid['dec'].values
+            if rows is not None:
+                ra = ra[rows]
+                dec = dec[rows]
+            return altaz_deg(ra, dec, time.mjd)
+
+        if rows is None:
+            field_coords = self.field_coords
+        else:
+            field_coords = self.field_coords[rows]
+        fieldsAltAz = field_coords.transform_to(
+            coord.AltAz(obstime=time, location=self.loc))
+        return fieldsAltAz.alt.degree, fieldsAltAz.az.degree
+
     def alt_az(self, time, cuts=None):
         """return Altitude & Azimuth by field at a given time"""
 
         if cuts is None:
-            index = self.fields.index
-            fieldsAltAz = self.field_coords.transform_to(
-                coord.AltAz(obstime=time, location=self.loc))
+            index = self.field_grid.index
+            alt, az = self._alt_az_arrays(time)
         else:
-            # warning: specifying cuts makes this much slower
-            index = self.fields[cuts].index
-            fieldsAltAz = self._field_coords(cuts=cuts).transform_to(
-                coord.AltAz(obstime=time, location=self.loc))
+            index = self.field_grid[cuts].index
+            alt, az = self._alt_az_arrays(time, rows=np.asarray(cuts))
+
+        return pd.DataFrame({'alt': alt, 'az': az}, index=index)
+
+    def overhead_arrays(self, current_state, rows=None):
+        """Calculate overhead time in seconds from current position,
+        plus current altitude and azimuth, as arrays.
+
+        rows is an optional index array or boolean mask into field_grid
+        (see field_rows); by default all fields are computed."""
+        # TODO: think about partitioning this. dome slew is the only
+        # time-dependent value
+        # TODO: is block-sized discretization accurate enough?
+        # TODO: figure out appropriate treatment of dome at zenith
 
-        return pd.DataFrame({'alt': fieldsAltAz.alt, 'az': fieldsAltAz.az},
-                            index=index)
+        alt, az = self._alt_az_arrays(current_state['current_time'],
+                                      rows=rows)
+        ra = self.field_grid['ra'].values
+        if rows is not None:
+            ra = ra[rows]
+
+        overhead = np.full(len(alt), READOUT_TIME.to(u.second).value)
+        overhead = np.maximum(overhead, self.slew_model.slew_time(
+            'dome', axis_separation(
+                az, current_state['current_domeaz'].to(u.deg).value)))
+        # convert to RA for ease of subtraction
+        current_ra = HA_to_RA(current_state['current_ha'],
+                              current_state['current_time']).degree
+        overhead = np.maximum(overhead, self.slew_model.slew_time(
+            'ha', axis_separation(ra, current_ra)))
+        overhead = np.maximum(overhead, self._dec_slew_times(
+            current_state['current_dec'].to(u.deg).value, rows=rows))
+
+        return overhead, alt, az
+
+    def _dec_slew_times(self, current_dec, rows=None):
+        """Dec axis slew times in seconds from current_dec (degrees) to the
+        fields.
+
+        Field grids are laid out in rings of constant dec, so slew times
+        between all pairs of distinct field decs are computed once and
+        cached."""
+
+        if self._dec_slew is None:
+            decs, dec_index = np.unique(self.field_grid['dec'].values,
+                                        return_inverse=True)
+            if len(decs) <= MAX_DEC_SLEW_MATRIX_SIZE:
+                matrix = self.slew_model.dec_slew_matrix(decs)
+            else:
+                matrix = None
+            self._dec_slew = {'decs': decs, 'dec_index': dec_index,
+                              'matrix': matrix}
+
+        decs = self._dec_slew['decs']
+        dec_index = self._dec_slew['dec_index']
+        if rows is not None:
+            dec_index = dec_index[rows]
+
+        # after the first slew the telescope is at a field dec
+        i = np.searchsorted(decs, current_dec)
+        if ((self._dec_slew['matrix'] is not None) and (i < len(decs)) and
+                (decs[i] == current_dec)):
+            return self._dec_slew['matrix'][i][dec_index]
+        else:
+            return self.slew_model.slew_time(
+                'dec', np.abs(decs[dec_index] - current_dec))
 
     def overhead_time(self, current_state, cuts=None):
         """Calculate overhead time in seconds from current position.
@@ -129,39 +414,17 @@ class Fields(object):
 
         cuts is a boolean series indexed by field_id, as generated by
         select_fields """
-        # TODO: think about partitioning this. dome slew is the only
-        # time-dependent value
-        # TODO: is block-sized discretization accurate enough?
-        # TODO: figure out appropriate treatment of dome at zenith
 
         if cuts is None:
-            fields = self.fields
+            index = self.field_grid.index
+            overhead, alt, az = self.overhead_arrays(current_state)
         else:
-            fields = self.fields[cuts]
-
-        df_altaz = self.alt_az(current_state['current_time'], cuts=cuts)
-        df = fields.join(df_altaz)
-
-        slews_by_axis = {'readout': READOUT_TIME}
-        for axis in ['dome', 'dec', 'ha']:
-            if axis == 'dome':
-                current_coord = current_state['current_domeaz'].value
-            if axis == 'ha':
-                # convert to RA for ease of subtraction
-                current_coord = HA_to_RA(current_state['current_ha'],
-                                         current_state['current_time']).degree
-            if axis == 'dec':
-                current_coord = current_state['current_dec'].value
-            coord = P48_slew_pars[axis]['coord']
-            dangle = np.abs(df[coord] - current_coord)
-            angle = np.where(dangle < (360. - dangle), dangle, 360. - dangle)
-            slews_by_axis[axis] = slew_time(axis, angle * u.deg)
-
-        dfslews = pd.DataFrame(slews_by_axis, index=df.index)
-
-        dfmax = dfslews.max(axis=1)
-        dfmax = pd.DataFrame(dfmax)
-        dfmax.columns = ['overhead_time']
+            index = self.field_grid[cuts].index
+            overhead, alt, az = self.overhead_arrays(current_state,
+                                                     rows=np.asarray(cuts))
+
+        dfmax = pd.DataFrame({'overhead_time': overhead}, index=index)
+        df_altaz = pd.DataFrame({'alt': alt, 'az': az}, index=index)
 
         return dfmax, df_altaz
 
@@ -189,14 +452,14 @@ class Fields(object):
         Returns a boolean array indexed by field_id."""
 
         # start with a boolean True series:
-        cuts = (self.fields['ra'] == self.fields['ra'])
+        cuts = (self.field_grid['ra'] == self.field_grid['ra'])
 
         if observable_hours_range is not None:
             # check that we've computed observable_hours
             assert(self.observable_hours is not None)
-            fields = self.fields.join(self.observable_hours)
+            fields = self.field_grid.join(self.observable_hours)
         else:
-            fields = self.fields
+            fields = self.field_grid
 
         range_keys = ['ra', 'dec', 'l', 'b', 'ecliptic_lon', 'ecliptic_lat',
                       'observable_hours']
@@ -224,26 +487,24 @@ class Fields(object):
         # n_obs and last_observed require special treatment,
         # since we have to specify the program_id and filter_id
 
-        pf_keys = ['n_obs', 'last_observed']
+        pf_states = [self.n_obs, self.last_observed]
 
         for i, arg in enumerate([n_obs_range, last_observed_range]):
             if arg is not None:
                 assert ((program_id is not None) and (filter_id is not None))
+                pi, fi = self.program_filter_index(program_id, filter_id)
+                # (fields, programs * filters)
+                values = pf_states[i][:, pi, :][:, :, fi].reshape(
+                    len(self.field_grid), -1)
                 if (scalar_len(program_id) == 1) and (scalar_len(filter_id) == 1):
-                    key = '{}_{}_{}'.format(pf_keys[i], program_id, filter_id)
-                    cuts = cuts & (fields[key] >= arg[0]) & \
-                        (fields[key] <= arg[1])
+                    cuts = cuts & (values[:, 0] >= arg[0]) & \
+                        (values[:, 0] <= arg[1])
                 else:
                     # combined selections across several filters
                     # and/or programs
                     assert len(reducefunc) == 2
-                    # build the keys
-                    keys = []
-                    for pi in np.atleast_1d(program_id):
-                        for fi in np.atleast_1d(filter_id):
-                            keys.append('{}_{}_{}'.format(pf_keys[i], pi, fi))
-                    mincomp = fields[keys].apply(reducefunc[0], axis=1)
-                    maxcomp = fields[keys].apply(reducefunc[1], axis=1)
+                    mincomp = reducefunc[0](values, axis=1)
+                    maxcomp = reducefunc[1](values, axis=1)
                     cuts = cuts & (mincomp >= arg[0]) & \
                         (maxcomp <= arg[1])
 
@@ -252,49 +513,51 @@ class Fields(object):
     def select_field_ids(self, **kwargs):
         """Returns a pandas index"""
         cuts = self.select_fields(**kwargs)
-        return self.fields[cuts].index
+        return self.field_grid[cuts].index
 
     def mark_field_observed(self, request, current_state):
         """Update time last observed and number of observations for a single field"""
 
-        field_id = request['target_field_id']
-        program_id = request['target_program_id']
-        filter_id = request['target_filter_id']
+        row = self._field_rows[request['target_field_id']]
+        pi = self._program_index[request['target_program_id']]
+        fi = self._filter_index[request['target_filter_id']]
         time_obs = current_state['current_time'] - EXPOSURE_TIME
 
-        # need this syntax to avoid setting on a copy
-        self.fields.loc[field_id,
-                        'last_observed_{}_{}'.format(program_id, filter_id)] = time_obs.mjd
+        self.last_observed[row, pi, fi] = time_obs.mjd
+
+        if np.isnan(self.first_obs_tonight[row, pi, fi]):
+            self.first_obs_tonight[row, pi, fi] = time_obs.mjd
 
-        if np.isnan(self.fields.loc[field_id,
-                                    'first_obs_tonight_{}_{}'.format(
-                                        program_id, filter_id)]):
-            self.fields.loc[field_id,
-                            'first_obs_tonight_{}_{}'.format(
-                                program_id, filter_id)] = time_obs.mjd
+        self.n_obs[row, pi, fi] += 1
 
-        self.fields.loc[field_id,
-                        'n_obs_{}_{}'.format(program_id, filter_id)] += 1
+        self._fields_view = None
 
     def count_total_obs_by_program(self):
         """Sum total number of exposures by program id"""
 
         count = defaultdict(int)
         for program_id in PROGRAM_IDS:
-            cols = ['n_obs_{}_{}'.format(program_id, filter_id)
-                    for filter_id in FILTER_IDS]
-            for col in cols:
-                count[program_id] += self.fields[col].sum()
+            pi = self._program_index[program_id]
+            count[program_id] += self.n_obs[:, pi, :].sum()
 
         return count
 
     def clear_first_obs(self):
         """Reset the time of the nightly first observations."""
 
-        for program_id in PROGRAM_IDS:
-            for filter_id in FILTER_IDS:
-                self.fields.loc[:, 'first_obs_tonight_{}_{}'.format(
-                    program_id, filter_id)] = np.nan
+        self.first_obs_tonight.fill(np.nan)
+        self._fields_view = None
+
+
+def _id_index(all_ids, sorter, ids):
+    """Positions in all_ids of each of ids, where sorter sorts all_ids.
+    Raises KeyError if any of ids is not in all_ids."""
+    ids = np.atleast_1d(ids)
+    i = sorter[np.clip(np.searchsorted(all_ids, ids, sorter=sorter), 0,
+                       len(all_ids) - 1)]
+    if np.sum(all_ids[i] != ids):
+        raise KeyError('Unknown ids')
+    return i
 
 
 def generate_test_field_grid(filename='../data/ZTF_fields.txt',
@@ -314,3 +577,67 @@ def generate_test_field_grid(filename='../data/ZTF_fields.txt',
 
     df_write_to_sqlite(df[['ra', 'dec', 'l', 'b', 'ecliptic_lon', 'ecliptic_lat',
                            'grid_id']], dbname, index_label='field_id')
+
+
+def generate_tessellated_field_grid(n_fields, n_grids=1, min_dec=-30.,
+                                    dbname=None):
+    """Tessellate the sky north of min_dec with about n_fields fields.
+
+    Fields are laid out in rings of constant dec, spaced so that each field
+    covers about the same area.  Each additional offset grid is shifted by
+    a fraction of the field spacing in ra and dec and labeled with its
+    grid_id; field_ids of grid k start at k * (a power of ten larger than
+    the grid size), as the ZTF secondary grid starts at 1000.
+
+    Returns a DataFrame with the columns of generate_test_field_grid and
+    writes it to ../data/{dbname}.db if dbname is given."""
+
+    sin_min = np.sin(np.radians(min_dec))
+    area = 2. * np.pi * (1. - sin_min) * np.degrees(1.)**2
+    spacing = np.sqrt(area / n_fields)
+    id_offset = 10**int(np.ceil(np.log10(n_fields * 1.1 + 1)))
+
+    ras = []
+    decs = []
+    field_ids = []
+    grid_ids = []
+    for grid_id in range(n_grids):
+        shift = grid_id / float(n_grids)
+        ring_decs = min_dec + (np.arange(np.ceil((90. - min_dec) / spacing))
+                               + 0.5 + shift) * spacing
+        ring_decs = ring_decs[ring_decs < 90.]
+        grid_ra = []
+        grid_dec = []
+        for dec in ring_decs:
+            n_ra = max(int(np.round(360. * np.cos(np.radians(dec)) /
+                                    spacing)), 1)
+            grid_ra.append((np.arange(n_ra) + 0.5 + shift) * 360. / n_ra)
+            grid_dec.append(np.full(n_ra, dec))
+        grid_ra = np.concatenate(grid_ra)
+        ras.append(grid_ra)
+        decs.append(np.concatenate(grid_dec))
+        field_ids.append(grid_id * id_offset + np.arange(len(grid_ra)) + 1)
+        grid_ids.append(np.full(len(grid_ra), grid_id, dtype=np.int8))
+
+    ra = np.concatenate(ras)
+    dec = np.concatenate(decs)
+
+    sc = coord.SkyCoord(ra * u.deg, dec * u.deg)
+    galactic = sc.galactic
+    ecliptic = sc.barycentrictrueecliptic
+
+    df = pd.DataFrame({'ra': ra, 'dec': dec,
+                       'l': galactic.l.to(u.deg).value,
+                       'b': galactic.b.to(u.deg).value,
+                       'ecliptic_lon': ecliptic.lon.to(u.deg).value,
+                       'ecliptic_lat': ecliptic.lat.to(u.deg).value,
+                       'grid_id': np.concatenate(grid_ids)},
+                      index=pd.Index(np.concatenate(field_ids),
+                                     name='field_id'))
+    df = df[['ra', 'dec', 'l', 'b', 'ecliptic_lon', 'ecliptic_lat',
+             'grid_id']]
+
+    if dbname is not None:
+        df_write_to_sqlite(df, dbname, index_label='field_id')
+
+    return df
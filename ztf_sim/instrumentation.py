@@ -0,0 +1,148 @@
+"""Low-overhead timers and counters for the simulator hot paths.
+
+Timings accumulate in the module-level RunProfile RUN_PROFILE, which
+observe() resets at the start of each run and writes to
+../sims/{run_name}_profile.json at the end.  Use the timed decorator or
+the timer context manager to time a code path, and count() for events.
+
+Timed sections may nest.  Each timer records both its total (inclusive)
+time and its self (exclusive) time, which leaves out the time spent in
+timed sections nested inside it; only the self times add up to at most
+the wall time."""
+
+import json
+import functools
+from contextlib import contextmanager
+from collections import defaultdict
+from timeit import default_timer as clock
+
+
+class RunProfile(object):
+    """Named timers and counters, totalled for the run and for each
+    night."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.start_wall = clock()
+        self.timers = defaultdict(float)
+        self.self_timers = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.nights = []
+        self._night = None
+        # time spent in nested timed sections, one entry per open section
+        self._child_time = []
+
+    def start_night(self, night_mjd):
+        """Start attributing timers and counters to a new night."""
+        self._end_night()
+        self._night = {'night_mjd': night_mjd, 'start_wall': clock(),
+                       'timers': defaultdict(float),
+                       'self_timers': defaultdict(float),
+                       'counters': defaultdict(int)}
+
+    def _end_night(self):
+        if self._night is not None:
+            night = self._night
+            self.nights.append(
+                {'night_mjd': night['night_mjd'],
+                 'wall_time_s': clock() - night['start_wall'],
+                 'timers': dict(night['timers']),
+                 'self_timers': dict(night['self_timers']),
+                 'counters': dict(night['counters'])})
+            self._night = None
+
+    def start_timer(self):
+        """Open a timed section and return its start time."""
+        self._child_time.append(0.)
+        return clock()
+
+    def stop_timer(self, name, start):
+        """Close the innermost timed section, started at start, and
+        accumulate its time under name."""
+        seconds = clock() - start
+        self_seconds = seconds - self._child_time.pop()
+        if len(self._child_time):
+            self._child_time[-1] += seconds
+        self.add_time(name, seconds, self_seconds=self_seconds)
+
+    def add_time(self, name, seconds, self_seconds=None):
+        """Accumulate seconds under name.  self_seconds defaults to
+        seconds, i.e., no nested timed sections."""
+        if self_seconds is None:
+            self_seconds = seconds
+        self.timers[name] += seconds
+        self.self_timers[name] += self_seconds
+        self.calls[name] += 1
+        if self._night is not None:
+            self._night['timers'][name] += seconds
+            self._night['self_timers'][name] += self_seconds
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+        if self._night is not None:
+            self._night['counters'][name] += n
+
+    def summary(self, simulated_days=None):
+        """Return the profile as a dictionary."""
+
+        self._end_night()
+        wall_time = clock() - self.start_wall
+
+        profile = {'wall_time_s': wall_time,
+                   'timers': {}, 'counters': dict(self.counters),
+                   'nights': self.nights}
+        for name, total in self.timers.items():
+            self_total = self.self_timers[name]
+            profile['timers'][name] = {
+                'total_s': total, 'self_s': self_total,
+                'calls': self.calls[name],
+                'mean_ms': total / self.calls[name] * 1000.,
+                'fraction_of_wall_time': self_total / wall_time}
+
+        if simulated_days is not None:
+            profile['simulated_days'] = simulated_days
+            profile['simulated_nights_per_wall_hour'] = \
+                simulated_days / (wall_time / 3600.)
+
+        return profile
+
+    def write(self, filename, simulated_days=None):
+        """Write the profile to a JSON file."""
+        with open(filename, 'w') as f:
+            json.dump(self.summary(simulated_days=simulated_days), f,
+                      indent=2, sort_keys=True)
+
+
+RUN_PROFILE = RunProfile()
+
+
+def timed(name):
+    """Decorator accumulating the run time of a function under name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = RUN_PROFILE.start_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                RUN_PROFILE.stop_timer(name, start)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def timer(name):
+    """Context manager accumulating the run time of a block under name."""
+    start = RUN_PROFILE.start_timer()
+    try:
+        yield
+    finally:
+        RUN_PROFILE.stop_timer(name, start)
+
+
+def count(name, n=1):
+    """Increment the counter name."""
+    RUN_PROFILE.count(name, n=n)
@@ -1,36 +1,119 @@
-
 import numpy as np
-from scipy.interpolate import interp1d
 from constants import *
 
+# filter_id * R20_TABLE_STRIDE + altitude is the abscissa of the combined
+# R20 vs. altitude table, so one np.interp call handles all filters
+R20_TABLE_STRIDE = 1000.
+
 
-def interp_R20_airmass(filter_id=2):
-    """Returns function to interpolate electrons/sec of a 20th mag source as a function of altitude."""
+def load_R20_altitude(filter_id=2):
+    """Altitude (degrees) and electrons/sec of a 20th mag source, with
+    absorption and the aperture cut, from ../data/R20_absorbed_ZTF{f}.txt"""
     R20_file = '../data/R20_absorbed_ZTF{}.txt'.format(
         FILTER_ID_TO_NAME[filter_id])
     data = np.loadtxt(R20_file)
-    alt = data[:, 0]
-    R20 = data[:, 1]
-    return interp1d(alt, R20)
+    return data[:, 0], data[:, 1]
+
+
+class LimitingMagKernel(object):
+    """Limiting magnitude and R20 for arrays of filter_id, altitude,
+    seeing, and sky brightness.
+
+    Holds the R20 vs. altitude tables of all filters as one table,
+    interpolated with np.interp, and the zenith R20 by filter_id used for
+    the sky background."""
+
+    def __init__(self, filter_ids=FILTER_IDS):
+
+        filter_ids = sorted(filter_ids)
+        x = []
+        R20 = []
+        self.min_altitude = -np.inf
+        self.max_altitude = np.inf
+        # NaN for filter_ids without tables
+        self.R20_zenith = np.full(max(filter_ids) + 1, np.nan)
+        for filter_id in filter_ids:
+            alt, R20_alt = load_R20_altitude(filter_id=filter_id)
+            x.append(filter_id * R20_TABLE_STRIDE + alt)
+            R20.append(R20_alt)
+            self.min_altitude = max(self.min_altitude, alt[0])
+            self.max_altitude = min(self.max_altitude, alt[-1])
+            self.R20_zenith[filter_id] = np.interp(90., alt, R20_alt)
+        self.x = np.concatenate(x)
+        self.R20 = np.concatenate(R20)
+
+    def _check_filters(self, filter_id):
+        try:
+            R20_zenith = self.R20_zenith[filter_id]
+        except IndexError:
+            raise NotImplementedError
+        if np.isnan(np.sum(R20_zenith)):
+            raise NotImplementedError
+        return R20_zenith
+
+    def R20_altitude(self, filter_id, altitude):
+        """Electrons/sec of a 20th mag source, with absorption and the
+        aperture cut."""
+        if (np.min(altitude) < self.min_altitude) or \
+                (np.max(altitude) > self.max_altitude):
+            raise ValueError('Altitude outside of the R20 tables')
+        return np.interp(filter_id * R20_TABLE_STRIDE + altitude,
+                         self.x, self.R20)
+
+    def limiting_mag(self, exposure_time, seeing_fwhm, sky_brightness,
+                     filter_id, altitude, SNR=5.):
+        """Sky limited magnitude at signal to noise SNR, as an array.
+
+        exposure_time : seconds; seeing_fwhm : arcsec;
+        sky_brightness : mag per square arcsec; altitude : degrees"""
+
+        filter_id = np.asarray(filter_id)
+        altitude = np.asarray(altitude, dtype=float)
+        R20_sky = self._check_filters(filter_id)
+        R20 = self.R20_altitude(filter_id, altitude)
+
+        # with npix from n_pixels and Rsky from sky_electrons_per_pixel,
+        # Rstar = sqrt(SNR**2 * npix * Rsky / exposure_time) and
+        # limiting_mag = 20 - 2.5 log10(Rstar / R20)
+        npix = np.maximum(np.round(np.pi * (0.673 * np.asarray(seeing_fwhm) /
+                                            PIXEL_SCALE)**2.), 1.)
+        sky = np.asarray(sky_brightness, dtype=float)
+        const = 20. - 1.25 * np.log10(SNR**2 / exposure_time *
+                                      PIXEL_SCALE**2 * 10.**8)
+        return const + 0.5 * sky + \
+            1.25 * np.log10(R20 * R20 / (npix * R20_sky))
+
+
+_LIMITING_MAG_KERNEL = None
 
-R20_interp_alt = {1: interp_R20_airmass(filter_id=1),
-                  2: interp_R20_airmass(filter_id=2)}
+
+def get_limiting_mag_kernel():
+    """LimitingMagKernel for FILTER_IDS, reading the R20 tables on first
+    use."""
+    global _LIMITING_MAG_KERNEL
+    if _LIMITING_MAG_KERNEL is None:
+        _LIMITING_MAG_KERNEL = LimitingMagKernel()
+    return _LIMITING_MAG_KERNEL
+
+
+def _values(x, unit=None):
+    """Array or scalar from a Quantity (in unit), Series, array, or
+    scalar."""
+    if isinstance(x, u.Quantity):
+        return x.to(unit).value
+    return getattr(x, 'values', x)
 
 
 def limiting_mag(exposure_time, seeing_fwhm, sky_brightness,
                  filter_id=2, altitude=90., SNR=5.):
-    """Calculate limiting magnitude."""
+    """Calculate limiting magnitude.
 
-    npix = n_pixels(seeing_fwhm)
-    Rsky = sky_electrons_per_pixel(sky_brightness, filter_id=filter_id)
+    Inputs may be scalars, arrays, or Series; returns an array."""
 
-    # sky limited case:
-    Rstar = np.sqrt(SNR**2. * npix * Rsky / exposure_time)
-    # TODO: decide if treatment of non-sky limited case is needed
-
-    R20 = Rstar20(filter_id=filter_id, altitude=altitude,
-                  aperture_cut=True, absorb=True)
-    return 20. - 2.5 * np.log10(Rstar / R20)
+    return get_limiting_mag_kernel().limiting_mag(
+        _values(exposure_time, u.second), _values(seeing_fwhm, u.arcsec),
+        _values(sky_brightness), _values(filter_id),
+        _values(altitude, u.deg), SNR=SNR)
 
 
 def Rstar20(filter_id=2, altitude=90.,
@@ -55,12 +138,9 @@ def Rstar20(filter_id=2, altitude=90.,
             raise NotImplementedError
 
     elif aperture_cut and absorb:
-        w1 = filter_id == 1
-        R20[w1] = R20_interp_alt[1](altitude[w1])
-        w2 = filter_id == 2
-        R20[w2] = R20_interp_alt[2](altitude[w2])
-        if np.sum(w1) + np.sum(w2) != len(R20):
-            raise NotImplementedError
+        kernel = get_limiting_mag_kernel()
+        kernel._check_filters(filter_id)
+        R20[:] = kernel.R20_altitude(filter_id, altitude)
     else:
         raise NotImplementedError
 
@@ -94,7 +174,7 @@ def n_pixels(seeing_fwhm):
     npix_extract = np.atleast_1d(np.round(npix_extract))
 
     w = npix_extract < 1.
-    npix_extract[w] == 1
+    npix_extract[w] = 1
 
     return npix_extract
 
@@ -1,11 +1,19 @@
-from ZTFStateMachine import ZTFStateMachine
+import json
+from ZTFStateMachine import ZTFStateMachine, PTFObservabilityDB
 import astropy.coordinates as coord
 from astropy.time import Time
 import astropy.units as u
 from QueueManager import GreedyQueueManager, QueueEmptyError
+from sky_brightness import SkyBrightness, SkyBrightnessTable, \
+    SkyBrightnessTrees, SKY_TABLE_MAX_ERROR
 from ObsLogger import ObsLogger
+from fields import Fields
+from slew import SlewModel
+from ephemeris import Ephemeris, SurveyCalendar
 from config import ZTFConfiguration
 from constants import *
+from utils import set_coordinate_backend
+from instrumentation import RUN_PROFILE, timer, count
 
 # check aggressively for setting with copy
 import pandas as pd
@@ -14,7 +22,82 @@ pd.options.mode.chained_assignment = 'raise'  # default='warn'
 # TODO: tag database with commit hash
 
 
-def observe(config_file, profile=False, raise_queue_empty=True):
+def build_shared_objects(config):
+    """Build the objects a run only reads: the field grid (and its
+    alt/az table and slew model), the sky brightness model, the
+    historical weather (if a weather_year is configured), and the optional
+    ephemeris and twilight calendar.
+
+    Runs with the same start time, duration, and field grid options (e.g.,
+    different weather years) can share them; see sweep.py."""
+
+    survey_start_time = Time(config['start_time'], scale='utc',
+                             location=P48_loc)
+    survey_stop_time = survey_start_time + \
+        config['survey_duration_days'] * u.day
+
+    shared = {}
+    shared['fields'] = Fields(
+        lst_table=config.get('lst_altaz_table', False),
+        lst_epoch=survey_start_time + (survey_stop_time -
+                                       survey_start_time) / 2.,
+        slew_model=SlewModel(config.get('slew_parameters', 'requirement')))
+    sky_brightness_model = config.get('sky_brightness_model', 'xgboost')
+    if sky_brightness_model == 'table':
+        shared['sky'] = SkyBrightnessTable(max_error=config.get(
+            'sky_table_max_error', SKY_TABLE_MAX_ERROR))
+    elif sky_brightness_model == 'trees':
+        shared['sky'] = SkyBrightnessTrees()
+    else:
+        shared['sky'] = SkyBrightness()
+    if config.get('weather_year', None) in [None, 'None']:
+        shared['observability'] = None
+    else:
+        shared['observability'] = PTFObservabilityDB()
+
+    if config.get('precompute_ephemeris', False):
+        shared['ephemeris'] = Ephemeris(survey_start_time, survey_stop_time)
+    else:
+        shared['ephemeris'] = None
+
+    if config.get('precompute_calendar', False):
+        shared['calendar'] = SurveyCalendar(survey_start_time,
+                                            survey_stop_time)
+    else:
+        shared['calendar'] = None
+
+    return shared
+
+
+def wait_for_next_event(tel, Q, event_driven=True):
+    """Advance the clock after an unsuccessful observation attempt.
+
+    If event_driven, jump to the next time the queue can change (see
+    QueueManager.next_event_time); otherwise wait one exposure time."""
+
+    count('waits')
+    if event_driven:
+        next_time = Q.next_event_time(tel.current_state_dict())
+        if next_time.mjd > tel.current_mjd:
+            tel.logger.info('Fast forwarding to next queue event: {}'.format(
+                next_time.iso))
+            tel.wait((next_time.mjd - tel.current_mjd) * u.day)
+            return
+    tel.wait()
+
+
+def observe(config_file, profile=False, raise_queue_empty=True,
+            shared=None):
+    """Run the simulation described by config_file (in ../sims).
+
+    shared : dictionary of prebuilt objects (see build_shared_objects).
+        Fields state is modified during the run, so only share objects
+        between separate processes.
+
+    Returns the number of exposures taken.  Writes timings of the main
+    code paths to ../sims/{run_name}_profile.json (see instrumentation.py)."""
+
+    RUN_PROFILE.reset()
 
     if profile:
         try:
@@ -33,7 +116,21 @@ def observe(config_file, profile=False, raise_queue_empty=True):
         weather_year = None
     survey_duration = ztf_config.config['survey_duration_days'] * u.day
     block_programs = ztf_config.config['block_programs']
-    observing_programs = ztf_config.build_observing_programs()
+    random_seed = ztf_config.config.get('random_seed', None)
+    if random_seed is not None:
+        np.random.seed(random_seed)
+    coordinate_backend = ztf_config.config.get('coordinate_backend',
+                                               'astropy')
+    event_driven_clock = ztf_config.config.get('event_driven_clock', False)
+    set_coordinate_backend(coordinate_backend)
+
+    if shared is None:
+        shared = build_shared_objects(ztf_config.config)
+    fields = shared['fields']
+    ephemeris = shared['ephemeris']
+    calendar = shared['calendar']
+
+    observing_programs = ztf_config.build_observing_programs(fields=fields)
 
     if profile:
         if survey_duration > 1. * u.day:
@@ -48,10 +145,18 @@ def observe(config_file, profile=False, raise_queue_empty=True):
     tel = ZTFStateMachine(
         current_time=survey_start_time,
         historical_observability_year=weather_year,
-        logfile='../sims/{}_log.txt'.format(run_name))
+        logfile='../sims/{}_log.txt'.format(run_name),
+        ephemeris=ephemeris, calendar=calendar,
+        observability=shared['observability'],
+        slew_model=fields.slew_model,
+        state_machine=ztf_config.config.get('state_machine', 'transitions'))
 
     # set up QueueManager
-    Q = GreedyQueueManager(block_programs=block_programs)
+    Q = GreedyQueueManager(block_programs=block_programs, fields=fields,
+                           ephemeris=ephemeris, calendar=calendar,
+                           sky=shared['sky'],
+                           precompute_sky=ztf_config.config.get(
+                               'precompute_nightly_sky', False))
 
     for op in observing_programs:
         Q.add_observing_program(op)
@@ -60,77 +165,109 @@ def observe(config_file, profile=False, raise_queue_empty=True):
     Q.assign_nightly_requests(tel.current_state_dict())
 
     # initialize sqlite history
-    log = ObsLogger(run_name, tel.current_time)
+    log = ObsLogger(run_name, tel.current_time, ephemeris=ephemeris,
+                    writer=ztf_config.config.get('pointing_format', 'sqlite'),
+                    sqlite_pragmas=ztf_config.config.get('sqlite_pragmas',
+                                                         None),
+                    metadata={'config': ztf_config.config}, fields=fields)
 
-    current_night_mjd = np.floor(tel.current_time.mjd)
+    current_night_mjd = np.floor(tel.current_mjd)
+    RUN_PROFILE.start_night(current_night_mjd)
+    n_exposures = 0
+    survey_stop_mjd = (survey_start_time + survey_duration).mjd
 
-    while tel.current_time < (survey_start_time + survey_duration):
+    while tel.current_mjd < survey_stop_mjd:
 
         # check if it is a new night and reload queue with new requests
-        if np.floor(tel.current_time.mjd) > current_night_mjd:
+        if np.floor(tel.current_mjd) > current_night_mjd:
+            log.flush()
             log.prev_obs = None
+            current_night_mjd = np.floor(tel.current_mjd)
+            RUN_PROFILE.start_night(current_night_mjd)
             Q.assign_nightly_requests(tel.current_state_dict())
-            current_night_mjd = np.floor(tel.current_time.mjd)
 
-        if tel.check_if_ready():
+        with timer('state_machine'):
+            ready = tel.check_if_ready()
+        if ready:
             current_state = tel.current_state_dict()
             # get coords
             try:
                 next_obs = Q.next_obs(current_state)
                 # TODO: debugging check...
-                assert(next_obs['request_id'] in Q.queue.index)
+                assert(Q.in_queue(next_obs['request_id']))
             except QueueEmptyError:
+                count('queue_empty')
                 if not raise_queue_empty:
                     tel.logger.info("Queue empty!  Waiting...")
                     log.prev_obs = None
-                    tel.wait()
+                    wait_for_next_event(tel, Q, event_driven_clock)
                     continue
                 else:
                     raise QueueEmptyError("Queue is empty")
 
             # try to change filters, if needed
             if next_obs['target_filter_id'] != current_state['current_filter_id']:
-                if not tel.start_filter_change(next_obs['target_filter_id']):
+                with timer('state_machine'):
+                    changed = tel.start_filter_change(
+                        next_obs['target_filter_id'])
+                if not changed:
+                    count('filter_change_failures')
                     tel.logger.info("Filter change failure!  Waiting...")
                     log.prev_obs = None
-                    tel.wait()
+                    wait_for_next_event(tel, Q, event_driven_clock)
                     continue
 
             # try to slew to the next target
-            if not tel.start_slew(coord.SkyCoord(next_obs['target_ra'] * u.deg,
-                                                 next_obs['target_dec'] * u.deg)):
+            with timer('state_machine'):
+                slewed = tel.start_slew(coord.SkyCoord(
+                    next_obs['target_ra'] * u.deg,
+                    next_obs['target_dec'] * u.deg))
+            if not slewed:
+                count('slew_failures')
                 tel.set_cant_observe()
                 # TODO: log the failure
                 # "missed history": http://ops2.lsst.org/docs/current/architecture.html#output-tables
                 tel.logger.info("Failure slewing to {}, {}!  Waiting...".format
                                 (next_obs['target_ra'] * u.deg, next_obs['target_dec'] * u.deg))
                 log.prev_obs = None
-                tel.wait()
+                wait_for_next_event(tel, Q, event_driven_clock)
                 continue
 
             # try to expose
-            if not tel.start_exposing():
+            with timer('state_machine'):
+                exposed = tel.start_exposing()
+            if not exposed:
+                count('exposure_failures')
                 tel.set_cant_observe()
                 tel.logger.info("Exposure failure!  Waiting...")
                 log.prev_obs = None
-                tel.wait()
+                wait_for_next_event(tel, Q, event_driven_clock)
                 continue
             else:
                 # exposure completed successfully.  now
                 # a) store exposure information in pointing history sqlite db
                 current_state = tel.current_state_dict()
                 log.log_pointing(current_state, next_obs)
+                n_exposures += 1
+                count('exposures')
                 # b) update Fields
                 Q.fields.mark_field_observed(next_obs, current_state)
                 # c) remove completed request_id from the pool and the queue
                 # TODO: debugging check
-                assert(next_obs['request_id'] in Q.queue.index)
+                assert(Q.in_queue(next_obs['request_id']))
                 Q.remove_requests(next_obs['request_id'])
         else:
+            count('cant_observe')
             log.prev_obs = None
             tel.set_cant_observe()
             tel.wait()
 
+    log.close()
+
+    RUN_PROFILE.write('../sims/{}_profile.json'.format(run_name),
+                      simulated_days=(tel.current_mjd -
+                                      survey_start_time.mjd))
+
     if profile:
         profiler.stop()
         print profiler.output_text(unicode=True, color=True)
@@ -138,3 +275,5 @@ def observe(config_file, profile=False, raise_queue_empty=True):
             f.write(profiler.output_text())
 
     # TODO: gzip logfile
+
+    return n_exposures
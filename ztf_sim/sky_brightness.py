@@ -1,18 +1,48 @@
-import sklearn
-from sklearn import model_selection, ensemble, preprocessing, pipeline
-from sklearn import neighbors, svm, linear_model
-from sklearn_pandas import DataFrameMapper
-from sklearn.externals import joblib
-import xgboost as xgb
 import pandas as pd
 import numpy as np
+import itertools
+import hashlib
+import re
+import os
+import logging
+from utils import atomic_savez
+
+logger = logging.getLogger('ztf_sim')
+
+# model inputs, in the order of the sky_model pipelines
+SKY_MODEL_FEATURES = ['moonillf', 'moonalt', 'moon_dist', 'azimuth',
+                      'altitude', 'sunalt']
+
+# (min, max, number of points) of the SkyBrightnessTable grid for each
+# input; values outside the grid are clipped to it.  Moon altitude is
+# sampled every 5 degrees to follow the brightening at moonrise.
+SKY_TABLE_GRID = {'moonillf': (0., 1., 11),
+                  'moonalt': (-90., 90., 37),
+                  'moon_dist': (0., 180., 19),
+                  'azimuth': (0., 360., 13),
+                  'altitude': (10., 90., 9),
+                  'sunalt': (-90., -10., 9)}
+
+# SkyBrightnessTable warns if its maximum difference from the model
+# (mag/arcsec^2) exceeds this; it changes limiting magnitudes by about half
+# as much
+SKY_TABLE_MAX_ERROR = 0.1
+
+
+def load_sky_model(filter_name='r', model_dir='../data/sky_model'):
+    """Load a trained sky model pipeline (see train_sky_model).
+
+    Unpickling it imports sklearn, sklearn_pandas, and xgboost, which are
+    only needed here and in train_sky_model."""
+    from sklearn.externals import joblib
+    return joblib.load('{}/sky_model_{}.pkl'.format(model_dir, filter_name))
 
 
 class SkyBrightness(object):
 
     def __init__(self):
-        self.clf_r = joblib.load('../data/sky_model/sky_model_r.pkl')
-        self.clf_g = joblib.load('../data/sky_model/sky_model_g.pkl')
+        self.clf_r = load_sky_model('r')
+        self.clf_g = load_sky_model('g')
 
     def predict(self, df):
         """df is a dataframe with columns:
@@ -49,7 +79,330 @@ class FakeSkyBrightness(object):
         return pd.Series(y, index=df.index, name='sky_brightness')
 
 
+def multilinear_interp(axes, values, points):
+    """Interpolate a table on a regular grid.
+
+    axes : list of d increasing 1-d arrays of grid coordinates
+    values : d-dimensional array of table values on the grid
+    points : (n, d) array; coordinates outside the grid are clipped to it
+
+    Returns an array of n interpolated values."""
+
+    points = np.atleast_2d(points)
+    lower = []
+    frac = []
+    for k, axis in enumerate(axes):
+        x = np.clip(points[:, k], axis[0], axis[-1])
+        i = np.clip(np.searchsorted(axis, x, side='right') - 1,
+                    0, len(axis) - 2)
+        lower.append(i)
+        frac.append((x - axis[i]) / (axis[i + 1] - axis[i]))
+
+    flat_values = values.ravel()
+    strides = np.cumprod([1] + [len(a) for a in axes[:0:-1]])[::-1]
+    result = np.zeros(len(points))
+    # weighted sum over the 2**d corners of each grid cell
+    for corner in itertools.product([0, 1], repeat=len(axes)):
+        weight = np.ones(len(points))
+        flat_index = np.zeros(len(points), dtype=np.int64)
+        for k, c in enumerate(corner):
+            weight *= frac[k] if c else 1. - frac[k]
+            flat_index += (lower[k] + c) * strides[k]
+        result += weight * flat_values[flat_index]
+
+    return result
+
+
+class SkyBrightnessTable(object):
+    """Sky brightness interpolated from tables of the trained sky models.
+
+    Each filter's model is evaluated once on a regular grid of its inputs
+    (SKY_TABLE_GRID) and predictions are multilinear interpolations on
+    that grid, without calling sklearn or xgboost.  The tables are saved
+    next to the models, keyed by the hash of the model file and the grid,
+    along with the maximum difference from the model at random points
+    within the grid (max_error, mag/arcsec^2 by filter_id).  max_error is
+    logged when a table is loaded, and a warning is logged if it exceeds
+    the tolerance max_error.
+
+    Inputs outside the grid are clamped to its edges, e.g., fields below
+    10 degrees altitude get the sky brightness at 10 degrees.  The queue
+    only considers fields above QueueManager.MIN_QUEUE_ALTITUDE (20
+    degrees), so clamped
+    values only enter the unused parts of precomputed block tables."""
+
+    def __init__(self, grid=SKY_TABLE_GRID, model_dir='../data/sky_model',
+                 n_check=10000, max_error=SKY_TABLE_MAX_ERROR):
+
+        self.grid = grid
+        self.axes = [np.linspace(*grid[f]) for f in SKY_MODEL_FEATURES]
+        self.tables = {}
+        self.max_error = {}
+        for filter_id, filter_name in [(1, 'g'), (2, 'r')]:
+            self.tables[filter_id], self.max_error[filter_id] = \
+                self._load_table(filter_name, model_dir, n_check)
+            logger.info('Sky brightness table {}: maximum error {:.3f} '
+                        'mag/arcsec^2'.format(filter_name,
+                                              self.max_error[filter_id]))
+            if self.max_error[filter_id] > max_error:
+                logger.warning(
+                    'Sky brightness table {} differs from the model by up '
+                    'to {:.3f} mag/arcsec^2, more than the tolerance of '
+                    '{:.3f}; refine the grid or use the trees '
+                    'model'.format(filter_name, self.max_error[filter_id],
+                                   max_error))
+
+    def _load_table(self, filter_name, model_dir, n_check):
+        """Load (building if needed) the table for one filter."""
+
+        model_file = '{}/sky_model_{}.pkl'.format(model_dir, filter_name)
+        h = hashlib.md5()
+        with open(model_file, 'rb') as f:
+            h.update(f.read())
+        h.update(repr([self.grid[f] for f in SKY_MODEL_FEATURES]).encode(
+            'ascii'))
+        filename = '{}/sky_table_{}_{}.npz'.format(model_dir, filter_name,
+                                                   h.hexdigest()[:12])
+
+        if os.path.exists(filename):
+            data = np.load(filename)
+            return data['table'], float(data['max_error'])
+
+        clf = load_sky_model(filter_name, model_dir=model_dir)
+
+        shape = [len(a) for a in self.axes]
+        table = np.zeros(np.prod(shape), dtype=np.float32)
+        chunk_size = 100000
+        for start in range(0, len(table), chunk_size):
+            index = np.unravel_index(
+                np.arange(start, min(start + chunk_size, len(table))), shape)
+            df = pd.DataFrame({f: self.axes[k][index[k]]
+                               for k, f in enumerate(SKY_MODEL_FEATURES)})
+            table[start:start + len(df)] = clf.predict(df)
+        table = table.reshape(shape)
+
+        # compare to the model at random points within the grid
+        rng = np.random.RandomState(0)
+        df = pd.DataFrame({f: rng.uniform(self.grid[f][0], self.grid[f][1],
+                                          n_check)
+                           for f in SKY_MODEL_FEATURES})
+        max_error = np.max(np.abs(
+            multilinear_interp(self.axes, table,
+                               df[SKY_MODEL_FEATURES].values) -
+            clf.predict(df)))
+
+        atomic_savez(filename, table=table, max_error=max_error)
+
+        return table, max_error
+
+    def predict(self, df):
+        """Same inputs and output as SkyBrightness.predict."""
+
+        filter_ids = df['filter_id'].unique()
+        # don't have an i-band model in place yet
+        assert(np.sum(filter_ids > 2) == 0)
+
+        sky = pd.Series(np.nan, index=df.index, name='sky_brightness')
+        for filter_id, table in self.tables.items():
+            w = (df['filter_id'] == filter_id).values
+            if np.sum(w):
+                sky[w] = multilinear_interp(
+                    self.axes, table, df.loc[w, SKY_MODEL_FEATURES].values)
+
+        return sky
+
+
+# maximum difference (mag/arcsec^2) between SkyModelTrees and the model
+# pipeline, from xgboost's single precision arithmetic (see
+# check_sky_model_export)
+SKY_MODEL_EXPORT_TOLERANCE = 1e-4
+
+# node lines of an xgboost text tree dump
+SPLIT_NODE_RE = re.compile(
+    r'(\d+):\[f(\d+)<([^\]]+)\] yes=(\d+),no=(\d+),missing=(\d+)')
+LEAF_NODE_RE = re.compile(r'(\d+):leaf=([^,\s]+)')
+
+
+def export_sky_model(filter_name='r', model_dir='../data/sky_model'):
+    """Export a trained sky model pipeline (see train_sky_model) to flat
+    arrays in {model_dir}/sky_model_{filter_name}_trees.npz.
+
+    Saves the input scaler means and scales and, for every node of every
+    tree, the split feature (-1 for leaves), threshold, child node indices,
+    and leaf value, with node indices global across trees."""
+
+    clf = load_sky_model(filter_name, model_dir=model_dir)
+    mapper = clf.named_steps['featurize']
+    model = clf.named_steps['xgb']
+
+    # sklearn_pandas keeps the fitted transformers in built_features
+    features = getattr(mapper, 'built_features', None) or mapper.features
+    # (columns, transformer[, options]) for each input
+    feature_names = [f[0][0] for f in features]
+    assert(feature_names == SKY_MODEL_FEATURES)
+    mean = np.array([f[1].mean_[0] for f in features])
+    scale = np.array([f[1].scale_[0] for f in features])
+
+    if hasattr(model, 'get_booster'):
+        booster = model.get_booster()
+    else:
+        booster = model.booster()
+    base_score = getattr(model, 'base_score', None)
+    if base_score is None:
+        import json
+        config = json.loads(booster.save_config())
+        base_score = float(config['learner']['learner_model_param'][
+            'base_score'].strip('[]'))
+
+    feature = []
+    threshold = []
+    left = []
+    right = []
+    missing = []
+    value = []
+    roots = []
+    offset = 0
+    for tree in booster.get_dump():
+        roots.append(offset)
+        splits = SPLIT_NODE_RE.findall(tree)
+        leaves = LEAF_NODE_RE.findall(tree)
+        n_nodes = max(int(node[0]) for node in splits + leaves) + 1
+        # leaves (and any unused node ids) point to themselves
+        self_index = offset + np.arange(n_nodes, dtype=np.int32)
+        tree_arrays = {'feature': np.full(n_nodes, -1, dtype=np.int32),
+                       'threshold': np.zeros(n_nodes, dtype=np.float32),
+                       'left': self_index.copy(),
+                       'right': self_index.copy(),
+                       'missing': self_index.copy(),
+                       'value': np.zeros(n_nodes)}
+        for node, f, thr, yes, no, miss in splits:
+            node = int(node)
+            tree_arrays['feature'][node] = int(f)
+            tree_arrays['threshold'][node] = float(thr)
+            tree_arrays['left'][node] = offset + int(yes)
+            tree_arrays['right'][node] = offset + int(no)
+            tree_arrays['missing'][node] = offset + int(miss)
+        for node, leaf in leaves:
+            tree_arrays['value'][int(node)] = float(leaf)
+        feature.append(tree_arrays['feature'])
+        threshold.append(tree_arrays['threshold'])
+        left.append(tree_arrays['left'])
+        right.append(tree_arrays['right'])
+        missing.append(tree_arrays['missing'])
+        value.append(tree_arrays['value'])
+        offset += n_nodes
+
+    filename = '{}/sky_model_{}_trees.npz'.format(model_dir, filter_name)
+    atomic_savez(filename, mean=mean, scale=scale, base_score=base_score,
+                 feature=np.concatenate(feature),
+                 threshold=np.concatenate(threshold),
+                 left=np.concatenate(left), right=np.concatenate(right),
+                 missing=np.concatenate(missing),
+                 value=np.concatenate(value), roots=np.array(roots))
+
+    return filename
+
+
+class SkyModelTrees(object):
+    """Batched NumPy evaluation of an exported sky model (see
+    export_sky_model)."""
+
+    def __init__(self, filename):
+        data = np.load(filename)
+        for key in ['mean', 'scale', 'feature', 'threshold', 'left',
+                    'right', 'missing', 'value', 'roots']:
+            setattr(self, key, data[key])
+        self.base_score = float(data['base_score'])
+        self.max_depth = self._max_depth()
+
+    def _max_depth(self):
+        """Number of steps from the roots that reaches a leaf of every
+        tree."""
+        depth = 0
+        nodes = self.roots
+        while True:
+            internal = nodes[self.feature[nodes] >= 0]
+            if not len(internal):
+                return depth
+            nodes = np.unique(np.concatenate([self.left[internal],
+                                              self.right[internal]]))
+            depth += 1
+
+    def predict(self, X):
+        """X : (n, 6) array of inputs in SKY_MODEL_FEATURES order"""
+
+        # xgboost compares single precision inputs to the thresholds
+        X = ((np.asarray(X, dtype=float) - self.mean) /
+             self.scale).astype(np.float32)
+        rows = np.arange(len(X))[:, np.newaxis]
+        nodes = np.repeat(self.roots[np.newaxis, :], len(X), axis=0)
+
+        for _ in range(self.max_depth):
+            feature = self.feature[nodes]
+            x = X[rows, np.maximum(feature, 0)]
+            nodes = np.where(np.isnan(x), self.missing[nodes],
+                             np.where(x < self.threshold[nodes],
+                                      self.left[nodes], self.right[nodes]))
+
+        return self.base_score + self.value[nodes].sum(axis=1)
+
+
+class SkyBrightnessTrees(object):
+    """Sky brightness from the exported sky models, evaluated with NumPy
+    rather than through sklearn and xgboost.  Exports the models first if
+    needed."""
+
+    def __init__(self, model_dir='../data/sky_model'):
+        self.models = {}
+        for filter_id, filter_name in [(1, 'g'), (2, 'r')]:
+            filename = '{}/sky_model_{}_trees.npz'.format(model_dir,
+                                                         filter_name)
+            model_file = '{}/sky_model_{}.pkl'.format(model_dir, filter_name)
+            if ((not os.path.exists(filename)) or
+                    (os.path.getmtime(filename) <
+                     os.path.getmtime(model_file))):
+                export_sky_model(filter_name, model_dir=model_dir)
+            self.models[filter_id] = SkyModelTrees(filename)
+
+    def predict(self, df):
+        """Same inputs and output as SkyBrightness.predict."""
+
+        filter_ids = df['filter_id'].unique()
+        # don't have an i-band model in place yet
+        assert(np.sum(filter_ids > 2) == 0)
+
+        sky = pd.Series(np.nan, index=df.index, name='sky_brightness')
+        for filter_id, model in self.models.items():
+            w = (df['filter_id'] == filter_id).values
+            if np.sum(w):
+                sky[w] = model.predict(df.loc[w, SKY_MODEL_FEATURES].values)
+
+        return sky
+
+
+def check_sky_model_export(filter_name='r', n=10000, seed=0,
+                           model_dir='../data/sky_model'):
+    """Compare SkyModelTrees predictions to the sky model pipeline at
+    random inputs within SKY_TABLE_GRID.  Returns the maximum absolute
+    difference (mag/arcsec^2)."""
+
+    clf = load_sky_model(filter_name, model_dir=model_dir)
+    trees = SkyModelTrees(export_sky_model(filter_name, model_dir=model_dir))
+
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({f: rng.uniform(SKY_TABLE_GRID[f][0],
+                                      SKY_TABLE_GRID[f][1], n)
+                       for f in SKY_MODEL_FEATURES})
+
+    return np.max(np.abs(trees.predict(df[SKY_MODEL_FEATURES].values) -
+                         np.ravel(clf.predict(df))))
+
+
 def train_sky_model(filter_name='r', df=None):
+    from sklearn import model_selection, preprocessing, pipeline
+    from sklearn_pandas import DataFrameMapper
+    from sklearn.externals import joblib
+    import xgboost as xgb
 
     filterid_map = {'r': 2, 'g': 1}
 
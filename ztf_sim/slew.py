@@ -0,0 +1,77 @@
+"""Telescope and dome slew times from precomputed lookup tables."""
+
+import numpy as np
+import astropy.units as u
+from constants import *
+
+# named sets of slew parameters (see constants.py)
+SLEW_PARAMETERS = {'requirement': P48_slew_pars,
+                   'goal': P48_slew_pars_goal}
+
+SLEW_AXES = ['ha', 'dec', 'dome']
+
+SLEW_TABLE_SIZE = 4001
+
+# maximum interpolation error in seconds of the SLEW_TABLE_SIZE tables (see
+# SlewModel.check_accuracy)
+SLEW_TABLE_TOLERANCE_S = 1e-3
+
+
+def axis_separation(angle1, angle2):
+    """Absolute difference of two angles in degrees, the short way
+    around."""
+    dangle = np.abs(angle1 - angle2)
+    return np.where(dangle < (360. - dangle), dangle, 360. - dangle)
+
+
+class SlewModel(object):
+    """Slew time in seconds by axis as a function of angle in degrees,
+    interpolated from tables of constants.slew_time.
+
+    The tables are uniform in the square root of the angle, where the
+    trapezoidal velocity profile is piecewise linear or quadratic, so
+    linear interpolation is accurate to SLEW_TABLE_TOLERANCE_S."""
+
+    def __init__(self, slew_pars='requirement', n_table=SLEW_TABLE_SIZE):
+
+        if slew_pars in SLEW_PARAMETERS:
+            slew_pars = SLEW_PARAMETERS[slew_pars]
+        self.slew_pars = slew_pars
+
+        self.angles = np.linspace(0., np.sqrt(360.), n_table)**2
+        self.tables = {}
+        for axis in SLEW_AXES:
+            self.tables[axis] = slew_time(
+                axis, self.angles * u.deg,
+                slew_pars=slew_pars).to(u.second).value
+
+    def slew_time(self, axis, angle):
+        """Slew time in seconds for an angle (or array of angles) in
+        degrees."""
+        return np.interp(angle, self.angles, self.tables[axis])
+
+    def dec_slew_matrix(self, dec):
+        """Dec axis slew times in seconds between every pair of the
+        given decs (degrees)."""
+        dec = np.asarray(dec)
+        return self.slew_time('dec', np.abs(dec[:, np.newaxis] -
+                                            dec[np.newaxis, :]))
+
+    def check_accuracy(self, n=10000, seed=0):
+        """Compare interpolated slew times to constants.slew_time at random
+        angles.
+
+        Returns a dictionary of the maximum absolute differences in
+        seconds by axis."""
+
+        rng = np.random.RandomState(seed)
+        angles = rng.uniform(0., 360., n)
+
+        max_diff = {}
+        for axis in SLEW_AXES:
+            direct = slew_time(axis, angles * u.deg,
+                               slew_pars=self.slew_pars).to(u.second).value
+            max_diff[axis] = np.max(np.abs(self.slew_time(axis, angles) -
+                                           direct))
+
+        return max_diff
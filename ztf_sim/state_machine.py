@@ -0,0 +1,75 @@
+"""Minimal state machine with the subset of the transitions.Machine
+interface used by ZTFStateMachine."""
+
+import functools
+from collections import defaultdict
+
+# state machine implementations accepted by ZTFStateMachine
+STATE_MACHINE_BACKENDS = ['transitions', 'native']
+
+
+class MachineError(Exception):
+    """Raised when a trigger is not valid from the current state."""
+    pass
+
+
+def _listify(names):
+    if names is None:
+        return []
+    if isinstance(names, str):
+        return [names]
+    return list(names)
+
+
+class NativeMachine(object):
+    """Triggers with source states, conditions, and after callbacks,
+    attached to a model object as in transitions.Machine.
+
+    transitions : list of dictionaries with keys trigger, source (a state,
+        list of states, or '*'), dest, and optional conditions and after
+        (method names on the model, or lists of them)
+
+    As in transitions, a trigger calls the conditions and callbacks with
+    its arguments, returns False if a condition fails and True after a
+    transition, and raises MachineError if it is not valid from the
+    current state.  Callbacks may be triggers themselves."""
+
+    def __init__(self, model, states, transitions, initial):
+
+        self.model = model
+        self.states = list(states)
+        self.events = defaultdict(list)
+
+        for t in transitions:
+            if t['source'] == '*':
+                source = self.states
+            else:
+                source = _listify(t['source'])
+            self.events[t['trigger']].append(
+                {'source': source, 'dest': t['dest'],
+                 'conditions': _listify(t.get('conditions')),
+                 'after': _listify(t.get('after'))})
+
+        for trigger in self.events:
+            setattr(model, trigger, functools.partial(self._trigger,
+                                                      trigger))
+
+        self.model.state = initial
+
+    def _trigger(self, trigger, *args, **kwargs):
+
+        candidates = [t for t in self.events[trigger]
+                      if self.model.state in t['source']]
+        if not len(candidates):
+            raise MachineError("Can't trigger event {} from state {}!".format(
+                trigger, self.model.state))
+
+        for t in candidates:
+            if all(getattr(self.model, condition)(*args, **kwargs)
+                   for condition in t['conditions']):
+                self.model.state = t['dest']
+                for callback in t['after']:
+                    getattr(self.model, callback)(*args, **kwargs)
+                return True
+
+        return False
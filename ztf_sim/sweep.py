@@ -0,0 +1,244 @@
+"""Run observe() over a grid of configuration variants and random seeds,
+or over all historical weather years, using a local process pool."""
+
+import os
+import copy
+import json
+import time
+import itertools
+import traceback
+import multiprocessing
+import numpy as np
+import pandas as pd
+from observe import observe, build_shared_objects
+from utils import read_pointings
+from constants import *
+
+# objects built once in the parent process and handed to each worker by
+# the pool initializer (see run_weather_ensemble)
+_shared_objects = None
+
+
+def _set_shared_objects(shared):
+    """Pool initializer storing the shared objects in a worker."""
+    global _shared_objects
+    _shared_objects = shared
+
+
+def set_config_value(config, key, value):
+    """Set a nested configuration value in place.
+
+    key is a dotted path; integer components index lists, e.g.
+    'observing_programs.0.n_visits_per_night'."""
+
+    parts = key.split('.')
+    node = config
+    for part in parts[:-1]:
+        if isinstance(node, list):
+            part = int(part)
+        node = node[part]
+    last = parts[-1]
+    if isinstance(node, list):
+        last = int(last)
+    node[last] = value
+
+
+def expand_sweep(base_config, grid=None, seeds=None, sweep_name='sweep'):
+    """Build the configuration of every run in a sweep.
+
+    base_config : configuration dictionary
+    grid : dictionary of dotted config keys (see set_config_value) to lists
+        of values; all combinations are run
+    seeds : list of random seeds; every grid point is run with each seed
+
+    Returns a list of (run_name, config, parameters) tuples.  Each run
+    writes its output to ../sims/{sweep_name}/."""
+
+    if grid is None:
+        grid = {}
+    if seeds is None:
+        seeds = [base_config.get('random_seed', None)]
+
+    keys = sorted(grid.keys())
+    runs = []
+    for values in itertools.product(*[grid[k] for k in keys]):
+        for seed in seeds:
+            run_name = '{}/{}_{:04d}'.format(sweep_name, sweep_name,
+                                             len(runs))
+            config = copy.deepcopy(base_config)
+            for k, v in zip(keys, values):
+                set_config_value(config, k, v)
+            config['run_name'] = run_name
+            if seed is not None:
+                config['random_seed'] = seed
+            parameters = dict(zip(keys, values))
+            parameters['random_seed'] = seed
+            runs.append((run_name, config, parameters))
+
+    return runs
+
+
+def _run_one(run):
+    """Run a single simulation, capturing any failure."""
+
+    run_name, config_file, parameters = run
+
+    result = {'run_name': run_name, 'config_file': config_file}
+    result.update(parameters)
+
+    start = time.time()
+    try:
+        result['n_exposures'] = observe(config_file,
+                                        shared=_shared_objects)
+        result['status'] = 'ok'
+        result['error'] = ''
+    except Exception:
+        result['n_exposures'] = 0
+        result['status'] = 'failed'
+        result['error'] = traceback.format_exc()
+    result['wall_time_s'] = time.time() - start
+
+    return result
+
+
+def run_sweep(base_config_file, grid=None, seeds=None, n_workers=None,
+              sweep_name=None):
+    """Run observe() for every configuration of a sweep in parallel.
+
+    base_config_file : configuration file in ../sims
+    grid, seeds : see expand_sweep
+    n_workers : number of worker processes (default: number of CPUs)
+    sweep_name : name of the output directory in ../sims (default: base
+        config run_name with a _sweep suffix)
+
+    Each run gets its own process.  Failed runs are recorded in the index
+    rather than stopping the sweep.  The index of runs (parameters,
+    status, wall time, and exposure count) is written to
+    ../sims/{sweep_name}/{sweep_name}_index.csv and returned as a
+    DataFrame."""
+
+    with open('../sims/{}'.format(base_config_file), 'r') as f:
+        base_config = json.load(f)
+
+    if sweep_name is None:
+        sweep_name = '{}_sweep'.format(base_config['run_name'])
+
+    sweep_dir = '../sims/{}'.format(sweep_name)
+    if not os.path.exists(sweep_dir):
+        os.makedirs(sweep_dir)
+
+    runs = expand_sweep(base_config, grid=grid, seeds=seeds,
+                        sweep_name=sweep_name)
+    index = _run_pool(runs, n_workers=n_workers)
+    index.to_csv('{}/{}_index.csv'.format(sweep_dir, sweep_name),
+                 index=False)
+
+    return index
+
+
+def _run_pool(runs, n_workers=None, shared=None):
+    """Write the configuration of each run and run them in a process
+    pool, passing shared (see observe.build_shared_objects) to every
+    worker.  Returns a DataFrame with one row per run.
+
+    Forked workers inherit shared; with the spawn start method it is
+    pickled to each of them, which is slower but still avoids rebuilding
+    it."""
+
+    tasks = []
+    for run_name, config, parameters in runs:
+        # observe() reads configurations relative to ../sims
+        config_file = '{}.json'.format(run_name)
+        with open('../sims/{}'.format(config_file), 'w') as f:
+            json.dump(config, f, indent=4)
+        tasks.append((run_name, config_file, parameters))
+
+    # one process per run keeps the loggers and caches of runs separate
+    pool = multiprocessing.Pool(processes=n_workers, maxtasksperchild=1,
+                                initializer=_set_shared_objects,
+                                initargs=(shared,))
+    try:
+        results = list(pool.imap_unordered(_run_one, tasks))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return pd.DataFrame(results).sort_values('run_name').reset_index(
+        drop=True)
+
+
+def run_weather_ensemble(config_file, years=PTF_WEATHER_YEARS,
+                         n_workers=None, ensemble_name=None):
+    """Run one configuration under each historical PTF weather year in
+    parallel.
+
+    The field grid, sky brightness model, weather history, and any
+    precomputed ephemeris or calendar are built once in this process and
+    passed to the workers.
+
+    Writes ../sims/{ensemble_name}/{ensemble_name}_summary.csv with one row
+    per year (see summarize_run) and returns it as a DataFrame."""
+
+    with open('../sims/{}'.format(config_file), 'r') as f:
+        base_config = json.load(f)
+
+    if ensemble_name is None:
+        ensemble_name = '{}_weather'.format(base_config['run_name'])
+
+    ensemble_dir = '../sims/{}'.format(ensemble_name)
+    if not os.path.exists(ensemble_dir):
+        os.makedirs(ensemble_dir)
+
+    runs = []
+    for year in years:
+        run_name = '{}/{}_{}'.format(ensemble_name, ensemble_name, year)
+        config = copy.deepcopy(base_config)
+        config['run_name'] = run_name
+        config['weather_year'] = year
+        runs.append((run_name, config, {'weather_year': year}))
+
+    # every run needs the weather history
+    shared = build_shared_objects(runs[0][1])
+    index = _run_pool(runs, n_workers=n_workers, shared=shared)
+
+    summaries = []
+    for _, run in index.iterrows():
+        summary = {'weather_year': run['weather_year'],
+                   'status': run['status'],
+                   'wall_time_s': run['wall_time_s']}
+        if run['status'] == 'ok':
+            summary.update(summarize_run(run['run_name']))
+        summaries.append(summary)
+
+    summary = pd.DataFrame(summaries).set_index('weather_year')
+    summary.to_csv('{}/{}_summary.csv'.format(ensemble_dir, ensemble_name))
+
+    return summary
+
+
+def summarize_run(run_name):
+    """Basic statistics of the pointing history of a completed run."""
+
+    df = read_pointings(run_name, columns=['night', 'propID', 'airmass',
+                                           'visitExpTime', 'slewTime',
+                                           'fiveSigmaDepth'])
+
+    summary = {'n_exposures': len(df),
+               'n_nights_observed': len(np.unique(df['night'])),
+               'exposure_hours': df['visitExpTime'].sum() / 3600.,
+               'median_airmass': df['airmass'].median(),
+               'median_limiting_mag': df['fiveSigmaDepth'].median()}
+
+    # leave out NaNs from weather/nightly breaks
+    w = np.isfinite(df['slewTime'])
+    summary['open_shutter_fraction'] = df[w]['visitExpTime'].sum() / \
+        (df[w]['visitExpTime'].sum() + df[w]['slewTime'].sum())
+
+    for program_id in PROGRAM_IDS:
+        summary['n_exposures_{}'.format(PROGRAM_ID_TO_NAME[program_id])] = \
+            np.sum(df['propID'] == program_id)
+
+    return summary
@@ -1,13 +1,31 @@
 
+import os
+import subprocess
 import numpy as np
 import pandas as pd
 from astropy.time import Time
 import astropy.coordinates as coord
 import astropy.units as u
-import astroplan
-from sqlalchemy import create_engine
-from datetime import datetime
+from datetime import datetime, date
 from constants import *
+from fast_coords import *
+
+# backend for coordinate transformations:
+# 'astropy' (reference) or 'fast' (analytic, see fast_coords.py)
+COORDINATE_BACKENDS = ['astropy', 'fast']
+_coordinate_backend = {'name': 'astropy'}
+
+
+def set_coordinate_backend(name):
+    """Select the backend used by HA_to_RA, RA_to_HA, skycoord_to_altaz,
+    and Fields.alt_az."""
+    if name not in COORDINATE_BACKENDS:
+        raise ValueError('Unknown coordinate backend {}'.format(name))
+    _coordinate_backend['name'] = name
+
+
+def get_coordinate_backend():
+    return _coordinate_backend['name']
 
 
 def df_write_to_sqlite(df, dbname, tablename=None,
@@ -15,6 +33,7 @@ def df_write_to_sqlite(df, dbname, tablename=None,
 
     if tablename is None:
         tablename = dbname
+    from sqlalchemy import create_engine
     engine = create_engine('sqlite:///../{}/{}.db'.format(directory, dbname))
     df.to_sql(tablename, engine, if_exists='replace', **kwargs)
 
@@ -24,15 +43,37 @@ def df_read_from_sqlite(dbname, tablename=None,
 
     if tablename is None:
         tablename = dbname
+    from sqlalchemy import create_engine
     engine = create_engine('sqlite:///../{}/{}.db'.format(directory, dbname))
     df = pd.read_sql(tablename, engine, **kwargs)
 
     return df
 
 
+def atomic_save(filename, array):
+    """np.save array to filename, writing to a temporary file first so
+    concurrent readers never see a partial file."""
+    tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmpname, 'wb') as f:
+        np.save(f, array)
+    os.rename(tmpname, filename)
+
+
+def atomic_savez(filename, **arrays):
+    """np.savez arrays to filename, like atomic_save."""
+    tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmpname, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(tmpname, filename)
+
+
 def HA_to_RA(ha, time):
     """convert hour angle to ra. """
 
+    if get_coordinate_backend() == 'fast':
+        return coord.Angle(ha_to_ra_deg(coord.Angle(ha).to(u.deg).value,
+                                        time.mjd) * u.deg)
+
     if time.location is None:
         time.location = P48_loc
 
@@ -53,6 +94,10 @@ def HA_to_RA(ha, time):
 def RA_to_HA(ra, time):
     """convert ra to hour angle. """
 
+    if get_coordinate_backend() == 'fast':
+        return coord.Angle(ra_to_ha_deg(coord.Angle(ra).to(u.deg).value,
+                                        time.mjd) * u.deg)
+
     if time.location is None:
         time.location = P48_loc
 
@@ -71,21 +116,48 @@ def RA_to_HA(ra, time):
 
 
 def previous_12deg_evening_twilight(time):
-    return P48_Observer.twilight_evening_nautical(time, which='previous')
+    return get_P48_Observer().twilight_evening_nautical(time, which='previous')
 
 
 def next_12deg_evening_twilight(time):
-    return P48_Observer.twilight_evening_nautical(time, which='next')
+    return get_P48_Observer().twilight_evening_nautical(time, which='next')
 
 
 def next_12deg_morning_twilight(time):
-    return P48_Observer.twilight_morning_nautical(time, which='next')
+    return get_P48_Observer().twilight_morning_nautical(time, which='next')
 
 
 def skycoord_to_altaz(skycoord, time):
+    # the fast backend only handles fixed (ICRS) positions; solar system
+    # objects need the full astropy treatment
+    if (get_coordinate_backend() == 'fast') and \
+            (skycoord.frame.name == 'icrs'):
+        alt, az = altaz_deg(skycoord.ra.to(u.deg).value,
+                            skycoord.dec.to(u.deg).value, time.mjd)
+        return coord.SkyCoord(alt=alt * u.deg, az=az * u.deg, frame='altaz',
+                              obstime=time, location=P48_loc)
     return skycoord.transform_to(coord.AltAz(obstime=time, location=P48_loc))
 
 
+def angular_separation_deg(ra1, dec1, ra2, dec2):
+    """Great-circle distance (degrees) between positions given in degrees.
+    Uses the Vincenty formula, as astropy does."""
+
+    lon1 = np.radians(ra1)
+    lat1 = np.radians(dec1)
+    lon2 = np.radians(ra2)
+    lat2 = np.radians(dec2)
+
+    sdlon = np.sin(lon2 - lon1)
+    cdlon = np.cos(lon2 - lon1)
+    num1 = np.cos(lat2) * sdlon
+    num2 = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * cdlon
+    denominator = np.sin(lat1) * np.sin(lat2) + \
+        np.cos(lat1) * np.cos(lat2) * cdlon
+
+    return np.degrees(np.arctan2(np.hypot(num1, num2), denominator))
+
+
 def airmass_to_zenith_angle(airmass):
     return np.degrees(np.arccos(1. / airmass)) * u.deg
 
@@ -180,47 +252,78 @@ def bin_ptf_obstimes(time_block_size=TIME_BLOCK_SIZE):
     df_write_to_sqlite(nexps, 'weather_blocks')
 
 
-def block_index(time, time_block_size=TIME_BLOCK_SIZE):
-    """convert an astropy time object into a bin index for years broken up
-    in time_block_size chunks."""
+# MJD of January 1 of each year, for converting between times and block
+# indices without going through astropy
+YEAR_START_YEARS = np.arange(1950, 2101)
+YEAR_START_MJD = np.array([date(y, 1, 1).toordinal() -
+                           date(1858, 11, 17).toordinal()
+                           for y in YEAR_START_YEARS], dtype=float)
+
+
+def year_start_mjd(mjd):
+    """MJD of the start of the (UTC) year containing mjd."""
+    i = np.searchsorted(YEAR_START_MJD, mjd, side='right') - 1
+    if (np.min(i) < 0) or (np.max(i) >= len(YEAR_START_MJD) - 1):
+        raise ValueError('Time outside of the supported years')
+    return YEAR_START_MJD[i]
+
+
+def block_index_mjd(mjd, time_block_size=TIME_BLOCK_SIZE):
+    """convert an MJD (or array of MJDs) into a bin index for years broken
+    up in time_block_size chunks."""
 
-    # get the time at the start of each year
-    year = np.floor(time.decimalyear)
     # this is an annoying conversion. blow up scalars:
-    year = np.atleast_1d(year)
-    tyear = Time([datetime(y, 1, 1) for y in year.astype(np.int)])
+    mjd = np.atleast_1d(mjd)
 
     # mjd to bin
     block_size = time_block_size.to(u.min).value
     convert = (1 * u.day.to(u.min)) / block_size
 
-    return np.floor((time.mjd - tyear.mjd) * convert).astype(np.int)
+    return np.floor((mjd - year_start_mjd(mjd)) * convert).astype(int)
 
 
-def block_index_to_time(block, time_year, where='mid',
-                        time_block_size=TIME_BLOCK_SIZE):
-    """Convert a block index (or array of indicies) back into astropy Time.
+def block_index(time, time_block_size=TIME_BLOCK_SIZE):
+    """convert an astropy time object into a bin index for years broken up
+    in time_block_size chunks."""
+    return block_index_mjd(time.mjd, time_block_size=time_block_size)
+
+
+def block_index_to_mjd(block, mjd_year, where='mid',
+                       time_block_size=TIME_BLOCK_SIZE):
+    """Convert a block index (or array of indicies) back into MJD.
 
     block : integer or array of integers
-    time_year : astropy.Time
-        any time in the current year
+    mjd_year : float
+        any MJD in the current year
     where : {'start', 'mid', 'end'}
         position in block to compute the time"""
 
     assert (where in ['start', 'mid', 'end'])
 
-    # get the time at the start of the year
-    year = np.floor(time_year.decimalyear)
-    tyear = Time([datetime(np.int(year), 1, 1)])
-
     # this is an annoying conversion. blow up scalars:
-    block = np.atleast_1d(block).astype(np.float)
+    block = np.atleast_1d(block).astype(float)
 
     if where == 'mid':
         block += 0.5
     if where == 'end':
         block += 1
-    return tyear + block * time_block_size
+    return year_start_mjd(mjd_year) + \
+        block * time_block_size.to(u.day).value
+
+
+def block_index_to_time(block, time_year, where='mid',
+                        time_block_size=TIME_BLOCK_SIZE):
+    """Convert a block index (or array of indicies) back into astropy Time.
+
+    block : integer or array of integers
+    time_year : astropy.Time
+        any time in the current year
+    where : {'start', 'mid', 'end'}
+        position in block to compute the time"""
+
+    return Time(block_index_to_mjd(block, time_year.mjd, where=where,
+                                   time_block_size=time_block_size),
+                format='mjd', scale='utc')
 
 
 def nightly_blocks(time, time_block_size=TIME_BLOCK_SIZE):
@@ -323,16 +426,74 @@ def _ptf_to_sqlite():
     return df
 
 
-def export_pointings_to_surace(dbname, **kwargs):
-    """put pointing data in format Jason Surace wants for his image simulator"""
+def code_version():
+    """Return the git description of the ztf_sim checkout, or 'unknown'."""
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).strip().decode('utf-8')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def read_pointings(run_name, columns=None, nights=None, directory='../sims'):
+    """Load the Summary table of a simulation run.
+
+    Reads {run_name}.parquet if present (requires pyarrow), otherwise
+    {run_name}.db.
+
+    columns : list of Summary columns to load (default all)
+    nights : list of night numbers to load (default all)"""
+
+    parquet_file = '{}/{}.parquet'.format(directory, run_name)
+
+    if os.path.exists(parquet_file):
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(parquet_file)
+        row_groups = range(pf.num_row_groups)
+        read_columns = columns
+        if nights is not None:
+            # each row group holds a single night
+            night_index = pf.schema_arrow.get_field_index('night')
+            row_groups = [i for i in row_groups if
+                          pf.metadata.row_group(i).column(
+                              night_index).statistics.min in nights]
+            if (columns is not None) and ('night' not in columns):
+                read_columns = list(columns) + ['night']
+        df = pf.read_row_groups(row_groups, columns=read_columns).to_pandas()
+        if (read_columns is not None) and (read_columns != columns):
+            df = df[columns]
+    else:
+        from sqlalchemy import create_engine
+        engine = create_engine('sqlite:///{}/{}.db'.format(directory,
+                                                            run_name))
+        if columns is None:
+            query = 'SELECT * FROM Summary'
+        else:
+            query = 'SELECT {} FROM Summary'.format(', '.join(columns))
+        if nights is not None:
+            query += ' WHERE night IN ({})'.format(
+                ', '.join(['{:d}'.format(int(n)) for n in nights]))
+        df = pd.read_sql(query, engine)
+
+    return df
+
+
+def export_pointings_to_surace(dbname, nights=None, directory='../sims'):
+    """put pointing data in format Jason Surace wants for his image simulator
+
+    Reads the pointings of the given nights (see read_pointings) from
+    directory and writes {directory}/{dbname}.txt"""
 
-    engine = create_engine('sqlite:///../sims/{}.db'.format(dbname))
-    df = pd.read_sql('Summary', engine, **kwargs)
+    df = read_pointings(dbname, columns=['fieldRA', 'fieldDec', 'fieldID',
+                                         'filter', 'expMJD'],
+                        nights=nights, directory=directory)
 
     df['ra'] = np.degrees(df['fieldRA'])
     df['dec'] = np.degrees(df['fieldDec'])
     df['imagetype'] = 0
 
     df[['ra', 'dec', 'fieldID',
-        'filter', 'imagetype', 'expMJD']].to_csv('../sims/{}.txt'.format(
-            dbname), sep=' ', header=False, index=False)
+        'filter', 'imagetype', 'expMJD']].to_csv('{}/{}.txt'.format(
+            directory, dbname), sep=' ', header=False, index=False)